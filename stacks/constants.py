@@ -2,15 +2,40 @@ FLD_CONTEXT_SALESFORCE = "salesforce"
 FLD_CONTEXT_SALESFORCE_CONSUMER_KEY = "consumerKey"
 FLD_CONTEXT_SALESFORCE_CONSUMER_SECRET = "consumerSecret"
 FLD_CONTEXT_SCHEDULE_EXPRESSION = "scheduleExpression"
+FLD_CONTEXT_SCHEDULE_MIN_MINUTES = "scheduleMinMinutes"
+FLD_CONTEXT_SCHEDULE_MAX_MINUTES = "scheduleMaxMinutes"
+FLD_CONTEXT_CDC_EVENT_BUS = "cdcEventBusName"
+FLD_CONTEXT_FARGATE_RUNNER = "fargateRunner"
+FLD_CONTEXT_FARGATE_THRESHOLD_RECORDS = "fargateThresholdRecords"
+FLD_CONTEXT_PIP_EXTRA_INDEX_URL = "pipExtraIndexUrl"
+FLD_CONTEXT_RECONCILE_BUCKETS = "reconcileBuckets"
+FLD_CONTEXT_DNSWATCH_SINK = "dnswatchSink"
+FLD_CONTEXT_SALESFORCE_ORGS = "salesforceOrgs"
+FLD_CONTEXT_SALESFORCE_ORG_NAME = "name"
+FLD_CONTEXT_SALESFORCE_ORG_CONCURRENCY = "salesforceOrgConcurrency"
+FLD_CONTEXT_DNSWATCH_API_URL = "dnswatchApiUrl"
+FLD_CONTEXT_DNSWATCH_API_TOKEN_SECRET = "dnswatchApiTokenSecretName"
+FLD_CONTEXT_DNSWATCH_API_MODEL_PATH = "dnswatchApiModelPath"
+FLD_CONTEXT_DNSWATCH_API_LOOKUP_PATH = "dnswatchApiLookupPath"
 FLD_CONTEXT_UPDATES_FROM_SF_BUCKET = "updatesFromSalesforceBucket"
 FLD_CONTEXT_SF_DOMAIN = "domain"
 FLD_CONTEXT_PROFILE = "profile"
 
 LL_CDDO_UTILS = "cddo_utils-0.1.95"
 
+LEASE_TABLE = "SalesforceUpdateRunLease"
+# index of each run stats table by entity and as_at_datetime, so recent runs are read
+# with a query rather than a scan
+STATS_INDEX = "ByAsAtDatetime"
+STATS_INDEX_PARTITION_KEY = "entity"
+
 
 FLD_CONTEXT_PRIVATESUBNETID1 = "PrivateSubnetId1"
 FLD_CONTEXT_PRIVATESUBNETID2 = "PrivateSubnetId2"
 FLD_CONTEXT_RDSSECRETNAME = "RdsSecretName"
 FLD_CONTEXT_VPCID = "VpcId"
 FLD_CONTEXT_BASTIONHOSTSG = "BastionHostSG"
+FLD_CONTEXT_RDSPROXY = "RdsProxy"
+FLD_CONTEXT_RDSINSTANCEID = "RdsInstanceId"
+FLD_CONTEXT_RDSENDPOINT = "RdsEndpoint"
+FLD_CONTEXT_RDSPORT = "RdsPort"
@@ -1 +1 @@
-from .db_tables import create_dynamodb_tables  # noqa: F401
+from .db_tables import create_dynamodb_tables, create_lease_table  # noqa: F401
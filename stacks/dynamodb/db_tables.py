@@ -5,6 +5,9 @@ import aws_cdk.aws_dynamodb as ddb
 from cddo.utils.constants import (FLD_DOMAIN_RELATION, FLD_ORGANISATION,
                                   FLD_ORPHAN_ORGANISATION)
 
+from stacks.constants import (LEASE_TABLE, STATS_INDEX,
+                              STATS_INDEX_PARTITION_KEY)
+
 
 def create_dynamodb_tables(stack: cdk.Stack) -> List[ddb.TableV2]:
     tables = []
@@ -17,6 +20,18 @@ def create_dynamodb_tables(stack: cdk.Stack) -> List[ddb.TableV2]:
                 partition_key=ddb.Attribute(
                     name="as_at_datetime", type=ddb.AttributeType.STRING
                 ),
+                global_secondary_indexes=[
+                    ddb.GlobalSecondaryIndexPropsV2(
+                        index_name=STATS_INDEX,
+                        partition_key=ddb.Attribute(
+                            name=STATS_INDEX_PARTITION_KEY,
+                            type=ddb.AttributeType.STRING,
+                        ),
+                        sort_key=ddb.Attribute(
+                            name="as_at_datetime", type=ddb.AttributeType.STRING
+                        ),
+                    )
+                ],
                 contributor_insights=True,
                 table_class=ddb.TableClass.STANDARD_INFREQUENT_ACCESS,
                 removal_policy=cdk.RemovalPolicy.DESTROY,
@@ -24,3 +39,14 @@ def create_dynamodb_tables(stack: cdk.Stack) -> List[ddb.TableV2]:
         )
 
     return tables
+
+
+def create_lease_table(stack: cdk.Stack) -> ddb.TableV2:
+    # single item table holding the lease which stops update runs overlapping
+    return ddb.TableV2(
+        scope=stack,
+        id=LEASE_TABLE,
+        table_name=LEASE_TABLE,
+        partition_key=ddb.Attribute(name="lease_id", type=ddb.AttributeType.STRING),
+        removal_policy=cdk.RemovalPolicy.DESTROY,
+    )
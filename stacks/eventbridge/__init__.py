@@ -1 +1 @@
-from .schedule import create_schedule  # noqa: F401
+from .schedule import create_schedule, create_scheduler_role  # noqa: F401
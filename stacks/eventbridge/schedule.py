@@ -2,10 +2,42 @@ import aws_cdk.aws_events as events
 import aws_cdk.aws_events_targets as targets
 import aws_cdk.aws_sns as sns
 import aws_cdk.aws_stepfunctions as stepfunctions
-from aws_cdk import Stack
+from aws_cdk import ArnFormat, Stack
 from aws_cdk import aws_iam as iam
 
 
+def create_scheduler_role(stack: Stack, state_machine_name: str) -> iam.Role:
+    """
+    Role EventBridge Scheduler assumes to start the one time runs the state machine
+    schedules for itself
+    """
+    role_name = f"{stack.stack_name}-AdaptiveSchedulerRole"
+
+    role = iam.Role(
+        stack,
+        id=role_name,
+        role_name=role_name,
+        assumed_by=iam.ServicePrincipal("scheduler.amazonaws.com"),
+    )
+
+    role.add_to_policy(
+        iam.PolicyStatement(
+            effect=iam.Effect.ALLOW,
+            actions=["states:StartExecution"],
+            resources=[
+                stack.format_arn(
+                    service="states",
+                    resource="stateMachine",
+                    resource_name=state_machine_name,
+                    arn_format=ArnFormat.COLON_RESOURCE_NAME,
+                )
+            ],
+        )
+    )
+
+    return role
+
+
 def create_schedule(
     stack: Stack,
     schedule_expression: str,
@@ -1 +1,5 @@
-from .params import create_secrets_and_params  # noqa: F401
+from .params import (  # noqa: F401
+    create_org_secrets_and_params,
+    create_secrets_and_params,
+    org_event_root,
+)
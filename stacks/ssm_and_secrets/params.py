@@ -14,6 +14,8 @@ from cddo.utils.constants import (FLD_DOMAIN_RELATION, FLD_ORGANISATION,
 
 from stacks.constants import (FLD_CONTEXT_SALESFORCE_CONSUMER_KEY,
                               FLD_CONTEXT_SALESFORCE_CONSUMER_SECRET,
+                              FLD_CONTEXT_SALESFORCE_ORG_NAME,
+                              FLD_CONTEXT_SALESFORCE_ORGS,
                               FLD_CONTEXT_SF_DOMAIN)
 
 
@@ -58,12 +60,13 @@ def set_param(
     parameter_name: str,
     string_value: Union[List[str], str],
     description: str,
+    construct_id: Optional[str] = None,
 ) -> ssm.IParameter:
     parameter_full_name = f"/{key_root}/{parameter_name}"
     if type(string_value) is list:
         param = ssm.StringListParameter(
             stack,
-            parameter_name,
+            construct_id or parameter_name,
             string_list_value=string_value,
             description=description,
             parameter_name=parameter_full_name,
@@ -72,7 +75,7 @@ def set_param(
     else:
         param = ssm.StringParameter(
             stack,
-            parameter_name,
+            construct_id or parameter_name,
             string_value=string_value,
             data_type=ssm.ParameterDataType.TEXT,
             description=description,
@@ -85,26 +88,35 @@ def set_param(
     return param
 
 
-def create_secrets_and_params(
-    stack: Stack, context: Dict[str, Any]
+def org_event_root(org_name: str) -> str:
+    """
+    Root of the secret and watermark parameter of an additional salesforce org
+    """
+    return f"{PS_SALESFORCE_EVENT_ROOT}-{org_name}"
+
+
+def _create_org_secret_and_param(
+    stack: Stack,
+    key_root: str,
+    org: Dict[str, Any],
+    construct_id: Optional[str] = None,
 ) -> Tuple[sm.Secret, ssm.IParameter]:
     salesforce_secret = set_secret(
         stack=stack,
-        key_root=PS_SALESFORCE_EVENT_ROOT,
+        key_root=key_root,
         value={
-            PS_SALESFORCE_CLIENT_ID: context[FLD_CONTEXT_SALESFORCE_CONSUMER_KEY],
-            PS_SALESFORCE_CLIENT_SECRET: context[
-                FLD_CONTEXT_SALESFORCE_CONSUMER_SECRET
-            ],
-            PS_SALESFORCE_DOMAIN: context[FLD_CONTEXT_SF_DOMAIN],
+            PS_SALESFORCE_CLIENT_ID: org[FLD_CONTEXT_SALESFORCE_CONSUMER_KEY],
+            PS_SALESFORCE_CLIENT_SECRET: org[FLD_CONTEXT_SALESFORCE_CONSUMER_SECRET],
+            PS_SALESFORCE_DOMAIN: org[FLD_CONTEXT_SF_DOMAIN],
         },
         description="Salesforce client id and client_secret to called endpoint",
     )
 
     last_checked_param = set_param(
         stack=stack,
-        key_root=PS_SALESFORCE_EVENT_ROOT,
+        key_root=key_root,
         parameter_name=PS_SALESFORCE_LAST_CHECKED,
+        construct_id=construct_id,
         string_value=json.dumps(
             {
                 FLD_ORGANISATION: "2024-01-01T00:00:00Z",
@@ -115,3 +127,29 @@ def create_secrets_and_params(
         description="Time of last check for Salesforce updates",
     )
     return salesforce_secret, last_checked_param
+
+
+def create_secrets_and_params(
+    stack: Stack, context: Dict[str, Any]
+) -> Tuple[sm.Secret, ssm.IParameter]:
+    return _create_org_secret_and_param(
+        stack=stack, key_root=PS_SALESFORCE_EVENT_ROOT, org=context
+    )
+
+
+def create_org_secrets_and_params(
+    stack: Stack, context: Dict[str, Any]
+) -> Dict[str, Tuple[sm.Secret, ssm.IParameter]]:
+    """
+    Secret and watermark parameter of each additional org in salesforceOrgs, by org name
+    """
+    org_secrets = dict()
+    for org in context.get(FLD_CONTEXT_SALESFORCE_ORGS, []):
+        name = org[FLD_CONTEXT_SALESFORCE_ORG_NAME]
+        org_secrets[name] = _create_org_secret_and_param(
+            stack=stack,
+            key_root=org_event_root(name),
+            org=org,
+            construct_id=f"{PS_SALESFORCE_LAST_CHECKED}-{name}",
+        )
+    return org_secrets
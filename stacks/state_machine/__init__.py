@@ -1 +1,5 @@
-from .state_machine import create_queue_consume_state_machine  # noqa: F401
+from .change_data_capture import create_change_data_capture  # noqa: F401
+from .state_machine import (  # noqa: F401
+    STATE_MACHINE_NAME,
+    create_queue_consume_state_machine,
+)
@@ -0,0 +1,92 @@
+from typing import Dict, Optional
+
+import aws_cdk as cdk
+import aws_cdk.aws_events as events
+import aws_cdk.aws_events_targets as targets
+import aws_cdk.aws_lambda as lambda_
+import aws_cdk.aws_lambda_event_sources as event_sources
+import aws_cdk.aws_s3 as s3
+import aws_cdk.aws_sqs as sqs
+import aws_cdk.aws_stepfunctions as sfn
+from aws_cdk import aws_secretsmanager as sm
+from cddo.utils import lambdas
+
+from stacks.constants import FLD_CONTEXT_CDC_EVENT_BUS
+from .state_machine import ENV_UPDATE_FROM_SALESFORCE_BUCKET, layers
+
+ENV_STATE_MACHINE_ARN = "CDDO_STATE_MACHINE_ARN"
+
+# change events relayed for the objects the update reads
+CDC_DETAIL_TYPES = ["AccountChangeEvent", "Domain__ChangeEvent"]
+# events gathered in to one batch, and how long to wait for a batch to fill
+CDC_BATCH_SIZE = 1000
+CDC_BATCH_WINDOW_SECONDS = 60
+CDC_CONSUMER_TIMEOUT = 300
+
+
+def create_change_data_capture(
+    stack: cdk.Stack,
+    context: Dict[str, str],
+    state_machine: sfn.StateMachine,
+    from_salesforce_bucket: s3.Bucket,
+    salesforce_secret: sm.Secret,
+) -> Optional[lambda_.Function]:
+    """
+    When the profile context names the EventBridge partner bus salesforce relays change
+    data capture events to, queue the Account and Domain__c change events and consume
+    them in micro-batches, each of which is applied by its own state machine run
+    """
+    if not context.get(FLD_CONTEXT_CDC_EVENT_BUS):
+        return None
+
+    dead_letter_queue = sqs.Queue(
+        stack,
+        id="ChangeEventsDLQ",
+        retention_period=cdk.Duration.days(14),
+    )
+    queue = sqs.Queue(
+        stack,
+        id="ChangeEvents",
+        # six times the consumer timeout, as recommended for lambda event sources
+        visibility_timeout=cdk.Duration.seconds(6 * CDC_CONSUMER_TIMEOUT),
+        dead_letter_queue=sqs.DeadLetterQueue(
+            max_receive_count=3, queue=dead_letter_queue
+        ),
+    )
+
+    events.Rule(
+        stack,
+        id="SalesforceChangeEvents",
+        event_bus=events.EventBus.from_event_bus_name(
+            stack, "SalesforceEventBus", context[FLD_CONTEXT_CDC_EVENT_BUS]
+        ),
+        event_pattern=events.EventPattern(detail_type=CDC_DETAIL_TYPES),
+        targets=[targets.SqsQueue(queue)],
+    )
+
+    fn = lambdas.create_lambda(
+        stack=stack,
+        name="ConsumeChangeEvents",
+        description="Micro-batch Salesforce change events in to a DNSWatch update",
+        timeout=CDC_CONSUMER_TIMEOUT,
+        source_folder="./lambdas",
+        create_log_group=True,
+        lambda_layers=[l for k, l in layers.items()],
+        environment={
+            ENV_UPDATE_FROM_SALESFORCE_BUCKET: from_salesforce_bucket.bucket_name,
+            ENV_STATE_MACHINE_ARN: state_machine.state_machine_arn,
+        },
+        memory_size=512,
+    )
+    fn.add_event_source(
+        event_sources.SqsEventSource(
+            queue,
+            batch_size=CDC_BATCH_SIZE,
+            max_batching_window=cdk.Duration.seconds(CDC_BATCH_WINDOW_SECONDS),
+        )
+    )
+    from_salesforce_bucket.grant_put(fn)
+    salesforce_secret.grant_read(fn)
+    state_machine.grant_start_execution(fn)
+
+    return fn
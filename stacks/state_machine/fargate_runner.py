@@ -0,0 +1,108 @@
+import os
+from typing import Any, Dict, Tuple
+
+import aws_cdk as cdk
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_ecs as ecs
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_logs as logs
+import aws_cdk.aws_stepfunctions as sfn
+import aws_cdk.aws_stepfunctions_tasks as tasks
+
+from stacks.constants import FLD_CONTEXT_PIP_EXTRA_INDEX_URL
+
+ENV_EXECUTION_ID = "CDDO_EXECUTION_ID"
+ENV_EXECUTION_INPUT = "CDDO_EXECUTION_INPUT"
+ENV_EXTRACT_PROCESSES = "CDDO_EXTRACT_PROCESSES"
+ENV_STATEMENT_TIMEOUT = "CDDO_STATEMENT_TIMEOUT"
+
+# well beyond the Lambda limits - 4 vCPU lets each entity be extracted in its own process
+FARGATE_CPU = 4096
+FARGATE_MEMORY_MIB = 16384
+EXTRACT_PROCESSES = 4
+# the runs sent here are the largest, whose merge statements would outlast the
+# statement_timeout Lambda runs are held to
+STATEMENT_TIMEOUT = "60min"
+
+
+def create_fargate_runner(
+    stack: cdk.Stack,
+    context: Dict[str, Any],
+    vpc: ec2.IVpc,
+    security_group: ec2.ISecurityGroup,
+    vpc_subnets: ec2.SubnetSelection,
+    environment: Dict[str, str],
+) -> Tuple[tasks.EcsRunTask, iam.IRole]:
+    """
+    EcsRunTask state which runs extraction and finalise together in a Fargate task,
+    waiting (.sync) for the task to stop. The task runs in the database subnets so they
+    need a route to salesforce. Returns the task role for the caller to grant access to
+    """
+    cluster = ecs.Cluster(stack, id="SalesforceUpdateCluster", vpc=vpc)
+
+    task_definition = ecs.FargateTaskDefinition(
+        stack,
+        id="SalesforceUpdateTask",
+        cpu=FARGATE_CPU,
+        memory_limit_mib=FARGATE_MEMORY_MIB,
+    )
+
+    build_args = dict()
+    if context.get(FLD_CONTEXT_PIP_EXTRA_INDEX_URL):
+        build_args["PIP_EXTRA_INDEX_URL"] = context[FLD_CONTEXT_PIP_EXTRA_INDEX_URL]
+
+    container = task_definition.add_container(
+        "SalesforceUpdate",
+        image=ecs.ContainerImage.from_asset(
+            directory=os.path.dirname(__file__),
+            file="docker/Dockerfile",
+            build_args=build_args,
+            exclude=["**/__pycache__"],
+        ),
+        environment=environment
+        | {
+            ENV_EXTRACT_PROCESSES: str(EXTRACT_PROCESSES),
+            ENV_STATEMENT_TIMEOUT: STATEMENT_TIMEOUT,
+            "AWS_DEFAULT_REGION": stack.region,
+        },
+        logging=ecs.LogDrivers.aws_logs(
+            stream_prefix="salesforce-update",
+            log_retention=logs.RetentionDays.ONE_MONTH,
+        ),
+    )
+
+    task = tasks.EcsRunTask(
+        stack,
+        id="RunUpdateOnFargate",
+        integration_pattern=sfn.IntegrationPattern.RUN_JOB,
+        cluster=cluster,
+        task_definition=task_definition,
+        launch_target=tasks.EcsFargateLaunchTarget(
+            platform_version=ecs.FargatePlatformVersion.LATEST
+        ),
+        assign_public_ip=False,
+        subnets=vpc_subnets,
+        security_groups=[security_group],
+        container_overrides=[
+            tasks.ContainerOverride(
+                container_definition=container,
+                environment=[
+                    tasks.TaskEnvironmentVariable(
+                        name=ENV_EXECUTION_ID,
+                        value=sfn.JsonPath.string_at("$$.Execution.Id"),
+                    ),
+                    # so the runner extracts as GetSalesforceChanges would for the
+                    # same input, e.g. a retryQuarantine run
+                    tasks.TaskEnvironmentVariable(
+                        name=ENV_EXECUTION_INPUT,
+                        value=sfn.JsonPath.json_to_string(
+                            sfn.JsonPath.object_at("$$.Execution.Input")
+                        ),
+                    ),
+                ],
+            )
+        ],
+        result_path=sfn.JsonPath.DISCARD,
+    )
+
+    return task, task_definition.task_role
@@ -0,0 +1,154 @@
+import datetime
+import json
+import os
+from typing import Any, Dict, List, Set
+
+import boto3
+import pandas as pd
+from cddo.utils.constants import (
+    ENV_UPDATE_FROM_SALESFORCE_BUCKET,
+    FLD_DOMAIN_RELATION,
+    FLD_MODEL,
+    FLD_ORGANISATION,
+    FLD_QUERY,
+    FLD_SALESFORCE_CHANGE_FILES,
+    FROM_SALESFORCE_FILESTUB,
+    PS_SALESFORCE_EVENT_ROOT,
+)
+from cddo.utils.salesforce import get_access_token
+
+from salesforce_work import (
+    FLD_LOOKUP_FILE,
+    LOOKUP_COLUMNS,
+    LOOKUP_FILE,
+    change_file_info,
+    query_ids,
+    to_model_frame,
+    work,
+)
+
+ENV_STATE_MACHINE_ARN = "CDDO_STATE_MACHINE_ARN"
+
+# input which sends a batch straight to FinaliseSalesforceUpdate
+FLD_CHANGE_DATA_CAPTURE = "changeDataCapture"
+
+OUTPUT_BUCKET = os.environ[ENV_UPDATE_FROM_SALESFORCE_BUCKET]
+STATE_MACHINE_ARN = os.environ[ENV_STATE_MACHINE_ARN]
+CDC_PREFIX = "cdc"
+
+# salesforce object of each change event and the work entry which reads it
+CDC_ENTITIES = {
+    "Account": FLD_ORGANISATION,
+    "Domain__c": FLD_DOMAIN_RELATION,
+}
+# the records no longer exist in salesforce so there is nothing to read
+SKIPPED_CHANGE_TYPES = {"DELETE", "GAP_DELETE"}
+# salesforce dropped the individual events so only a full poll catches everything
+OVERFLOW_CHANGE_TYPE = "GAP_OVERFLOW"
+
+s3_client = boto3.client("s3")
+sfn_client = boto3.client("stepfunctions")
+
+
+def _change_headers(event: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    ChangeEventHeader of each change event in an SQS batch of events relayed from
+    salesforce through the EventBridge partner bus
+    """
+    headers = []
+    for record in event["Records"]:
+        body = json.loads(record["body"])
+        headers.append(body["detail"]["payload"]["ChangeEventHeader"])
+    return headers
+
+
+def _changed_ids(headers: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    changed = {query_entity: set() for query_entity in CDC_ENTITIES.values()}
+    for header in headers:
+        if header["entityName"] not in CDC_ENTITIES:
+            print(f"Ignoring change event for {header['entityName']}")
+        elif header["changeType"] in SKIPPED_CHANGE_TYPES:
+            print(f"Ignoring {header['changeType']} of {header['recordIds']}")
+        else:
+            changed[CDC_ENTITIES[header["entityName"]]].update(header["recordIds"])
+    return changed
+
+
+def _start_execution(state_machine_input: Dict[str, Any], name: str) -> None:
+    sfn_client.start_execution(
+        stateMachineArn=STATE_MACHINE_ARN,
+        name=name,
+        input=json.dumps(state_machine_input),
+    )
+
+
+def lambda_handler(event, _context):
+    """
+    Micro-batch salesforce change data capture events from the SQS queue in to the
+    per model files and lookup FinaliseSalesforceUpdate reads, then start a state
+    machine run which applies just this batch. Changed records are read back from
+    salesforce rather than taken from the events so a batch always carries the
+    current values, whatever order the events arrived in
+    """
+    headers = _change_headers(event)
+    batch_id = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%fZ")
+
+    if any([h["changeType"] == OVERFLOW_CHANGE_TYPE for h in headers]):
+        print("Change events overflowed - starting a full polling run")
+        _start_execution(state_machine_input={}, name=f"cdc-overflow-{batch_id}")
+        return {"records": None}
+
+    changed = _changed_ids(headers)
+    if not any(changed.values()):
+        print("No changed records in batch")
+        return {"records": 0}
+
+    domain, access_token = get_access_token(PS_SALESFORCE_EVENT_ROOT)
+
+    files_written = dict()
+    lookups = [pd.DataFrame()]
+    records = 0
+    for query_entity, ids in changed.items():
+        info = work[query_entity]
+        df = query_ids(
+            query=info[FLD_QUERY],
+            ids=sorted(ids),
+            domain=domain,
+            access_token=access_token,
+        )
+        print(f"{query_entity}: {len(ids)} changed ids, {len(df)} records read")
+        records += len(df)
+
+        if len(df) != 0:
+            df = to_model_frame(df=df, info=info)
+            lookups.append(df[LOOKUP_COLUMNS])
+
+        key = f"{CDC_PREFIX}/{batch_id}/{FROM_SALESFORCE_FILESTUB}-{query_entity}.csv"
+        s3_client.put_object(
+            Body=df.to_csv(encoding="utf-8", index=False, lineterminator="\n"),
+            Bucket=OUTPUT_BUCKET,
+            Key=key,
+        )
+        files_written[info[FLD_MODEL]] = change_file_info(info=info, keys=[key])
+
+    lookup_key = f"{CDC_PREFIX}/{batch_id}/{LOOKUP_FILE}"
+    s3_client.put_object(
+        Body=pd.concat(lookups).to_csv(
+            encoding="utf-8", index=False, lineterminator="\n"
+        ),
+        Bucket=OUTPUT_BUCKET,
+        Key=lookup_key,
+    )
+
+    _start_execution(
+        state_machine_input={
+            FLD_CHANGE_DATA_CAPTURE: {
+                ENV_UPDATE_FROM_SALESFORCE_BUCKET: OUTPUT_BUCKET,
+                FLD_SALESFORCE_CHANGE_FILES: files_written,
+                FLD_LOOKUP_FILE: lookup_key,
+            }
+        },
+        name=f"cdc-{batch_id}",
+    )
+
+    return {"records": records, FLD_LOOKUP_FILE: lookup_key}
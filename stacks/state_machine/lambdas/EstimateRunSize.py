@@ -0,0 +1,69 @@
+import json
+import os
+
+import boto3
+import requests
+from cddo.utils.constants import PS_SALESFORCE_EVENT_ROOT, SALESFORCE_API_VERSION
+from cddo.utils.salesforce import get_access_token
+
+from salesforce_work import (
+    FLD_SALESFORCE_OBJECT,
+    changed_since,
+    last_checked_key,
+    work,
+)
+
+# records changed since the watermark above which the run goes to the Fargate runner
+ENV_FARGATE_THRESHOLD_RECORDS = "CDDO_FARGATE_THRESHOLD_RECORDS"
+FARGATE_THRESHOLD_RECORDS = int(os.environ.get(ENV_FARGATE_THRESHOLD_RECORDS, "50000"))
+
+FLD_RECORDS = "records"
+FLD_USE_FARGATE = "useFargate"
+
+TIMEOUT = 20
+# the default org's watermark, which a polling run outside multi-org mode reads from
+LAST_CHECKED_KEY = last_checked_key(event_root=PS_SALESFORCE_EVENT_ROOT)
+
+ssm_client = boto3.client("ssm")
+
+
+def _count(domain: str, access_token: str, salesforce_object: str, since: str) -> int:
+    response = requests.get(
+        url=f"https://{domain}.my.salesforce.com/services/data/v{SALESFORCE_API_VERSION}/query",
+        params={
+            "q": f"SELECT COUNT() FROM {salesforce_object} WHERE {changed_since(since)}"
+        },
+        headers={"Authorization": f"Bearer {access_token}"},
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
+    return json.loads(response.content)["totalSize"]
+
+
+def lambda_handler(_event, _context):
+    """
+    Count the records changed since the watermark with COUNT() queries, which return no
+    rows, so the state machine can send runs too large for the Lambda limits to Fargate
+    """
+    salesforce_last_checked_datetime = json.loads(
+        ssm_client.get_parameter(Name=LAST_CHECKED_KEY)["Parameter"]["Value"]
+    )
+    domain, access_token = get_access_token(PS_SALESFORCE_EVENT_ROOT)
+
+    records = 0
+    for query_entity, info in work.items():
+        count = _count(
+            domain=domain,
+            access_token=access_token,
+            salesforce_object=info[FLD_SALESFORCE_OBJECT],
+            since=salesforce_last_checked_datetime[query_entity],
+        )
+        print(f"{query_entity}: {count} records changed")
+        records += count
+
+    use_fargate = records > FARGATE_THRESHOLD_RECORDS
+    print(
+        f"{records} records to update - running on {'Fargate' if use_fargate else 'Lambda'}"
+    )
+
+    return {FLD_RECORDS: records, FLD_USE_FARGATE: use_fargate}
@@ -1,9 +1,12 @@
-import os
+import contextlib
 import io
-from typing import List, Optional
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
 import pandas as pd
 import boto3
 import sqlalchemy
+from sqlalchemy.dialects import postgresql
 from cddo.utils.constants import (
     ENV_UPDATE_FROM_SALESFORCE_BUCKET,
     FLD_SALESFORCE_CHANGE_FILES,
@@ -11,60 +14,322 @@ from cddo.utils.constants import (
     FLD_FIELDS_TO_JOIN,
     FLD_FILES_WRITTEN,
 )
-from cddo.utils.postgres import get_db_engine
 
-TEMP_TABLE = "zzz_temp_table"
-FLD_FIELDS_TO_NULL = "fieldsToNull"
+from batched_merge import (
+    MERGE_BATCH_AUTO,
+    MERGE_BATCH_SIZE,
+    merge_in_batches,
+    number_staged_rows,
+)
+from chunk_planner import PLAN_CSV_CHUNK_ROWS, PLAN_MERGE_BATCH_SIZE, plan_chunks
+from db_engine import connect, get_engine, reset_engine
+from explain import explain_enabled, explain_statements, write_plans
+from id_mapping import (
+    FLD_USE_ID_MAPPING,
+    ID_MAPPING,
+    classify,
+    load_mapping,
+    save_mapping,
+    update_mapping,
+)
+from lock_monitor import monitor_locks, record_blockers, set_timeouts
+from profiling import profiled
+from quarantine import (
+    FLD_DEAD_LETTER_FILES,
+    mark_retried,
+    quarantine_rejected,
+    validate_rows,
+)
+from salesforce_work import (
+    FLD_FIELDS_TO_NULL,
+    FLD_LOOKUP_FILE,
+    FLD_WATERMARK,
+    FLD_WATERMARK_PARAMETER,
+    FLD_WATERMARK_VALUE,
+    LOOKUP_FILE,
+)
+from sinks import SINK, SINK_API, SINK_SQL, api_sink
+from snapstart import register_after_restore, register_before_snapshot
+from sql_statements import (
+    ALLOWED_COLUMNS,
+    CNT_EXISTING,
+    CNT_INSERTS,
+    CNT_UPDATES,
+    INV_DUPLICATE_OBJECTS,
+    INV_DUPLICATE_STAGED,
+    INV_MERGED,
+    INV_STAGED,
+    INV_UNRESOLVED_CONTENT_TYPE,
+    LOOKUP_COUNT_STATEMENTS,
+    LOOKUP_MAPPING_SQL,
+    LOOKUP_MERGE_STATEMENTS,
+    LOOKUP_ORDER_BY,
+    LOOKUP_PRECHECK_STATEMENTS,
+    LOOKUP_RESOLVE_STATEMENTS,
+    LOOKUP_VERIFY_STATEMENTS,
+    STMT_DUPLICATES,
+    STMT_MATCHED,
+    STMT_UPDATE,
+    TEMP_TABLE,
+    compile_cache_info,
+    compile_upsert_statements,
+)
+from verification import check_invariants
+
+APPLICATION_NAME = "FinaliseSalesforceUpdate"
+
+# rows per DataFrame chunk read from s3 - bounds memory whatever the file size. When
+# not set the size is planned from the memory the function has free at the start of
+# each run
+ENV_CSV_CHUNK_ROWS = "CDDO_CSV_CHUNK_ROWS"
+CSV_CHUNK_ROWS = int(os.environ.get(ENV_CSV_CHUNK_ROWS, "10000"))
+
+# send the merge statements of a transaction as one psycopg pipeline rather than
+# waiting for each reply in turn
+ENV_PIPELINE = "CDDO_FINALISE_PIPELINE"
+PIPELINE = os.environ.get(ENV_PIPELINE, "true").lower() == "true"
+
+# staging table columns of the salesforce id lookup - id is the object_id it is
+# resolved against, and inserted as
+LOOKUP_DTYPES = {
+    "id": sqlalchemy.types.INTEGER,
+    "salesforce_id": sqlalchemy.types.VARCHAR(255),
+    "model": sqlalchemy.types.VARCHAR(100),
+    "content_type_id": sqlalchemy.types.INTEGER,
+    "sso_id": sqlalchemy.types.BIGINT,
+    "batch": sqlalchemy.types.UUID,
+}
+
+# staging table column types of a change file - declared rather than inferred from
+# the first chunk, where a sparse column may be all NaN and so taken as a float
+STAGING_KEY_DTYPE = sqlalchemy.types.BIGINT
+STAGING_UPDATE_DTYPE = sqlalchemy.types.TEXT
+
+# statement types postgres will hold as server side prepared statements
+PREPARABLE = {"SELECT", "INSERT", "UPDATE", "DELETE"}
 
 OUTPUT_BUCKET = os.environ[ENV_UPDATE_FROM_SALESFORCE_BUCKET]
 s3_client = boto3.client("s3")
-
-
-def _drop_temp_table(db_conn: sqlalchemy.Connection):
-    print("Dropping table")
-    _res = db_conn.execute(sqlalchemy.sql.text(f"TRUNCATE TABLE {TEMP_TABLE}"))
-    db_conn.commit()
-    _res = db_conn.execute(sqlalchemy.sql.text(f"DROP TABLE {TEMP_TABLE}"))
+ssm_client = boto3.client("ssm")
+
+# statements prepared on each postgres backend, keyed by backend pid
+_prepared = dict()
+# chunk and batch sizes planned for the current run
+_chunk_plan = dict()
+
+
+def _read_csv_chunks(
+    bucket_name: str, key: str, chunksize: Optional[int] = None, **kwargs
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream a csv file from s3 as DataFrames of at most chunksize rows. The s3 body is
+    decoded incrementally by the csv reader so the raw bytes, the decoded string and
+    the whole DataFrame are never held in memory together
+    """
+    chunksize = chunksize or _chunk_plan.get(PLAN_CSV_CHUNK_ROWS, CSV_CHUNK_ROWS)
+    body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+    try:
+        with pd.read_csv(
+            body, sep=",", encoding="utf-8", chunksize=chunksize, **kwargs
+        ) as reader:
+            yield from reader
+    except pd.errors.EmptyDataError:
+        # GetSalesforceChanges writes an empty file when nothing has changed
+        return
+    finally:
+        body.close()
+
+
+@contextlib.contextmanager
+def _transaction(
+    db_conn: sqlalchemy.Connection, label: str, run_stats: Dict[str, Any]
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run the body as a single transaction - committed when the body completes and
+    rolled back on any error so DNSWatch is never left half updated. Yields a dict
+    in which the body counts its round trips, which is recorded in run_stats along
+    with the transaction time and the WAL written while it ran. The WAL figure is the
+    server wide pg_current_wal_lsn delta so includes any concurrent DNSWatch writes
+    """
+    stats = {"round_trips": 0, "plan_cache_hits": 0, "plan_cache_misses": 0}
+    start = time.perf_counter()
+    start_lsn = db_conn.execute(
+        sqlalchemy.sql.text("SELECT pg_current_wal_lsn()::text")
+    ).scalar()
+    # begin explicitly so pandas.to_sql joins this transaction rather than committing its own
+    if not db_conn.in_transaction():
+        db_conn.begin()
+    set_timeouts(db_conn=db_conn)
+    try:
+        yield stats
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    stats["transaction_seconds"] = round(time.perf_counter() - start, 3)
+    stats["wal_bytes"] = int(
+        db_conn.execute(
+            sqlalchemy.sql.text(
+                "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), CAST(:start AS pg_lsn))"
+            ),
+            {"start": start_lsn},
+        ).scalar()
+    )
     db_conn.commit()
+    # the timeouts, the commit and the two WAL position queries
+    stats["round_trips"] += 4
+    run_stats[label] = stats
+    print(f"Transaction {label}: {stats}")
 
 
-def _create_null_sql(
-    upsert_object: str,
-    fields_to_null: List[str],
-) -> str:
-    set_stmt = ",".join([f"{f}=null" for f in fields_to_null])
-
-    query = f"UPDATE {upsert_object} uo SET {set_stmt}"
-
-    return query
-
-
-def _create_update_sql(
-    upsert_object: str,
-    fields_to_join: List[str],
-    fields_to_update: List[str],
-) -> str:
-    set_stmt = ",".join([f"{f}=tt.{f}" for f in fields_to_update])
-    where_stmt = " and ".join([f"uo.{f}=tt.{f}" for f in fields_to_join])
+def _execute(
+    db_conn: sqlalchemy.Connection,
+    statements: List[str],
+    stats: Dict[str, Any],
+    label: str,
+    plans: Optional[List[Dict[str, Any]]] = None,
+    params: Optional[Dict[str, Any]] = None,
+) -> List[int]:
+    """
+    Execute statements in order in the current transaction and return their row counts,
+    or for a SELECT the value it returns.
+    In pipeline mode all statements go to the server in one batch and the replies are
+    collected at a single sync point, otherwise each statement is a round trip. DML is
+    run as a server side prepared statement, planned once per connection. When plans is
+    given the statements are first explained and their plans appended to it
+    """
+    for statement in statements:
+        print(statement)
+
+    pg_conn = db_conn.connection.driver_connection
+    if plans is not None:
+        plans.extend(
+            explain_statements(
+                pg_conn=pg_conn,
+                statements=[
+                    s
+                    for s in statements
+                    if s.split(maxsplit=1)[0].upper() in PREPARABLE
+                ],
+                label=label,
+            )
+        )
 
-    query = f"UPDATE {upsert_object} uo SET {set_stmt} FROM {TEMP_TABLE} tt WHERE {where_stmt}"
+    prepared = _prepared.setdefault(pg_conn.info.backend_pid, set())
+    cursors = []
+    with pg_conn.pipeline() if PIPELINE else contextlib.nullcontext():
+        for statement in statements:
+            prepare = statement.split(maxsplit=1)[0].upper() in PREPARABLE
+            if prepare:
+                if statement in prepared:
+                    stats["plan_cache_hits"] += 1
+                else:
+                    stats["plan_cache_misses"] += 1
+                    prepared.add(statement)
+            cursor = pg_conn.cursor()
+            cursor.execute(statement, params, prepare=prepare)
+            cursors.append(cursor)
+    stats["round_trips"] += 1 if PIPELINE else len(statements)
+
+    rowcounts = [c.fetchone()[0] if c.description else c.rowcount for c in cursors]
+    for cursor in cursors:
+        cursor.close()
+    return rowcounts
+
+
+def _merge(
+    db_conn: sqlalchemy.Connection,
+    bucket_name: str,
+    key: str,
+    statements: List[str],
+    order_by: List[str],
+    stats: Dict[str, Any],
+    after: Optional[List[str]] = None,
+    plans: Optional[List[Dict[str, Any]]] = None,
+) -> List[int]:
+    """
+    Run the merge statements and then the statements in after, returning the row
+    counts, or SELECT values, of them all. By default everything runs in the current
+    transaction. When a merge batch size is set the staging table is committed and the
+    merge statements are applied in committed key ordered batches so row locks on
+    DNSWatch tables are held for one batch at a time. Anything which has to stop a
+    broken file reaching DNSWatch must therefore be checked before calling this
+    """
+    after = after or []
+    batch_size = _chunk_plan.get(PLAN_MERGE_BATCH_SIZE, MERGE_BATCH_SIZE)
+
+    if batch_size == 0:
+        rowcounts = _execute(
+            db_conn=db_conn,
+            statements=statements + after,
+            stats=stats,
+            label=key,
+            plans=plans,
+        )
+        return rowcounts
+
+    if plans is not None:
+        plans.extend(
+            explain_statements(
+                pg_conn=db_conn.connection.driver_connection,
+                statements=statements,
+                label=key,
+            )
+        )
+    total = number_staged_rows(db_conn=db_conn, order_by=order_by)
+    # the batches each commit so the staging table has to be committed first
+    db_conn.commit()
+    # the numbering statements and the commit
+    stats["round_trips"] += 6
+
+    def _execute_batch(batch: List[str], params: Dict[str, Any]) -> List[int]:
+        # each batch is a transaction of its own, which the timeouts are set for
+        set_timeouts(db_conn=db_conn)
+        stats["round_trips"] += 1
+        return _execute(
+            db_conn=db_conn, statements=batch, stats=stats, label=key, params=params
+        )
 
-    return query
+    merge_rowcounts = merge_in_batches(
+        db_conn=db_conn,
+        execute=_execute_batch,
+        statements=statements,
+        total=total,
+        bucket_name=bucket_name,
+        label=key,
+        version=s3_client.head_object(Bucket=bucket_name, Key=key)["ETag"],
+        stats=stats,
+        batch_size=batch_size,
+    )
 
+    set_timeouts(db_conn=db_conn)
+    stats["round_trips"] += 1
+    after_rowcounts = _execute(
+        db_conn=db_conn, statements=after, stats=stats, label=key
+    )
 
-def _create_insert_sql(
-    upsert_object: str,
-    fields_to_join: List[str],
-    fields_to_update: List[str],
-) -> str:
-    flds_stmt = ",".join([f for f in (fields_to_join + fields_to_update)])
-    values_stmt = ",".join([f"tt.{f}" for f in (fields_to_join + fields_to_update)])
+    return merge_rowcounts + after_rowcounts
 
-    where_stmt = " and ".join([f"tt.{f} is null" for f in fields_to_join])
 
-    query = f"INSERT INTO {upsert_object}({flds_stmt}) SELECT {values_stmt} FROM {TEMP_TABLE} tt WHERE {where_stmt}"
+def _prepared_statement_stats(db_conn: sqlalchemy.Connection) -> Dict[str, Any]:
+    """
+    Plan cache statistics for this connection - how often postgres used its cached
+    generic plan rather than planning the prepared statement again
+    """
+    row = db_conn.execute(
+        sqlalchemy.sql.text(
+            "SELECT count(*) AS statements, coalesce(sum(generic_plans), 0) AS generic_plans, "
+            "coalesce(sum(custom_plans), 0) AS custom_plans FROM pg_prepared_statements"
+        )
+    ).one()
+    db_conn.commit()
 
-    return query
+    return {
+        "statements": row.statements,
+        "generic_plans": int(row.generic_plans),
+        "custom_plans": int(row.custom_plans),
+        "compiled": compile_cache_info(),
+    }
 
 
 def upsert_from_file(
@@ -75,191 +340,415 @@ def upsert_from_file(
     fields_to_join: List[str],
     fields_to_update: List[str],
     fields_to_null: List[str],
+    stats: Dict[str, Any],
+    plans: Optional[List[Dict[str, Any]]] = None,
 ):
-    df_input: pd.DataFrame = pd.read_csv(
-        io.StringIO(
-            s3_client.get_object(Bucket=bucket_name, Key=key)["Body"]
-            .read()
-            .decode("utf-8")
-        ),
-        sep=",",
-    )
-
-    print("Creating table")
-    res = df_input.to_sql(
-        name=TEMP_TABLE,
-        con=db_conn,
-        if_exists="replace",
-        index=False,
-    )
-    db_conn.commit()
-
-    if len(fields_to_null) != 0:
-        # null_query = _create_null_sql(
-        #     upsert_object=upsert_object, fields_to_null=fields_to_null
-        # )
-        # print(null_query)
-        # res = db_conn.execute(sqlalchemy.sql.text(null_query))
-        # db_conn.commit()
-        # print(f"Nulling {res.rowcount} rows")
-        pass
-
-    update_query = _create_update_sql(
+    # compiled, and the identifiers checked, before anything is loaded
+    statements = compile_upsert_statements(
         upsert_object=upsert_object,
         fields_to_join=fields_to_join,
         fields_to_update=fields_to_update,
+        fields_to_null=fields_to_null,
     )
-    print(update_query)
-
-    res = db_conn.execute(sqlalchemy.sql.text(update_query))
-    db_conn.commit()
-    print(f"Updated {res.rowcount} rows")
 
-    insert_query = _create_insert_sql(
-        upsert_object=upsert_object,
-        fields_to_join=fields_to_join,
-        fields_to_update=fields_to_update,
+    print("Creating table")
+    dtype = {f: STAGING_UPDATE_DTYPE for f in fields_to_update} | {
+        f: STAGING_KEY_DTYPE for f in fields_to_join
+    }
+    staged_rows = 0
+    seen = set()
+    rejected = []
+    # only the columns the statements use are staged, so no staging column type is
+    # inferred from a chunk in which a sparse column happens to be empty
+    for df_chunk in _read_csv_chunks(
+        bucket_name=bucket_name, key=key, usecols=fields_to_join + fields_to_update
+    ):
+        # records with no external_id__c are not linked to a DNSWatch object yet
+        df_chunk = df_chunk.dropna(subset=fields_to_join)
+        df_chunk, df_rejected = validate_rows(
+            df=df_chunk,
+            key_columns=fields_to_join,
+            seen=seen,
+            varchar_columns=fields_to_update,
+        )
+        rejected.append(df_rejected)
+        if len(df_chunk) == 0:
+            continue
+        df_chunk.to_sql(
+            name=TEMP_TABLE,
+            con=db_conn,
+            if_exists="replace" if staged_rows == 0 else "append",
+            index=False,
+            dtype=dtype,
+        )
+        staged_rows += len(df_chunk)
+        stats["round_trips"] += 1
+
+    quarantine_rejected(
+        bucket_name=bucket_name,
+        key=key,
+        rejected=rejected,
+        stats=stats,
+        model=upsert_object,
     )
-    print(insert_query)
 
-    # res = db_conn.execute(
-    #     sqlalchemy.sql.text(
-    #         f"ALTER TABLE {TEMP_TABLE} ADD CONSTRAINT fk_tt_object FOREIGN KEY (id) REFERENCES {upsert_object} (id)"
-    #     )
-    # )
-    # db_conn.commit()
+    print(f"Rows staged: <{staged_rows}>")
+    if staged_rows == 0:
+        return
 
-    _drop_temp_table(db_conn=db_conn)
+    update_query = statements[STMT_UPDATE]
+    matched_query = statements[STMT_MATCHED]
 
+    duplicates, matched = _execute(
+        db_conn=db_conn,
+        statements=[statements[STMT_DUPLICATES], matched_query],
+        stats=stats,
+        label=key,
+        plans=plans,
+    )
+    check_invariants(label=key, invariants=[(INV_DUPLICATE_STAGED, 0, duplicates)])
 
-def lambda_handler(event, _context):
-    s3 = boto3.resource("s3")
-    input_files = event[FLD_SALESFORCE_CHANGE_FILES]
-
-    engine = get_db_engine(rds_secret_name=os.environ["RDS_SECRET_NAME"])
-
-    with engine.connect() as db_conn:
-        for query_entity, object_info in input_files.items():
-            print(f"Processing {query_entity}")
-            for file in object_info[FLD_FILES_WRITTEN]:
-                print(f"File {file}")
-                upsert_from_file(
-                    bucket_name=OUTPUT_BUCKET,
-                    key=file,
-                    db_conn=db_conn,
-                    upsert_object=query_entity,
-                    fields_to_join=object_info[FLD_FIELDS_TO_JOIN],
-                    fields_to_update=object_info[FLD_FIELDS_TO_UPDATE],
-                    fields_to_null=object_info[FLD_FIELDS_TO_NULL],
-                )
-        # #         s3.Object(OUTPUT_BUCKET, f"archive/{file}").copy_from(
-        # #             CopySource=f"{OUTPUT_BUCKET}/{file}"
-        # #         )
-        # #         s3.Object(OUTPUT_BUCKET, file).delete()
+    print("Dropping table")
+    updated, _ = _merge(
+        db_conn=db_conn,
+        bucket_name=bucket_name,
+        key=key,
+        statements=[update_query],
+        order_by=fields_to_join,
+        stats=stats,
+        after=[f"DROP TABLE {TEMP_TABLE}"],
+        plans=plans,
+    )
+    print(f"Matched {matched} rows, updated {updated} rows")
+    stats["rows_matched"] = matched
+    stats["rows_changed"] = updated
 
-        df_lookup = pd.read_csv(
-            io.StringIO(
-                s3_client.get_object(
-                    Bucket=OUTPUT_BUCKET, Key="salesforce_salesforceobject.csv"
-                )["Body"]
-                .read()
-                .decode("utf-8")
-            ),
-            sep=",",
-        )
 
-        df_lookup = df_lookup.loc[
-            df_lookup["model"].isin(["domain", "organisation"]), :
-        ]
+def _stage_lookup(
+    db_conn: sqlalchemy.Connection,
+    bucket_name: str,
+    key: str,
+    stats: Dict[str, Any],
+    mapping: Optional[pd.DataFrame] = None,
+) -> int:
+    """
+    Load the salesforce id lookup file into the staging table chunk by chunk,
+    returning the number of rows staged. With an id mapping, rows it shows are
+    unchanged are not staged and the rows it knows are staged already resolved
+    """
+    print("Creating table")
+    total_rows = 0
+    mapping_counts = {"unchanged": 0, "updates": 0, "unknown": 0}
+    seen = set()
+    rejected = []
+    for df_lookup in _read_csv_chunks(bucket_name=bucket_name, key=key):
+        # records with no external_id__c are not linked to a DNSWatch object yet
         df_lookup = df_lookup.dropna(subset=["id"])
-        df_lookup["content_type_id"] = 0
-        df_lookup["sso_id"] = 0
+        df_lookup, df_rejected = validate_rows(
+            df=df_lookup,
+            key_columns=["id"],
+            seen=seen,
+            varchar_columns=["salesforce_id"],
+            models=set(ALLOWED_COLUMNS.keys()),
+            scope_columns=["model"],
+        )
+        rejected.append(df_rejected)
+        if mapping is not None:
+            df_lookup, counts = classify(mapping=mapping, df=df_lookup)
+            for k, v in counts.items():
+                mapping_counts[k] += v
+        else:
+            df_lookup["content_type_id"] = 0
+            df_lookup["sso_id"] = 0
+        if len(df_lookup) == 0:
+            continue
         df_lookup["batch"] = pd.NA
 
-        print("Creating table")
         df_lookup.to_sql(
+            name=TEMP_TABLE,
+            con=db_conn,
+            if_exists="replace" if total_rows == 0 else "append",
+            index=False,
+            schema="public",
+            dtype=LOOKUP_DTYPES,
+        )
+        total_rows += len(df_lookup)
+        stats["round_trips"] += 1
+
+    if total_rows == 0:
+        # nothing to merge, or every row quarantined, but the merge still needs a table
+        pd.DataFrame(columns=list(LOOKUP_DTYPES.keys())).to_sql(
             name=TEMP_TABLE,
             con=db_conn,
             if_exists="replace",
             index=False,
             schema="public",
-            dtype={
-                "content_type_id": sqlalchemy.types.INTEGER,
-                "sso_id": sqlalchemy.types.BIGINT,
-                "model": sqlalchemy.types.VARCHAR(100),
-                "id": sqlalchemy.types.VARCHAR(255),
-                "salesforce_id": sqlalchemy.types.VARCHAR(255),
-                "batch": sqlalchemy.types.UUID,
-            },
+            dtype=LOOKUP_DTYPES,
         )
+        stats["round_trips"] += 1
 
-        # how many rows to be added
-        total_rows = len(df_lookup)
-        print(f"Rows to upsert: <{total_rows}>")
+    quarantine_rejected(
+        bucket_name=bucket_name, key=key, rejected=rejected, stats=stats
+    )
+    if mapping is not None:
+        stats["id_mapping"] = mapping_counts
+        print(f"Id mapping: {mapping_counts}")
+
+    return total_rows
+
+
+@register_before_snapshot
+def _prime():
+    """
+    Warm the code paths every run takes before SnapStart takes its snapshot - the csv
+    reader and DataFrame operations, SQLAlchemy statement compilation and the generated
+    statements for each model. Nothing connects to the database here
+    """
+    for df_chunk in pd.read_csv(
+        io.StringIO("id,salesforce_id,model\n1,a,domain\n"), chunksize=CSV_CHUNK_ROWS
+    ):
+        df_chunk = df_chunk.loc[df_chunk["model"].isin(["domain"]), :].dropna(
+            subset=["id"]
+        )
+        df_chunk["content_type_id"] = 0
+    sqlalchemy.sql.text("SELECT 1").compile(dialect=postgresql.dialect())
+    for model, columns in ALLOWED_COLUMNS.items():
+        compile_upsert_statements(
+            upsert_object=model,
+            fields_to_join=["id"],
+            fields_to_update=["salesforce_id"],
+            fields_to_null=sorted(columns - {"id"}),
+        )
 
-        # how many rows in {TEMP_TABLE}
-        res = db_conn.execute(sqlalchemy.sql.text(f"SELECT * FROM {TEMP_TABLE}"))
 
-        print(f"Rows in {TEMP_TABLE}: <{res.rowcount}>")
+@register_after_restore
+def _refresh():
+    """
+    Nothing connection related survives a restore - pooled connections from before the
+    snapshot are abandoned and the secret read again. AWS credentials come from the
+    container credentials endpoint after a restore so boto3 clients refresh themselves
+    """
+    reset_engine(close=False)
+    _prepared.clear()
+
+
+def _sql_sink(
+    event: Dict[str, Any], input_files: Dict[str, Any], lookup_file: str
+) -> Dict[str, Any]:
+    """
+    Merge the change files and the lookup in to the DNSWatch tables directly
+    """
+    mapping = load_mapping(bucket_name=OUTPUT_BUCKET) if ID_MAPPING else None
+
+    run_stats = dict()
+    # captured EXPLAIN ANALYZE plans when profiling is switched on
+    plans = [] if explain_enabled(event) else None
+
+    with connect(application_name=APPLICATION_NAME) as db_conn, monitor_locks(
+        engine=get_engine(application_name=APPLICATION_NAME),
+        pid=db_conn.connection.driver_connection.info.backend_pid,
+    ) as blockers:
+        for query_entity, object_info in input_files.items():
+            print(f"Processing {query_entity}")
+            for file in object_info[FLD_FILES_WRITTEN]:
+                print(f"File {file}")
+                with _transaction(
+                    db_conn=db_conn, label=file, run_stats=run_stats
+                ) as stats:
+                    upsert_from_file(
+                        bucket_name=OUTPUT_BUCKET,
+                        key=file,
+                        db_conn=db_conn,
+                        upsert_object=query_entity,
+                        fields_to_join=object_info[FLD_FIELDS_TO_JOIN],
+                        fields_to_update=object_info[FLD_FIELDS_TO_UPDATE],
+                        fields_to_null=object_info[FLD_FIELDS_TO_NULL],
+                        stats=stats,
+                        plans=plans,
+                    )
+        # #         s3.Object(OUTPUT_BUCKET, f"archive/{file}").copy_from(
+        # #             CopySource=f"{OUTPUT_BUCKET}/{file}"
+        # #         )
+        # #         s3.Object(OUTPUT_BUCKET, file).delete()
 
-        # get content type id for each model
-        res = db_conn.execute(
-            sqlalchemy.sql.text(
-                f"UPDATE {TEMP_TABLE} tt SET content_type_id = dct.id  FROM django_content_type dct WHERE dct.model = tt.model"
+        with _transaction(
+            db_conn=db_conn, label=lookup_file, run_stats=run_stats
+        ) as stats:
+            total_rows = _stage_lookup(
+                db_conn=db_conn,
+                bucket_name=OUTPUT_BUCKET,
+                key=lookup_file,
+                stats=stats,
+                mapping=mapping if event.get(FLD_USE_ID_MAPPING, True) else None,
             )
-        )
 
-        print(f"Content type updates: <{res.rowcount}>")
-        print(f"Content type updates should be: <{total_rows}>")
-
-        # update existing entries
-        res = db_conn.execute(
-            sqlalchemy.sql.text(
-                f"UPDATE {TEMP_TABLE} tt SET sso_id = sso.id  FROM salesforce_salesforceobject sso WHERE sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id"
+            # how many rows to be added
+            print(f"Rows to upsert: <{total_rows}>")
+
+            resolved = _execute(
+                db_conn=db_conn,
+                statements=LOOKUP_RESOLVE_STATEMENTS
+                + list(LOOKUP_PRECHECK_STATEMENTS.values())
+                + list(LOOKUP_COUNT_STATEMENTS.values()),
+                stats=stats,
+                label=lookup_file,
+                plans=plans,
+            )
+            content_type_updates, stale_mappings, resolved_rows, nulled = resolved[
+                : len(LOOKUP_RESOLVE_STATEMENTS)
+            ]
+            prechecks = dict(
+                zip(
+                    LOOKUP_PRECHECK_STATEMENTS.keys(),
+                    resolved[len(LOOKUP_RESOLVE_STATEMENTS) :],
+                )
+            )
+            counts = dict(
+                zip(
+                    LOOKUP_COUNT_STATEMENTS.keys(),
+                    resolved[-len(LOOKUP_COUNT_STATEMENTS) :],
+                )
             )
-        )
 
-        existing_rows = res.rowcount
-        print(f"Existing rows in salesforce_salesforceobject: <{existing_rows}>")
+            print(f"Content type updates: <{content_type_updates}>")
+            print(f"Stale id mappings: <{stale_mappings}>")
+            print(f"Resolved rows: <{resolved_rows}>")
+            print(f"Nulled: <{nulled}>")
+            print(f"Rows in {TEMP_TABLE}: <{prechecks[INV_STAGED]}>")
+            print(
+                f"Existing rows in salesforce_salesforceobject: <{counts[CNT_EXISTING]}>"
+            )
+            print(f"Existing updates: <{counts[CNT_UPDATES]}>")
+            print(f"Unchanged: <{counts[CNT_EXISTING] - counts[CNT_UPDATES]}>")
+            print(f"New inserts: <{counts[CNT_INSERTS]}>")
+
+            stats["rows_matched"] = counts[CNT_EXISTING]
+            stats["rows_changed"] = counts[CNT_UPDATES]
+            stats["rows_inserted"] = counts[CNT_INSERTS]
+
+            check_invariants(
+                label=lookup_file,
+                invariants=[
+                    (INV_STAGED, total_rows, prechecks[INV_STAGED]),
+                    (
+                        INV_UNRESOLVED_CONTENT_TYPE,
+                        0,
+                        prechecks[INV_UNRESOLVED_CONTENT_TYPE],
+                    ),
+                    (INV_DUPLICATE_STAGED, 0, prechecks[INV_DUPLICATE_STAGED]),
+                ],
+            )
 
-        print("Nulling ids which dont exist in DNSWatch")
-        res = db_conn.execute(
-            sqlalchemy.sql.text(f"update {TEMP_TABLE} set sso_id=null where sso_id=0")
-        )
+            checks = dict(
+                zip(
+                    LOOKUP_VERIFY_STATEMENTS.keys(),
+                    _merge(
+                        db_conn=db_conn,
+                        bucket_name=OUTPUT_BUCKET,
+                        key=lookup_file,
+                        statements=LOOKUP_MERGE_STATEMENTS,
+                        order_by=LOOKUP_ORDER_BY,
+                        stats=stats,
+                        after=list(LOOKUP_VERIFY_STATEMENTS.values()),
+                        plans=plans,
+                    )[len(LOOKUP_MERGE_STATEMENTS) :],
+                )
+            )
 
-        print(f"Nulled: <{res.rowcount}>")
+            if mapping is not None:
+                changed = pd.read_sql(sqlalchemy.sql.text(LOOKUP_MAPPING_SQL), db_conn)
+                stats["round_trips"] += 1
+            _execute(
+                db_conn=db_conn,
+                statements=[f"DROP TABLE {TEMP_TABLE}"],
+                stats=stats,
+                label=lookup_file,
+            )
 
-        # update existing
-        res = db_conn.execute(
-            sqlalchemy.sql.text(
-                f"UPDATE salesforce_salesforceobject sso SET salesforce_id = tt.salesforce_id FROM {TEMP_TABLE} tt WHERE tt.sso_id = sso.id"
+            # counted from salesforce_salesforceobject itself, so these hold for a
+            # resumed batched merge too. A batched merge has committed by now, so a
+            # failure here fails the run for the lookup to be looked in to rather than
+            # rolling it back
+            check_invariants(
+                label=lookup_file,
+                invariants=[
+                    (INV_MERGED, prechecks[INV_STAGED], checks[INV_MERGED]),
+                    (INV_DUPLICATE_OBJECTS, 0, checks[INV_DUPLICATE_OBJECTS]),
+                ],
             )
-        )
 
-        print(f"Existing updates: <{res.rowcount}>")
-        print(f"Should be: <{existing_rows}>")
+        run_stats["prepared_statements"] = _prepared_statement_stats(db_conn=db_conn)
 
-        # insert new
-        res = db_conn.execute(
-            sqlalchemy.sql.text(
-                f"INSERT INTO salesforce_salesforceobject(id, salesforce_id, content_type_id, batch) select id, salesforce_id, content_type_id, batch from {TEMP_TABLE} WHERE sso_id IS NULL"
-            )
+    if mapping is not None:
+        # only once the lookup has committed, so the mapping never runs ahead of DNSWatch
+        save_mapping(
+            bucket_name=OUTPUT_BUCKET,
+            mapping=update_mapping(mapping=mapping, changed=changed),
         )
 
-        db_conn.commit()
+    run_stats["lock_contention"] = record_blockers(
+        bucket_name=OUTPUT_BUCKET, blockers=blockers
+    )
+
+    if plans:
+        run_stats["explain"] = write_plans(bucket_name=OUTPUT_BUCKET, plans=plans)
 
-        print(f"New inserts: <{res.rowcount}>")
-        print(f"Should be: <{total_rows - existing_rows}>")
+    return run_stats
 
-        _drop_temp_table(db_conn=db_conn)
 
-        _df = pd.read_sql_query(
-            sql=sqlalchemy.sql.text(
-                "SELECT t.relname, pid, mode, granted FROM pg_locks l, pg_stat_all_tables t  WHERE l.relation = t.relid and relname not like 'pg_%' ORDER BY pid asc;"
+def _api_sink(
+    event: Dict[str, Any], input_files: Dict[str, Any], lookup_file: str
+) -> Dict[str, Any]:
+    return api_sink(
+        bucket_name=OUTPUT_BUCKET,
+        input_files=input_files,
+        lookup_file=lookup_file,
+        read_chunks=_read_csv_chunks,
+    )
+
+
+# where the changes go, selected by CDDO_DNSWATCH_SINK - each returns the run stats
+SINKS = {SINK_SQL: _sql_sink, SINK_API: _api_sink}
+
+
+@profiled(bucket_name=OUTPUT_BUCKET, name="FinaliseSalesforceUpdate")
+def lambda_handler(event, _context):
+    input_files = event[FLD_SALESFORCE_CHANGE_FILES]
+    # change data capture batches write their lookup under their own prefix
+    lookup_file = event.get(FLD_LOOKUP_FILE, LOOKUP_FILE)
+
+    # planned per run as a warm container's memory use changes between runs
+    plan = plan_chunks(
+        overrides={
+            PLAN_CSV_CHUNK_ROWS: (
+                CSV_CHUNK_ROWS if os.environ.get(ENV_CSV_CHUNK_ROWS) else None
             ),
-            con=db_conn,
+            PLAN_MERGE_BATCH_SIZE: None if MERGE_BATCH_AUTO else MERGE_BATCH_SIZE,
+        }
+    )
+    _chunk_plan.clear()
+    _chunk_plan.update(plan)
+
+    run_stats = SINKS[SINK](
+        event=event, input_files=input_files, lookup_file=lookup_file
+    )
+    run_stats["chunk_plan"] = plan
+
+    # only a retryQuarantine run carries the dead letter files it read back
+    mark_retried(bucket_name=OUTPUT_BUCKET, keys=event.get(FLD_DEAD_LETTER_FILES, []))
+
+    # only a polling run carries the watermark it read up to
+    if FLD_WATERMARK in event:
+        ssm_client.put_parameter(
+            Name=event[FLD_WATERMARK][FLD_WATERMARK_PARAMETER],
+            Value=event[FLD_WATERMARK][FLD_WATERMARK_VALUE],
+            Type="String",
+            Overwrite=True,
         )
-        db_conn.commit()
+
+    print(f"Run stats: {run_stats}")
+
+    return run_stats
 
     # data = (
     #     {"id": 1, "title": "The Hobbit", "primary_author": "Tolkien"},
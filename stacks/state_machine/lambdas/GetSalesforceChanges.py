@@ -1,16 +1,18 @@
+import concurrent.futures
 import datetime
+import functools
+import io
 import json
+import multiprocessing
 import os
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 import boto3
 import pandas as pd
 import requests
 from cddo.utils.constants import (
     ENV_UPDATE_FROM_SALESFORCE_BUCKET,
-    FLD_DOMAIN_RELATION,
-    FLD_ORGANISATION,
     FLD_ORPHAN_ORGANISATION,
     FLD_SALESFORCE_CHANGE_FILES,
     FROM_SALESFORCE_FILESTUB,
@@ -18,16 +20,34 @@ from cddo.utils.constants import (
     PS_SALESFORCE_CLIENT_SECRET,
     PS_SALESFORCE_DOMAIN,
     PS_SALESFORCE_EVENT_ROOT,
-    PS_SALESFORCE_LAST_CHECKED,
     SALESFORCE_API_VERSION,
     FLD_MODEL,
-    FLD_RENAMER,
     FLD_QUERY,
-    FLD_FIELDS_TO_UPDATE,
-    FLD_FIELDS_TO_JOIN,
-    FLD_FILES_WRITTEN,
 )
-from cddo.utils.salesforce import get_access_token, query_to_df
+from cddo.utils.salesforce import get_access_token
+
+from chunk_planner import PLAN_S3_PART_SIZE, PLAN_SALESFORCE_BATCH_SIZE, plan_chunks
+from explain import pass_explain
+from profiling import profiled
+from quarantine import FLD_DEAD_LETTER_FILES, read_quarantined_ids
+from salesforce_work import (
+    FLD_LOOKUP_FILE,
+    FLD_WATERMARK,
+    FLD_WATERMARK_PARAMETER,
+    FLD_WATERMARK_VALUE,
+    LOOKUP_COLUMNS,
+    LOOKUP_FILE,
+    change_file_info,
+    changed_since,
+    last_checked_key,
+    put_csv,
+    put_csv_frames,
+    query_ids,
+    query_pages,
+    to_model_frame,
+    work,
+)
+from snapstart import register_after_restore, register_before_snapshot
 
 ssm_client = boto3.client("ssm")
 secrets_client = boto3.client("secretsmanager")
@@ -36,40 +56,78 @@ ddb_client = boto3.client("dynamodb")
 
 
 TIMEOUT = 20
-FLD_FIELDS_TO_NULL = "fieldsToNull"
+# salesforce access token reused by warm invocations for this long
+TOKEN_TTL_SECONDS = 900
 OUTPUT_BUCKET = os.environ[ENV_UPDATE_FROM_SALESFORCE_BUCKET]
-
-work = dict()
-work[FLD_ORGANISATION] = {
-    FLD_MODEL: "organisation",
-    FLD_RENAMER: {"external_id__c": "id", "id": "salesforce_id"},
-    FLD_QUERY: "select Id, Name, external_id__c from Account where",
-    FLD_FIELDS_TO_UPDATE: ["salesforce_id"],
-    FLD_FIELDS_TO_JOIN: ["id"],
-    FLD_FIELDS_TO_NULL: ["salesforce_id"],
-}
-work[FLD_DOMAIN_RELATION] = {
-    FLD_MODEL: "domain",
-    FLD_RENAMER: {"external_id__c": "id", "id": "salesforce_id"},
-    FLD_QUERY: "select Id, Name, Organisation__c, Parent_domain__c, Public_suffix__c, Organisation__r.Id, Organisation__r.Name, external_id__c \
-    from Domain__c where",
-    FLD_FIELDS_TO_UPDATE: ["salesforce_id"],
-    FLD_FIELDS_TO_JOIN: ["id"],
-    FLD_FIELDS_TO_NULL: ["salesforce_id", "salesforce_organisation_id"],
+# processes extracting entities in parallel - only set where there are cores to use
+# them, e.g. the Fargate runner, as Lambda has no shared memory for a process pool
+ENV_EXTRACT_PROCESSES = "CDDO_EXTRACT_PROCESSES"
+EXTRACT_PROCESSES = int(os.environ.get(ENV_EXTRACT_PROCESSES, "1"))
+# records per salesforce page - planned from the memory free when not set
+ENV_SALESFORCE_BATCH_SIZE = "CDDO_SALESFORCE_BATCH_SIZE"
+
+# execution input which reads back only the records earlier runs quarantined
+FLD_RETRY_QUARANTINE = "retryQuarantine"
+
+# one org's extraction in multi-org mode - its secret and watermark are under its own
+# event root and its files under its own prefix. Without it the run is for the org
+# under PS_SALESFORCE_EVENT_ROOT, writing to the top of the bucket
+FLD_ORG = "org"
+FLD_ORG_NAME = "name"
+FLD_ORG_EVENT_ROOT = "eventRoot"
+FLD_ORG_PREFIX = "prefix"
+DEFAULT_ORG = {
+    FLD_ORG_NAME: "default",
+    FLD_ORG_EVENT_ROOT: PS_SALESFORCE_EVENT_ROOT,
+    FLD_ORG_PREFIX: "",
 }
+# the other orgs' files, and so their dead letter files, are under orgs/<name>/
+ORGS_PREFIX = "orgs"
+# the execution a multi-org run's extraction is part of - recorded with the run stats
+# so ScheduleNextRun counts the orgs' extractions as one run
+FLD_EXECUTION_ID = "executionId"
 
-# work[FLD_ORPHAN_ORGANISATION] = {
-#     FLD_MODEL: "orphan",
-#     FLD_RENAMER: {"external_id__c": "object_id", "id": "salesforce_id"},
-#     FLD_QUERY: "SELECT Id, Name, external_id__c FROM Account WHERE Id NOT IN (SELECT Organisation__c FROM Domain__c) and",
-# }
 
+def date_now_as_sf_str() -> str:
+    return str(datetime.datetime.now(datetime.UTC)).replace(" ", "T")
 
-LAST_CHECKED_KEY = f"/{PS_SALESFORCE_EVENT_ROOT}/{PS_SALESFORCE_LAST_CHECKED}"
 
+# (domain, access token, monotonic time fetched) for each org's salesforce connection
+_tokens: Dict[str, Tuple[str, str, float]] = dict()
+
+
+def _get_access_token(event_root: str = PS_SALESFORCE_EVENT_ROOT) -> Tuple[str, str]:
+    token = _tokens.get(event_root)
+    if token is None or time.monotonic() - token[2] > TOKEN_TTL_SECONDS:
+        domain, access_token = get_access_token(event_root)
+        token = _tokens[event_root] = (domain, access_token, time.monotonic())
+    return token[0], token[1]
+
+
+@register_before_snapshot
+def _prime():
+    """
+    Warm the DataFrame code paths every run takes before SnapStart takes its snapshot.
+    Nothing calls salesforce here as a token in the snapshot would be shared by every
+    restored environment
+    """
+    for info in work.values():
+        df = to_model_frame(
+            df=pd.read_csv(io.StringIO("Id,Name,external_id__c\nx,y,1\n")), info=info
+        )
+        pd.concat([pd.DataFrame(), df[LOOKUP_COLUMNS]]).to_csv(
+            encoding="utf-8", index=False, lineterminator="\n"
+        )
+    date_now_as_sf_str()
 
-def date_now_as_sf_str() -> str:
-    return str(datetime.datetime.now(datetime.UTC)).replace(" ", "T")
+
+@register_after_restore
+def _refresh():
+    """
+    Fetch a new salesforce token after a restore. AWS credentials come from the
+    container credentials endpoint after a restore so boto3 clients refresh themselves
+    """
+    _tokens.clear()
 
 
 # def get_key(query_entity: str, now: str, file_count: int) -> str:
@@ -226,97 +284,198 @@ def date_now_as_sf_str() -> str:
 #     }
 
 
-def lambda_handler(_event, _context):
-    ssm_client.put_parameter(
-        Name=LAST_CHECKED_KEY,
-        Value=json.dumps(
-            {
-                "organisation": "2023-01-01T00:00:01.000000+00:00",
-                "domainRelation": "2023-01-01T00:00:01.000000+00:00",
-                "orphanOrganisation": "2023-01-01T00:00:01.000000+00:00",
-            }
-        ),
-        Type="String",
-        Overwrite=True,
+def _extract(
+    query_entity: str,
+    since: Optional[str],
+    ids: Optional[List[str]],
+    now: str,
+    plan: Dict[str, int],
+    org: Dict[str, str] = DEFAULT_ORG,
+    execution_id: Optional[str] = None,
+) -> Tuple[Dict[str, Any], pd.DataFrame]:
+    """
+    Read the records of one entity changed since the watermark, recording the count,
+    or the records with the given ids, and write them to s3. Returns the change file
+    entry and the entity's rows of the lookup
+    """
+    print(f"Processing {query_entity}")
+    info = work[query_entity]
+    domain, access_token = _get_access_token(event_root=org[FLD_ORG_EVENT_ROOT])
+
+    if ids is not None:
+        frames = [
+            query_ids(
+                query=info[FLD_QUERY], ids=ids, domain=domain, access_token=access_token
+            )
+        ]
+    else:
+        frames = query_pages(
+            query=f"{info[FLD_QUERY]} {changed_since(since)}",
+            domain=domain,
+            access_token=access_token,
+            batch_size=plan[PLAN_SALESFORCE_BATCH_SIZE],
+        )
+
+    # each page is written as it arrives, keeping only its rows of the lookup
+    lookups = []
+
+    def _model_frames():
+        for df in frames:
+            if len(df) == 0:
+                continue
+            df = to_model_frame(df=df, info=info)
+            lookups.append(df[LOOKUP_COLUMNS])
+            yield df
+
+    key = f"{org[FLD_ORG_PREFIX]}{FROM_SALESFORCE_FILESTUB}-{query_entity}.csv"
+
+    records = put_csv_frames(
+        s3_client=s3_client,
+        bucket_name=OUTPUT_BUCKET,
+        key=key,
+        frames=_model_frames(),
+        part_size=plan[PLAN_S3_PART_SIZE],
     )
 
-    salesforce_last_checked_datetime = json.loads(
-        ssm_client.get_parameter(Name=LAST_CHECKED_KEY)["Parameter"]["Value"]
+    if ids is None:
+        item = {
+            "as_at_datetime": {
+                "S": str(
+                    datetime.datetime.fromisoformat(now.replace("T", " ")).timestamp()
+                )
+            },
+            "records": {"N": str(records)},
+            # partition of the index ScheduleNextRun queries recent runs through
+            "entity": {"S": query_entity},
+        }
+        if execution_id:
+            item["execution_id"] = {"S": execution_id}
+        ddb_client.put_item(TableName=query_entity, Item=item)
+
+    df_lookup = pd.concat([pd.DataFrame()] + lookups)
+
+    return change_file_info(info=info, keys=[key]), df_lookup
+
+
+def _extract_all(
+    query_entities: List[str],
+    since: List[Optional[str]],
+    ids: List[Optional[List[str]]],
+    now: str,
+    org: Dict[str, str] = DEFAULT_ORG,
+    execution_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Extract every entity and write the lookup, returning the step output
+    """
+    plan = plan_chunks(
+        overrides={
+            PLAN_SALESFORCE_BATCH_SIZE: (
+                int(os.environ[ENV_SALESFORCE_BATCH_SIZE])
+                if os.environ.get(ENV_SALESFORCE_BATCH_SIZE)
+                else None
+            )
+        },
+        workers=min(EXTRACT_PROCESSES, len(query_entities)),
+    )
+    extract = functools.partial(
+        _extract, now=now, plan=plan, org=org, execution_id=execution_id
     )
+    if EXTRACT_PROCESSES > 1:
+        # each entity in its own process so the DataFrame work uses every core - spawned
+        # rather than forked so no boto3 client is shared between processes
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(EXTRACT_PROCESSES, len(query_entities)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            results = list(executor.map(extract, query_entities, since, ids))
+    else:
+        results = list(map(extract, query_entities, since, ids))
 
-    print(json.dumps(salesforce_last_checked_datetime, indent=2, default=str))
+    files_written = dict()
+    for query_entity, (file_info, _) in zip(query_entities, results):
+        files_written[work[query_entity][FLD_MODEL]] = file_info
+    # one concat of every entity's rows rather than copying the lookup per entity
+    df_lookup = pd.concat([pd.DataFrame()] + [df for _, df in results])
+
+    key = f"{org[FLD_ORG_PREFIX]}{LOOKUP_FILE}"
+
+    put_csv(
+        s3_client=s3_client,
+        bucket_name=OUTPUT_BUCKET,
+        key=key,
+        df=df_lookup,
+        part_size=plan[PLAN_S3_PART_SIZE],
+    )
 
-    domain, access_token = get_access_token(PS_SALESFORCE_EVENT_ROOT)
+    return {
+        ENV_UPDATE_FROM_SALESFORCE_BUCKET: OUTPUT_BUCKET,
+        FLD_SALESFORCE_CHANGE_FILES: files_written,
+        FLD_LOOKUP_FILE: key,
+    }
 
-    now = date_now_as_sf_str()
-    # sleep to ensure no records missed at the snapshot time
-    time.sleep(2)
 
-    print(f"Collecting data at {now}")
+def _retry_quarantine() -> Dict[str, Any]:
+    """
+    Read back just the records quarantined by earlier runs, leaving the watermark alone
+    """
+    # only the default org's - the records of other orgs cannot be read back from it
+    quarantined, dead_letter_files = read_quarantined_ids(
+        bucket_name=OUTPUT_BUCKET, skip_prefixes=[ORGS_PREFIX]
+    )
+    query_entities = list(work.keys())
+    ids = [sorted(quarantined.get(work[e][FLD_MODEL], set())) for e in query_entities]
+    for query_entity, entity_ids in zip(query_entities, ids):
+        print(f"Retrying {len(entity_ids)} quarantined {query_entity} records")
+
+    output = _extract_all(
+        query_entities=query_entities,
+        since=[None] * len(query_entities),
+        ids=ids,
+        now=date_now_as_sf_str(),
+    )
+    output[FLD_DEAD_LETTER_FILES] = dead_letter_files
 
-    files_written = dict()
-    df_lookup = pd.DataFrame()
-    for query_entity, info in work.items():
-        print(f"Processing {query_entity}")
-
-        query = f"{info[FLD_QUERY]} LastModifiedDate > {salesforce_last_checked_datetime[query_entity]}"
-
-        df = query_to_df(query=query, domain=domain, access_token=access_token)
-
-        ddb_client.put_item(
-            TableName=query_entity,
-            Item={
-                "as_at_datetime": {
-                    "S": str(
-                        datetime.datetime.fromisoformat(
-                            now.replace("T", " ")
-                        ).timestamp()
-                    )
-                },
-                "records": {"N": str(len(df))},
-            },
-        )
+    return output
 
-        if len(df) != 0:
-            df.columns = [x.lower() for x in df.columns]
-            df[FLD_MODEL] = info[FLD_MODEL]
-            df = df.rename(columns=info[FLD_RENAMER])
-            df_lookup = pd.concat([df_lookup, df[["id", "salesforce_id", FLD_MODEL]]])
 
-        key = f"{FROM_SALESFORCE_FILESTUB}-{query_entity}.csv"
+@profiled(bucket_name=OUTPUT_BUCKET, name="GetSalesforceChanges")
+def lambda_handler(event, _context):
+    if event.get(FLD_RETRY_QUARANTINE, False):
+        return pass_explain(event=event, output=_retry_quarantine())
 
-        s3_client.put_object(
-            Body=df.to_csv(encoding="utf-8", index=False, lineterminator="\n"),
-            Bucket=OUTPUT_BUCKET,
-            Key=key,
-        )
+    org = event.get(FLD_ORG, DEFAULT_ORG)
+    print(f"Extracting org {org[FLD_ORG_NAME]}")
+    watermark_key = last_checked_key(event_root=org[FLD_ORG_EVENT_ROOT])
 
-        return_dict = dict()
-        return_dict[FLD_FIELDS_TO_UPDATE] = info[FLD_FIELDS_TO_UPDATE]
-        return_dict[FLD_FIELDS_TO_JOIN] = info[FLD_FIELDS_TO_JOIN]
-        return_dict[FLD_FIELDS_TO_NULL] = info[FLD_FIELDS_TO_NULL]
-        return_dict[FLD_FILES_WRITTEN] = [key]
+    salesforce_last_checked_datetime = json.loads(
+        ssm_client.get_parameter(Name=watermark_key)["Parameter"]["Value"]
+    )
 
-        files_written[info[FLD_MODEL]] = return_dict
+    print(json.dumps(salesforce_last_checked_datetime, indent=2, default=str))
 
-        salesforce_last_checked_datetime[query_entity] = now
+    now = date_now_as_sf_str()
+    # sleep to ensure no records missed at the snapshot time
+    time.sleep(2)
 
-    key = "salesforce_salesforceobject.csv"
+    print(f"Collecting data at {now}")
 
-    s3_client.put_object(
-        Body=df_lookup.to_csv(encoding="utf-8", index=False, lineterminator="\n"),
-        Bucket=OUTPUT_BUCKET,
-        Key=key,
+    query_entities = list(work.keys())
+    output = _extract_all(
+        query_entities=query_entities,
+        since=[salesforce_last_checked_datetime[e] for e in query_entities],
+        ids=[None] * len(query_entities),
+        now=now,
+        org=org,
+        execution_id=event.get(FLD_EXECUTION_ID),
     )
 
-    ssm_client.put_parameter(
-        Name=LAST_CHECKED_KEY,
-        Value=json.dumps(salesforce_last_checked_datetime),
-        Type="String",
-        Overwrite=True,
-    )
+    for query_entity in query_entities:
+        salesforce_last_checked_datetime[query_entity] = now
 
-    return {
-        ENV_UPDATE_FROM_SALESFORCE_BUCKET: OUTPUT_BUCKET,
-        FLD_SALESFORCE_CHANGE_FILES: files_written,
+    output[FLD_WATERMARK] = {
+        FLD_WATERMARK_PARAMETER: watermark_key,
+        FLD_WATERMARK_VALUE: json.dumps(salesforce_last_checked_datetime),
     }
+
+    return pass_explain(event=event, output=output)
@@ -0,0 +1,169 @@
+import datetime
+import json
+import os
+
+import boto3
+import pandas as pd
+from cddo.utils.constants import (
+    ENV_UPDATE_FROM_SALESFORCE_BUCKET,
+    FLD_MODEL,
+    FLD_QUERY,
+    FLD_SALESFORCE_CHANGE_FILES,
+    FROM_SALESFORCE_FILESTUB,
+    PS_SALESFORCE_EVENT_ROOT,
+)
+from cddo.utils.salesforce import get_access_token, query_to_df
+
+from db_engine import connect
+from id_mapping import FLD_USE_ID_MAPPING
+from reconcile import (
+    FLD_OBJECT_ID,
+    FLD_SALESFORCE_ID,
+    differing_buckets,
+    dnswatch_bucket_ids,
+    dnswatch_digests,
+    salesforce_digests,
+)
+from salesforce_work import (
+    FLD_LOOKUP_FILE,
+    FLD_SALESFORCE_OBJECT,
+    LOOKUP_COLUMNS,
+    LOOKUP_FILE,
+    change_file_info,
+    query_ids,
+    to_model_frame,
+    work,
+)
+
+# buckets the id space of each model is split in to - more buckets narrow each repair
+ENV_RECONCILE_BUCKETS = "CDDO_RECONCILE_BUCKETS"
+RECONCILE_BUCKETS = int(os.environ.get(ENV_RECONCILE_BUCKETS, "256"))
+
+APPLICATION_NAME = "ReconcileSalesforce"
+OUTPUT_BUCKET = os.environ[ENV_UPDATE_FROM_SALESFORCE_BUCKET]
+RECONCILE_PREFIX = "reconcile"
+
+s3_client = boto3.client("s3")
+
+
+def _salesforce_projection(
+    salesforce_object: str, domain: str, access_token: str
+) -> pd.DataFrame:
+    """
+    (object_id, salesforce_id) of every record with a DNSWatch id - two columns rather
+    than the full records a reload reads
+    """
+    df = query_to_df(
+        query=f"select Id, external_id__c from {salesforce_object} where external_id__c != null",
+        domain=domain,
+        access_token=access_token,
+    )
+    if len(df) == 0:
+        return pd.DataFrame(columns=[FLD_OBJECT_ID, FLD_SALESFORCE_ID])
+
+    df.columns = [x.lower() for x in df.columns]
+    object_ids = pd.to_numeric(df["external_id__c"], errors="coerce")
+    # rows the loaders would quarantine are left out so they are not reported every time
+    df = df.loc[object_ids.notna() & (object_ids % 1 == 0)]
+    return pd.DataFrame(
+        {
+            FLD_OBJECT_ID: object_ids[df.index].astype("int64").astype(str),
+            FLD_SALESFORCE_ID: df["id"],
+        }
+    )
+
+
+def lambda_handler(_event, _context):
+    """
+    Compare salesforce with salesforce_salesforceobject bucket by bucket and read back
+    from salesforce only the records in buckets which differ, writing them as the usual
+    change files so FinaliseSalesforceUpdate repairs them. Rows DNSWatch holds which
+    salesforce no longer has are reported but, as with polling, left in place
+    """
+    run_id = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+    prefix = f"{RECONCILE_PREFIX}/{run_id}"
+    domain, access_token = get_access_token(PS_SALESFORCE_EVENT_ROOT)
+
+    report = dict()
+    files_written = dict()
+    lookups = [pd.DataFrame()]
+    with connect(application_name=APPLICATION_NAME) as db_conn:
+        for query_entity, info in work.items():
+            model = info[FLD_MODEL]
+            projection, sf_digests = salesforce_digests(
+                df=_salesforce_projection(
+                    salesforce_object=info[FLD_SALESFORCE_OBJECT],
+                    domain=domain,
+                    access_token=access_token,
+                ),
+                buckets=RECONCILE_BUCKETS,
+            )
+            db_digests = dnswatch_digests(
+                db_conn=db_conn, model=model, buckets=RECONCILE_BUCKETS
+            )
+            differing = differing_buckets(salesforce=sf_digests, dnswatch=db_digests)
+
+            repair = projection.loc[projection["bucket"].isin(differing)]
+            dnswatch_ids = (
+                dnswatch_bucket_ids(
+                    db_conn=db_conn,
+                    model=model,
+                    buckets=RECONCILE_BUCKETS,
+                    bucket_list=differing,
+                )
+                if differing
+                else set()
+            )
+            db_conn.commit()
+
+            report[query_entity] = {
+                "salesforce_rows": len(projection),
+                "dnswatch_rows": sum([rows for rows, _ in db_digests.values()]),
+                "buckets": RECONCILE_BUCKETS,
+                "differing_buckets": len(differing),
+                "rows_to_repair": len(repair),
+                "missing_in_salesforce": len(
+                    dnswatch_ids - set(repair[FLD_OBJECT_ID].tolist())
+                ),
+            }
+            print(f"{query_entity}: {report[query_entity]}")
+
+            df = query_ids(
+                query=info[FLD_QUERY],
+                ids=sorted(repair[FLD_SALESFORCE_ID].tolist()),
+                domain=domain,
+                access_token=access_token,
+            )
+            if len(df) != 0:
+                df = to_model_frame(df=df, info=info)
+                lookups.append(df[LOOKUP_COLUMNS])
+
+            key = f"{prefix}/{FROM_SALESFORCE_FILESTUB}-{query_entity}.csv"
+            s3_client.put_object(
+                Body=df.to_csv(encoding="utf-8", index=False, lineterminator="\n"),
+                Bucket=OUTPUT_BUCKET,
+                Key=key,
+            )
+            files_written[model] = change_file_info(info=info, keys=[key])
+
+    lookup_key = f"{prefix}/{LOOKUP_FILE}"
+    s3_client.put_object(
+        Body=pd.concat(lookups).to_csv(
+            encoding="utf-8", index=False, lineterminator="\n"
+        ),
+        Bucket=OUTPUT_BUCKET,
+        Key=lookup_key,
+    )
+    s3_client.put_object(
+        Body=json.dumps(report, indent=2),
+        Bucket=OUTPUT_BUCKET,
+        Key=f"{prefix}/report.json",
+    )
+
+    return {
+        ENV_UPDATE_FROM_SALESFORCE_BUCKET: OUTPUT_BUCKET,
+        FLD_SALESFORCE_CHANGE_FILES: files_written,
+        FLD_LOOKUP_FILE: lookup_key,
+        # the mapping would drop the very rows which have drifted from it
+        FLD_USE_ID_MAPPING: False,
+    }
@@ -0,0 +1,156 @@
+import json
+import os
+import time
+
+import boto3
+
+ENV_LEASE_TABLE = "CDDO_LEASE_TABLE"
+ENV_LEASE_SECONDS = "CDDO_LEASE_SECONDS"
+
+FLD_ACTION = "action"
+FLD_EXECUTION_ID = "executionId"
+FLD_STATE_MACHINE_ARN = "stateMachineArn"
+FLD_ACQUIRED = "acquired"
+FLD_COALESCED = "coalesced"
+# the execution input, passed to acquire so it can tell a polling run from the rest
+FLD_INPUT = "input"
+# inputs of runs which wait for the lease rather than coalescing in to a follow up run,
+# as their work is not a poll the follow up would repeat
+WAITING_TRIGGERS = ["changeDataCapture", "reconcile"]
+
+ACTION_ACQUIRE = "acquire"
+ACTION_HEARTBEAT = "heartbeat"
+ACTION_RELEASE = "release"
+
+# one lease for the whole update - only one execution may touch the staging table and watermark
+LEASE_ID = "SendSalesforceUpdatesToDNSWatch"
+
+LEASE_TABLE = os.environ[ENV_LEASE_TABLE]
+LEASE_SECONDS = int(os.environ.get(ENV_LEASE_SECONDS, "1200"))
+
+ddb_client = boto3.client("dynamodb")
+sfn_client = boto3.client("stepfunctions")
+
+
+class LeaseLostError(Exception):
+    """
+    Another execution took the lease over after it expired
+    """
+
+
+def _acquire(execution_id: str, coalesce: bool = True, attempts: int = 2) -> dict:
+    """
+    Take the lease if it is free, expired or already ours. Otherwise, for a polling run,
+    flag that a run was asked for while the lease was held so the holder starts one
+    follow up run when it releases - however many triggers arrive they coalesce in to
+    that one run. Runs which are not coalesced wait and try again instead
+    """
+    now = int(time.time())
+    try:
+        response = ddb_client.put_item(
+            TableName=LEASE_TABLE,
+            Item={
+                "lease_id": {"S": LEASE_ID},
+                "owner": {"S": execution_id},
+                "expires_at": {"N": str(now + LEASE_SECONDS)},
+                "pending": {"BOOL": False},
+            },
+            ConditionExpression="attribute_not_exists(lease_id) OR expires_at < :now OR #owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={
+                ":now": {"N": str(now)},
+                ":owner": {"S": execution_id},
+            },
+            ReturnValues="ALL_OLD",
+        )
+    except ddb_client.exceptions.ConditionalCheckFailedException:
+        if not coalesce:
+            print(f"Run already in progress - {execution_id} waits for the lease")
+            return {FLD_ACQUIRED: False}
+        try:
+            ddb_client.update_item(
+                TableName=LEASE_TABLE,
+                Key={"lease_id": {"S": LEASE_ID}},
+                UpdateExpression="SET pending = :true",
+                ConditionExpression="attribute_exists(lease_id)",
+                ExpressionAttributeValues={":true": {"BOOL": True}},
+            )
+        except ddb_client.exceptions.ConditionalCheckFailedException:
+            # released in between so try to take it again
+            if attempts > 1:
+                return _acquire(
+                    execution_id=execution_id, coalesce=coalesce, attempts=attempts - 1
+                )
+            raise
+        print(
+            f"Run already in progress - {execution_id} coalesced in to a follow up run"
+        )
+        return {FLD_ACQUIRED: False}
+
+    previous = response.get("Attributes")
+    if previous and previous["owner"]["S"] != execution_id:
+        print(f"Took over expired lease from {previous['owner']['S']}")
+    return {FLD_ACQUIRED: True}
+
+
+def _heartbeat(execution_id: str) -> dict:
+    now = int(time.time())
+    try:
+        ddb_client.update_item(
+            TableName=LEASE_TABLE,
+            Key={"lease_id": {"S": LEASE_ID}},
+            UpdateExpression="SET expires_at = :expires",
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={
+                ":expires": {"N": str(now + LEASE_SECONDS)},
+                ":owner": {"S": execution_id},
+            },
+        )
+    except ddb_client.exceptions.ConditionalCheckFailedException:
+        raise LeaseLostError(f"Lease no longer held by {execution_id}")
+    return {FLD_ACQUIRED: True}
+
+
+def _release(execution_id: str, state_machine_arn: str) -> dict:
+    try:
+        response = ddb_client.delete_item(
+            TableName=LEASE_TABLE,
+            Key={"lease_id": {"S": LEASE_ID}},
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames={"#owner": "owner"},
+            ExpressionAttributeValues={":owner": {"S": execution_id}},
+            ReturnValues="ALL_OLD",
+        )
+    except ddb_client.exceptions.ConditionalCheckFailedException:
+        print(f"Lease no longer held by {execution_id} - nothing to release")
+        return {FLD_ACQUIRED: False}
+
+    if response["Attributes"].get("pending", {}).get("BOOL", False):
+        print("Runs were requested during this run - starting one follow up run")
+        sfn_client.start_execution(
+            stateMachineArn=state_machine_arn,
+            input=json.dumps({FLD_COALESCED: True}),
+        )
+    return {FLD_ACQUIRED: False}
+
+
+def lambda_handler(event, _context):
+    action = event[FLD_ACTION]
+    execution_id = event[FLD_EXECUTION_ID]
+
+    if action == ACTION_ACQUIRE:
+        execution_input = event.get(FLD_INPUT, {})
+        return _acquire(
+            execution_id=execution_id,
+            coalesce=not any([t in execution_input for t in WAITING_TRIGGERS]),
+        )
+    elif action == ACTION_HEARTBEAT:
+        return _heartbeat(execution_id=execution_id)
+    elif action == ACTION_RELEASE:
+        return _release(
+            execution_id=execution_id,
+            state_machine_arn=event[FLD_STATE_MACHINE_ARN],
+        )
+
+    raise ValueError(f"Unknown lease action <{action}>")
@@ -0,0 +1,106 @@
+import datetime
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+import boto3
+
+from schedule_policy import next_interval_minutes, runs_from_stats
+
+ENV_STATS_TABLES = "CDDO_STATS_TABLES"
+ENV_STATS_INDEX = "CDDO_STATS_INDEX"
+ENV_SCHEDULER_ROLE_ARN = "CDDO_SCHEDULER_ROLE_ARN"
+ENV_SCHEDULE_MIN_MINUTES = "CDDO_SCHEDULE_MIN_MINUTES"
+ENV_SCHEDULE_MAX_MINUTES = "CDDO_SCHEDULE_MAX_MINUTES"
+
+FLD_STATE_MACHINE_ARN = "stateMachineArn"
+FLD_SCHEDULED_BY = "scheduledBy"
+# the input which started the execution - runs started with any of NOT_POLLING in it
+# are not polling runs, so leave the schedule as it is
+FLD_INPUT = "input"
+NOT_POLLING = ["changeDataCapture", "reconcile"]
+
+STATS_TABLES = os.environ[ENV_STATS_TABLES].split(",")
+STATS_INDEX = os.environ[ENV_STATS_INDEX]
+SCHEDULER_ROLE_ARN = os.environ[ENV_SCHEDULER_ROLE_ARN]
+SCHEDULE_MIN_MINUTES = int(os.environ.get(ENV_SCHEDULE_MIN_MINUTES, "5"))
+SCHEDULE_MAX_MINUTES = int(os.environ.get(ENV_SCHEDULE_MAX_MINUTES, "60"))
+
+# one pending adaptive run at a time - each run moves it rather than adding another
+SCHEDULE_NAME = "NextSalesforceUpdate"
+
+ddb_client = boto3.client("dynamodb")
+scheduler_client = boto3.client("scheduler")
+
+
+def _recent_stats(since: float) -> List[Tuple[str, int, Optional[str]]]:
+    items = []
+    paginator = ddb_client.get_paginator("query")
+    for table in STATS_TABLES:
+        # each table holds one entity's runs, named as the table is
+        for page in paginator.paginate(
+            TableName=table,
+            IndexName=STATS_INDEX,
+            KeyConditionExpression="entity = :entity AND as_at_datetime > :since",
+            ExpressionAttributeValues={
+                ":entity": {"S": table},
+                ":since": {"S": str(since)},
+            },
+        ):
+            items.extend(
+                [
+                    (
+                        i["as_at_datetime"]["S"],
+                        int(i["records"]["N"]),
+                        # only recorded by the orgs of a multi-org run
+                        i.get("execution_id", {}).get("S"),
+                    )
+                    for i in page["Items"]
+                ]
+            )
+    return items
+
+
+def _schedule_run(state_machine_arn: str, at: datetime.datetime) -> None:
+    schedule = {
+        "Name": SCHEDULE_NAME,
+        "ScheduleExpression": f"at({at.strftime('%Y-%m-%dT%H:%M:%S')})",
+        "ScheduleExpressionTimezone": "UTC",
+        "FlexibleTimeWindow": {"Mode": "OFF"},
+        "ActionAfterCompletion": "DELETE",
+        "Target": {
+            "Arn": state_machine_arn,
+            "RoleArn": SCHEDULER_ROLE_ARN,
+            "Input": json.dumps({FLD_SCHEDULED_BY: SCHEDULE_NAME}),
+        },
+    }
+    try:
+        scheduler_client.update_schedule(**schedule)
+    except scheduler_client.exceptions.ResourceNotFoundException:
+        # the last one time schedule has fired and deleted itself
+        scheduler_client.create_schedule(**schedule)
+
+
+def lambda_handler(event, _context):
+    execution_input = event.get(FLD_INPUT, dict())
+    if any(f in execution_input for f in NOT_POLLING):
+        print("Not a polling run - the next run is left as scheduled")
+        return {"intervalMinutes": None, "nextRunAt": None}
+
+    now = time.time()
+    runs = runs_from_stats(_recent_stats(since=now - 3 * SCHEDULE_MAX_MINUTES * 60))
+
+    minutes = next_interval_minutes(
+        runs=runs, min_minutes=SCHEDULE_MIN_MINUTES, max_minutes=SCHEDULE_MAX_MINUTES
+    )
+    at = datetime.datetime.fromtimestamp(now, datetime.UTC) + datetime.timedelta(
+        minutes=minutes
+    )
+    _schedule_run(state_machine_arn=event[FLD_STATE_MACHINE_ARN], at=at)
+
+    print(
+        f"{runs[-1][1] if runs else 0} records changed in the last run - "
+        f"next run in {minutes} minutes at {at.isoformat()}"
+    )
+    return {"intervalMinutes": minutes, "nextRunAt": at.isoformat()}
@@ -0,0 +1,149 @@
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import boto3
+import sqlalchemy
+
+from sql_statements import TEMP_TABLE
+
+# rows per merge batch - 0 merges the whole staging table in one statement and "auto"
+# starts from a size planned from the memory the function has free
+ENV_MERGE_BATCH_SIZE = "CDDO_MERGE_BATCH_SIZE"
+MERGE_BATCH_SIZE_AUTO = "auto"
+# batch duration to aim for, so the time row locks are held stays bounded
+ENV_MERGE_TARGET_SECONDS = "CDDO_MERGE_TARGET_SECONDS"
+
+MERGE_BATCH_AUTO = os.environ.get(ENV_MERGE_BATCH_SIZE) == MERGE_BATCH_SIZE_AUTO
+MERGE_BATCH_SIZE = (
+    0 if MERGE_BATCH_AUTO else int(os.environ.get(ENV_MERGE_BATCH_SIZE, "0"))
+)
+MERGE_TARGET_SECONDS = float(os.environ.get(ENV_MERGE_TARGET_SECONDS, "0.5"))
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 50000
+
+SEQ_COLUMN = "merge_seq"
+PROGRESS_PREFIX = "merge-progress"
+
+s3_client = boto3.client("s3")
+
+
+def ranged(statement: str) -> str:
+    """
+    Restrict a merge statement, which already has a WHERE clause over the staging
+    table, to the staged rows of one batch
+    """
+    return f"{statement} AND {SEQ_COLUMN} > %(lo)s AND {SEQ_COLUMN} <= %(hi)s"
+
+
+def number_staged_rows(db_conn: sqlalchemy.Connection, order_by: List[str]) -> int:
+    """
+    Number the staged rows in key order so batches can be walked, and resumed, by
+    sequence range. Returns the number of rows
+    """
+    for statement in [
+        f"ALTER TABLE {TEMP_TABLE} ADD COLUMN {SEQ_COLUMN} BIGINT",
+        f"UPDATE {TEMP_TABLE} tt SET {SEQ_COLUMN} = s.rn FROM "
+        f"(SELECT ctid AS row_ctid, row_number() OVER (ORDER BY {','.join(order_by)}) AS rn FROM {TEMP_TABLE}) s "
+        "WHERE tt.ctid = s.row_ctid",
+        f"CREATE INDEX ON {TEMP_TABLE} ({SEQ_COLUMN})",
+        f"ANALYZE {TEMP_TABLE}",
+    ]:
+        db_conn.execute(sqlalchemy.sql.text(statement))
+
+    return db_conn.execute(
+        sqlalchemy.sql.text(f"SELECT coalesce(max({SEQ_COLUMN}), 0) FROM {TEMP_TABLE}")
+    ).scalar()
+
+
+def _progress_key(label: str) -> str:
+    return f"{PROGRESS_PREFIX}/{label}.json"
+
+
+def _load_progress(
+    bucket_name: str, label: str, version: str
+) -> Optional[Dict[str, Any]]:
+    try:
+        progress = json.loads(
+            s3_client.get_object(Bucket=bucket_name, Key=_progress_key(label))[
+                "Body"
+            ].read()
+        )
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    # only resume a walk over the same version of the input file
+    return progress if progress["version"] == version else None
+
+
+def _next_batch_size(batch_size: int, elapsed: float, target: float) -> int:
+    scale = min(max(target / max(elapsed, 0.001), 0.5), 2.0)
+    return min(max(int(batch_size * scale), MIN_BATCH_SIZE), MAX_BATCH_SIZE)
+
+
+def merge_in_batches(
+    db_conn: sqlalchemy.Connection,
+    execute: Callable[[List[str], Dict[str, Any]], List[int]],
+    statements: List[str],
+    total: int,
+    bucket_name: str,
+    label: str,
+    version: str,
+    stats: Dict[str, Any],
+    batch_size: int = MERGE_BATCH_SIZE,
+    target_seconds: float = MERGE_TARGET_SECONDS,
+) -> List[int]:
+    """
+    Apply the merge statements to the numbered staging table in key ordered batches,
+    committing each batch so row locks on the DNSWatch tables are only held for one
+    batch. The batch size adapts towards target_seconds per batch. Progress is saved to
+    s3 after every commit so a retry of the same input file resumes where it stopped
+    """
+    progress = _load_progress(bucket_name=bucket_name, label=label, version=version)
+    if progress is None:
+        progress = {"version": version, "seq": 0, "rowcounts": [0] * len(statements)}
+    else:
+        print(f"Resuming {label} after row {progress['seq']} of {total}")
+
+    first_seq = progress["seq"]
+    batches = 0
+    longest = 0.0
+    start = time.perf_counter()
+    while progress["seq"] < total:
+        lo = progress["seq"]
+        hi = min(lo + batch_size, total)
+
+        batch_start = time.perf_counter()
+        rowcounts = execute(
+            [ranged(s) for s in statements],
+            {"lo": lo, "hi": hi},
+        )
+        db_conn.commit()
+        elapsed = time.perf_counter() - batch_start
+
+        progress["seq"] = hi
+        progress["rowcounts"] = [
+            a + b for a, b in zip(progress["rowcounts"], rowcounts)
+        ]
+        s3_client.put_object(
+            Body=json.dumps(progress),
+            Bucket=bucket_name,
+            Key=_progress_key(label),
+        )
+
+        batches += 1
+        longest = max(longest, elapsed)
+        batch_size = _next_batch_size(
+            batch_size=batch_size, elapsed=elapsed, target=target_seconds
+        )
+
+    s3_client.delete_object(Bucket=bucket_name, Key=_progress_key(label))
+
+    seconds = time.perf_counter() - start
+    stats["merge_batches"] = batches
+    stats["longest_batch_seconds"] = round(longest, 3)
+    stats["merge_rows_per_second"] = (
+        round((total - first_seq) / seconds, 1) if seconds else None
+    )
+
+    return progress["rowcounts"]
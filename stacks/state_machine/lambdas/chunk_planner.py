@@ -0,0 +1,99 @@
+import os
+import resource
+from typing import Dict, Optional, Tuple
+
+from batched_merge import MAX_BATCH_SIZE, MIN_BATCH_SIZE
+
+# set by the Lambda runtime - elsewhere, e.g. on Fargate, the cgroup limit is used
+ENV_MEMORY_SIZE = "AWS_LAMBDA_FUNCTION_MEMORY_SIZE"
+# share of the memory not yet in use which the planned chunks may take
+ENV_CHUNK_MEMORY_FRACTION = "CDDO_CHUNK_MEMORY_FRACTION"
+CHUNK_MEMORY_FRACTION = float(os.environ.get(ENV_CHUNK_MEMORY_FRACTION, "0.5"))
+
+CGROUP_MEMORY_LIMITS = [
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+]
+MIB = 1024 * 1024
+
+PLAN_SALESFORCE_BATCH_SIZE = "salesforce_batch_size"
+PLAN_S3_PART_SIZE = "s3_part_size"
+PLAN_CSV_CHUNK_ROWS = "csv_chunk_rows"
+PLAN_MERGE_BATCH_SIZE = "merge_batch_size"
+
+# generous estimates of the memory one row takes at each stage - a salesforce page is
+# held as json, parsed records and a DataFrame at once, a csv chunk as a DataFrame and
+# the to_sql parameters
+SALESFORCE_ROW_BYTES = 4096
+CSV_ROW_BYTES = 2048
+
+# salesforce accepts a batchSize of 200 to 2000, s3 parts other than the last must be at
+# least 5 MiB and the merge batch limits are batched_merge's
+LIMITS = {
+    PLAN_SALESFORCE_BATCH_SIZE: (200, 2000),
+    PLAN_S3_PART_SIZE: (5 * MIB, 100 * MIB),
+    PLAN_CSV_CHUNK_ROWS: (1000, 100000),
+    PLAN_MERGE_BATCH_SIZE: (MIN_BATCH_SIZE, MAX_BATCH_SIZE),
+}
+
+
+def memory_limit_bytes() -> int:
+    if os.environ.get(ENV_MEMORY_SIZE):
+        return int(os.environ[ENV_MEMORY_SIZE]) * MIB
+
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in CGROUP_MEMORY_LIMITS:
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # "max", or a huge v1 value, when the container has no limit of its own
+        if limit.isdigit() and int(limit) < physical:
+            return int(limit)
+    return physical
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak rather than current, in KiB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _clamp(value: int, limits: Tuple[int, int]) -> int:
+    return int(min(max(value, limits[0]), limits[1]))
+
+
+def plan_chunks(
+    overrides: Optional[Dict[str, Optional[int]]] = None, workers: int = 1
+) -> Dict[str, int]:
+    """
+    Page, part, chunk and batch sizes which fit the memory this function has left,
+    split between workers processes. Sizes given in overrides, i.e. set explicitly by
+    environment variable, are used as they are
+    """
+    limit = memory_limit_bytes()
+    rss = rss_bytes()
+    budget = max(limit - rss, 0) * CHUNK_MEMORY_FRACTION / max(workers, 1)
+
+    plan = {
+        # a page is held along with the part it is written to and the lookup rows kept
+        PLAN_SALESFORCE_BATCH_SIZE: budget / 8 / SALESFORCE_ROW_BYTES,
+        PLAN_S3_PART_SIZE: budget / 8,
+        PLAN_CSV_CHUNK_ROWS: budget / 2 / CSV_ROW_BYTES,
+        # the starting size only - batched_merge adapts it to the batch timings
+        PLAN_MERGE_BATCH_SIZE: budget / 2 / CSV_ROW_BYTES,
+    }
+    plan = {k: _clamp(int(v), LIMITS[k]) for k, v in plan.items()}
+    for k, v in (overrides or {}).items():
+        if v is not None:
+            plan[k] = v
+
+    print(
+        f"Chunk plan: memory {limit // MIB} MiB, rss {rss // MIB} MiB, "
+        f"budget {int(budget) // MIB} MiB per worker -> {plan}"
+    )
+    return plan
@@ -0,0 +1,83 @@
+import os
+from typing import Optional
+
+import sqlalchemy
+from cddo.utils.postgres import get_db_engine
+
+ENV_RDS_SECRET_NAME = "RDS_SECRET_NAME"
+# set when the stack puts an RDS Proxy in front of the database. The finalise merge
+# runs as server side prepared statements, which pin the connection for its session,
+# so the proxy bounds and reuses connections rather than multiplexing transactions
+ENV_RDS_PROXY_ENDPOINT = "CDDO_RDS_PROXY_ENDPOINT"
+# connect straight to this url rather than via the secret, e.g. a local postgres
+ENV_DATABASE_URL = "CDDO_DATABASE_URL"
+
+POOL_SIZE = 1
+# room for the lock monitor side connection
+POOL_MAX_OVERFLOW = 1
+POOL_RECYCLE_SECONDS = 1800
+
+# kept at module scope so the secret read and the TLS connection set up are paid once
+# per execution environment rather than once per invocation
+_engine: Optional[sqlalchemy.Engine] = None
+
+
+def _database_url() -> sqlalchemy.URL:
+    if os.environ.get(ENV_DATABASE_URL):
+        return sqlalchemy.make_url(os.environ[ENV_DATABASE_URL])
+
+    # only used to read the credentials from secrets manager and build the url
+    secret_engine = get_db_engine(rds_secret_name=os.environ[ENV_RDS_SECRET_NAME])
+    url = secret_engine.url
+    secret_engine.dispose()
+
+    if os.environ.get(ENV_RDS_PROXY_ENDPOINT):
+        url = url.set(host=os.environ[ENV_RDS_PROXY_ENDPOINT])
+    return url
+
+
+def get_engine(application_name: str) -> sqlalchemy.Engine:
+    """
+    Engine for the DNSWatch database, created on first use and reused by warm
+    invocations. Connections are pinged on checkout so one dropped while the
+    environment was frozen is replaced rather than failing the run
+    """
+    global _engine
+    if _engine is None:
+        _engine = sqlalchemy.create_engine(
+            _database_url(),
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=POOL_RECYCLE_SECONDS,
+            connect_args={"application_name": application_name},
+        )
+    return _engine
+
+
+def reset_engine(close: bool = True) -> None:
+    """
+    Drop the cached engine so the next get_engine reads the secret again. With
+    close=False pooled connections are abandoned rather than closed, for use when the
+    connections cannot be trusted, e.g. after restoring from a snapshot
+    """
+    global _engine
+    if _engine is not None:
+        _engine.dispose(close=close)
+    _engine = None
+
+
+def connect(application_name: str) -> sqlalchemy.Connection:
+    """
+    Connect with the cached engine. An authentication failure means the secret has been
+    rotated since the engine was built so the engine is rebuilt, with the new
+    credentials, and the connection tried once more
+    """
+    try:
+        return get_engine(application_name=application_name).connect()
+    except sqlalchemy.exc.OperationalError as e:
+        if "authentication failed" not in str(e):
+            raise
+        print("Database authentication failed - reading the secret again")
+        reset_engine()
+        return get_engine(application_name=application_name).connect()
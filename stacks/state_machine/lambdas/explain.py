@@ -0,0 +1,168 @@
+import datetime
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional
+
+import boto3
+import psycopg
+
+# opt in with the environment variable or "explain": true in the execution input,
+# which GetSalesforceChanges passes on in its output
+ENV_EXPLAIN = "CDDO_FINALISE_EXPLAIN"
+FLD_EXPLAIN = "explain"
+
+EXPLAIN_PREFIX = "explain"
+LATEST_RUN = "latest"
+SUMMARY_FILE = "summary.json"
+SAVEPOINT = "explain_capture"
+
+s3_client = boto3.client("s3")
+
+
+def explain_enabled(event: Dict[str, Any]) -> bool:
+    return (
+        bool(event.get(FLD_EXPLAIN, False))
+        or os.environ.get(ENV_EXPLAIN, "false").lower() == "true"
+    )
+
+
+def pass_explain(event: Dict[str, Any], output: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Carry the opt in from a step's input on to its output, the next step's input
+    """
+    if FLD_EXPLAIN in event:
+        output[FLD_EXPLAIN] = event[FLD_EXPLAIN]
+    return output
+
+
+def _plan_nodes(plan: Dict[str, Any]) -> Iterator[str]:
+    node = plan["Node Type"]
+    if "Relation Name" in plan:
+        node = f"{node} on {plan['Relation Name']}"
+    if "Index Name" in plan:
+        node = f"{node} using {plan['Index Name']}"
+    yield node
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def explain_statements(
+    pg_conn: psycopg.Connection, statements: List[str], label: str
+) -> List[Dict[str, Any]]:
+    """
+    Run each statement under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) in a savepoint which
+    is rolled back afterwards. The statements run in order so each is planned against the
+    effects of the ones before it, exactly as the real execution which follows will be
+    """
+    plans = []
+    pg_conn.execute(f"SAVEPOINT {SAVEPOINT}")
+    try:
+        for statement in statements:
+            explained = pg_conn.execute(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}"
+            ).fetchone()[0][0]
+            plans.append(
+                {
+                    "label": label,
+                    "statement": statement,
+                    "planning_time_ms": explained.get("Planning Time"),
+                    "execution_time_ms": explained.get("Execution Time"),
+                    "nodes": list(_plan_nodes(explained["Plan"])),
+                    "plan": explained,
+                }
+            )
+    except psycopg.Error as e:
+        # profiling must never fail the run itself
+        print(f"Unable to explain statements for {label}: {e}")
+    finally:
+        pg_conn.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT}")
+        pg_conn.execute(f"RELEASE SAVEPOINT {SAVEPOINT}")
+
+    return plans
+
+
+def _summarise(plans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        p["statement"]: {
+            "label": p["label"],
+            "nodes": p["nodes"],
+            "execution_time_ms": p["execution_time_ms"],
+        }
+        for p in plans
+    }
+
+
+def _get_summary(bucket_name: str, run_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        body = s3_client.get_object(
+            Bucket=bucket_name, Key=f"{EXPLAIN_PREFIX}/{run_id}/{SUMMARY_FILE}"
+        )["Body"]
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(body.read())
+
+
+def compare_summaries(
+    previous: Dict[str, Any], current: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """
+    Statements whose plan shape changed between two runs, flagging any which now use a
+    sequential scan
+    """
+    changes = []
+    for statement, summary in current.items():
+        before = previous.get(statement)
+        if before is None or before["nodes"] == summary["nodes"]:
+            continue
+        changes.append(
+            {
+                "label": summary["label"],
+                "statement": statement,
+                "previous_nodes": before["nodes"],
+                "nodes": summary["nodes"],
+                "new_seq_scans": [
+                    n
+                    for n in summary["nodes"]
+                    if n.startswith("Seq Scan") and n not in before["nodes"]
+                ],
+                "previous_execution_time_ms": before["execution_time_ms"],
+                "execution_time_ms": summary["execution_time_ms"],
+            }
+        )
+    return changes
+
+
+def write_plans(bucket_name: str, plans: List[Dict[str, Any]]) -> str:
+    """
+    Write the captured plans to s3 under a timestamped run prefix, one file per statement
+    label plus a summary of plan shape and timing which is also kept as the "latest"
+    summary. Plan changes against the previous run are printed
+    """
+    run_id = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+    prefix = f"{EXPLAIN_PREFIX}/{run_id}"
+
+    by_label = dict()
+    for p in plans:
+        by_label.setdefault(p["label"], []).append(p)
+    for label, label_plans in by_label.items():
+        s3_client.put_object(
+            Body=json.dumps(label_plans, indent=2, sort_keys=True, default=str),
+            Bucket=bucket_name,
+            Key=f"{prefix}/{label}.json",
+        )
+
+    summary = _summarise(plans)
+    previous = _get_summary(bucket_name=bucket_name, run_id=LATEST_RUN)
+    if previous is not None:
+        for change in compare_summaries(previous=previous, current=summary):
+            print(f"Plan changed: {json.dumps(change, default=str)}")
+
+    for run in [run_id, LATEST_RUN]:
+        s3_client.put_object(
+            Body=json.dumps(summary, indent=2, sort_keys=True, default=str),
+            Bucket=bucket_name,
+            Key=f"{EXPLAIN_PREFIX}/{run}/{SUMMARY_FILE}",
+        )
+
+    print(f"Plans written to s3://{bucket_name}/{prefix}")
+    return prefix
@@ -0,0 +1,141 @@
+import io
+import os
+from typing import Dict, Tuple
+
+import boto3
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+
+# persistent copy of the (model, object_id) -> (salesforce_id, sso_id, content_type_id)
+# mapping held in salesforce_salesforceobject, so lookup rows which have not changed
+# can be dropped, and existing rows resolved, before anything reaches postgres
+ENV_ID_MAPPING = "CDDO_ID_MAPPING"
+ID_MAPPING = os.environ.get(ENV_ID_MAPPING, "true").lower() == "true"
+# false in the output of a step whose lookup must reach the database whatever the
+# mapping says, such as a reconciliation repairing drift the mapping cannot see
+FLD_USE_ID_MAPPING = "useIdMapping"
+
+ID_MAPPING_KEY = "id-mapping/salesforce_salesforceobject.npz"
+
+FLD_MODEL = "model"
+FLD_OBJECT_ID = "object_id"
+FLD_SALESFORCE_ID = "salesforce_id"
+FLD_SSO_ID = "sso_id"
+FLD_CONTENT_TYPE_ID = "content_type_id"
+
+# numpy types of the stored columns - fixed width so the file loads without pickle
+MAPPING_DTYPES = {
+    FLD_MODEL: "U100",
+    FLD_OBJECT_ID: "int64",
+    FLD_SALESFORCE_ID: "U255",
+    FLD_SSO_ID: "int64",
+    FLD_CONTENT_TYPE_ID: "int32",
+}
+MAPPING_ORDER_BY = [FLD_MODEL, FLD_OBJECT_ID]
+
+s3_client = boto3.client("s3")
+
+
+def empty_mapping() -> pd.DataFrame:
+    return pd.DataFrame({c: np.array([], dtype=t) for c, t in MAPPING_DTYPES.items()})
+
+
+def load_mapping(bucket_name: str) -> pd.DataFrame:
+    """
+    The mapping sorted by (model, object_id), or an empty mapping before the first run
+    has written one
+    """
+    try:
+        body = s3_client.get_object(Bucket=bucket_name, Key=ID_MAPPING_KEY)["Body"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise
+        print(f"No id mapping at {ID_MAPPING_KEY}")
+        return empty_mapping()
+
+    with np.load(io.BytesIO(body.read()), allow_pickle=False) as columns:
+        mapping = pd.DataFrame({c: columns[c] for c in MAPPING_DTYPES})
+    print(f"Loaded id mapping of {len(mapping)} rows")
+    return mapping
+
+
+def save_mapping(bucket_name: str, mapping: pd.DataFrame) -> None:
+    out = io.BytesIO()
+    np.savez_compressed(
+        out,
+        **{c: mapping[c].to_numpy(dtype=t) for c, t in MAPPING_DTYPES.items()},
+    )
+    s3_client.put_object(Body=out.getvalue(), Bucket=bucket_name, Key=ID_MAPPING_KEY)
+    print(f"Saved id mapping of {len(mapping)} rows")
+
+
+def _positions(mapping: pd.DataFrame, df: pd.DataFrame) -> np.ndarray:
+    """
+    Row of the mapping holding each (model, id) of df, or -1. The mapping is sorted so
+    each model is a contiguous run which is binary searched by object_id
+    """
+    positions = np.full(len(df), -1, dtype="int64")
+    models = mapping[FLD_MODEL].to_numpy()
+    object_ids = mapping[FLD_OBJECT_ID].to_numpy()
+    for model, rows in df.groupby(FLD_MODEL, sort=False).indices.items():
+        lo = np.searchsorted(models, model, side="left")
+        hi = np.searchsorted(models, model, side="right")
+        if lo == hi:
+            continue
+        wanted = df["id"].to_numpy(dtype="int64")[rows]
+        found = lo + np.searchsorted(object_ids[lo:hi], wanted)
+        hit = found < hi
+        hit[hit] = object_ids[found[hit]] == wanted[hit]
+        positions[rows[hit]] = found[hit]
+    return positions
+
+
+def classify(
+    mapping: pd.DataFrame, df: pd.DataFrame
+) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Drop the lookup rows whose salesforce id the mapping already holds and fill in
+    sso_id and content_type_id for rows the mapping knows with a new salesforce id.
+    Rows the mapping does not know keep sso_id 0 for postgres to resolve. df must have
+    passed validate_rows so id is int64
+    """
+    positions = _positions(mapping=mapping, df=df)
+    known = positions >= 0
+    unchanged = np.zeros(len(df), dtype=bool)
+    unchanged[known] = (
+        mapping[FLD_SALESFORCE_ID].to_numpy()[positions[known]]
+        == df[FLD_SALESFORCE_ID].astype(str).to_numpy()[known]
+    )
+
+    update = known & ~unchanged
+    sso_ids = np.zeros(len(df), dtype="int64")
+    sso_ids[update] = mapping[FLD_SSO_ID].to_numpy()[positions[update]]
+    content_type_ids = np.zeros(len(df), dtype="int32")
+    content_type_ids[update] = mapping[FLD_CONTENT_TYPE_ID].to_numpy()[
+        positions[update]
+    ]
+    df = df.assign(**{FLD_SSO_ID: sso_ids, FLD_CONTENT_TYPE_ID: content_type_ids})
+
+    counts = {
+        "unchanged": int(unchanged.sum()),
+        "updates": int(update.sum()),
+        "unknown": int((~known).sum()),
+    }
+    return df.loc[~unchanged], counts
+
+
+def update_mapping(mapping: pd.DataFrame, changed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the rows a run wrote to salesforce_salesforceobject, read back with their
+    sso_id and content_type_id, to the mapping. A row replaces the mapping's row for
+    the same (model, object_id)
+    """
+    if len(changed) == 0:
+        return mapping
+    changed = changed[list(MAPPING_DTYPES)].astype(MAPPING_DTYPES)
+    return (
+        pd.concat([mapping, changed], ignore_index=True)
+        .drop_duplicates(subset=MAPPING_ORDER_BY, keep="last")
+        .sort_values(MAPPING_ORDER_BY, kind="stable", ignore_index=True)
+    )
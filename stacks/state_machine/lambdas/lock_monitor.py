@@ -0,0 +1,160 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+import boto3
+import sqlalchemy
+
+ENV_LOCK_TIMEOUT = "CDDO_LOCK_TIMEOUT"
+ENV_STATEMENT_TIMEOUT = "CDDO_STATEMENT_TIMEOUT"
+ENV_LOCK_SAMPLE_SECONDS = "CDDO_LOCK_SAMPLE_SECONDS"
+
+LOCK_TIMEOUT = os.environ.get(ENV_LOCK_TIMEOUT, "5s")
+STATEMENT_TIMEOUT = os.environ.get(ENV_STATEMENT_TIMEOUT, "120s")
+LOCK_SAMPLE_SECONDS = float(os.environ.get(ENV_LOCK_SAMPLE_SECONDS, "0.5"))
+
+LOCKS_PREFIX = "lock-contention"
+
+# sessions currently blocking the work connection and the relations they hold locks on
+BLOCKERS_SQL = """
+SELECT blocker.pid, blocker.usename, blocker.application_name, blocker.client_addr::text AS client_addr,
+       blocker.state, left(blocker.query, 500) AS query,
+       string_agg(DISTINCT c.relname, ',') AS relations
+FROM pg_stat_activity blocker
+LEFT JOIN pg_locks l ON l.pid = blocker.pid AND l.granted
+LEFT JOIN pg_class c ON c.oid = l.relation AND c.relname NOT LIKE 'pg_%'
+WHERE blocker.pid = ANY(pg_blocking_pids(:pid))
+GROUP BY blocker.pid, blocker.usename, blocker.application_name, blocker.client_addr, blocker.state, blocker.query
+"""
+
+s3_client = boto3.client("s3")
+
+
+def set_timeouts(db_conn: sqlalchemy.Connection) -> None:
+    """
+    Fail a statement rather than queue behind DNSWatch for ever - lock_timeout bounds
+    the wait for any one lock and statement_timeout the whole statement. Set as SET
+    LOCAL does, for the current transaction only, so no session state is left for RDS
+    Proxy to pin the connection on - call it at the start of each transaction
+    """
+    db_conn.execute(
+        sqlalchemy.sql.text(
+            "SELECT set_config('lock_timeout', :lock, true), "
+            "set_config('statement_timeout', :statement, true)"
+        ),
+        {"lock": LOCK_TIMEOUT, "statement": STATEMENT_TIMEOUT},
+    )
+
+
+def _sample(
+    engine: sqlalchemy.Engine,
+    pid: int,
+    interval: float,
+    stop: threading.Event,
+    blockers: Dict[int, Dict[str, Any]],
+) -> None:
+    try:
+        with engine.connect() as side_conn:
+            while not stop.wait(interval):
+                rows = (
+                    side_conn.execute(sqlalchemy.sql.text(BLOCKERS_SQL), {"pid": pid})
+                    .mappings()
+                    .all()
+                )
+                side_conn.commit()
+                now = time.monotonic()
+                for row in rows:
+                    blocker = blockers.setdefault(
+                        row["pid"],
+                        {
+                            "first_seen": datetime.datetime.now(
+                                datetime.UTC
+                            ).isoformat(),
+                            "first_seen_monotonic": now,
+                            "samples": 0,
+                            "queries": [],
+                        },
+                    )
+                    blocker.update(
+                        {
+                            k: row[k]
+                            for k in [
+                                "usename",
+                                "application_name",
+                                "client_addr",
+                                "state",
+                                "relations",
+                            ]
+                        }
+                    )
+                    blocker["samples"] += 1
+                    blocker["blocked_seconds"] = round(
+                        now - blocker["first_seen_monotonic"] + interval, 3
+                    )
+                    if row["query"] not in blocker["queries"]:
+                        blocker["queries"].append(row["query"])
+    except Exception as e:
+        print(f"Lock monitor stopped: {e}")
+
+
+@contextlib.contextmanager
+def monitor_locks(
+    engine: sqlalchemy.Engine, pid: int, interval: float = LOCK_SAMPLE_SECONDS
+) -> Iterator[Dict[int, Dict[str, Any]]]:
+    """
+    Sample pg_stat_activity and pg_locks on a side connection while the body runs,
+    recording each session which blocks backend pid and for roughly how long
+    """
+    blockers = dict()
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_sample,
+        kwargs={
+            "engine": engine,
+            "pid": pid,
+            "interval": interval,
+            "stop": stop,
+            "blockers": blockers,
+        },
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield blockers
+    finally:
+        stop.set()
+        thread.join(timeout=10 * interval)
+
+
+def record_blockers(
+    bucket_name: str, blockers: Dict[int, Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Summarise the blocking sessions, longest first, and keep them in s3 so busy
+    periods of the DNSWatch application can be found across runs
+    """
+    summary = sorted(
+        [
+            {"pid": pid} | {k: v for k, v in b.items() if k != "first_seen_monotonic"}
+            for pid, b in blockers.items()
+        ],
+        key=lambda b: b["blocked_seconds"],
+        reverse=True,
+    )
+    if summary:
+        now = datetime.datetime.now(datetime.UTC)
+        s3_client.put_object(
+            Body=json.dumps(summary, indent=2, default=str),
+            Bucket=bucket_name,
+            Key=f"{LOCKS_PREFIX}/{now.strftime('%Y/%m/%d/%H%M%SZ')}.json",
+        )
+        for b in summary:
+            print(
+                f"Blocked {b['blocked_seconds']}s by pid {b['pid']} "
+                f"({b['usename']}/{b['application_name']}) on {b['relations']}"
+            )
+    return summary
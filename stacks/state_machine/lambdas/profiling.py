@@ -0,0 +1,134 @@
+import cProfile
+import datetime
+import functools
+import io
+import json
+import os
+import pstats
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict
+
+import boto3
+
+# opt in with the environment variable or "profile": true in the execution input. The
+# first handler puts its run id in its output as "profile" so the next handler's
+# profile is written under the same run prefix
+ENV_PROFILE = "CDDO_PROFILE"
+FLD_PROFILE = "profile"
+
+PROFILE_PREFIX = "profile"
+PSTATS_SUFFIX = ".pstats"
+ALLOCATIONS_SUFFIX = ".allocations.json"
+SNAPSHOT_SUFFIX = ".tracemalloc"
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 50
+
+s3_client = boto3.client("s3")
+
+
+def profile_enabled(event: Dict[str, Any]) -> bool:
+    return (
+        bool(event.get(FLD_PROFILE, False))
+        or os.environ.get(ENV_PROFILE, "false").lower() == "true"
+    )
+
+
+def _run_id(event: Dict[str, Any]) -> str:
+    if isinstance(event.get(FLD_PROFILE), str):
+        return event[FLD_PROFILE]
+    return datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot, peak: int) -> Dict[str, Any]:
+    return {
+        "peak_kib": round(peak / 1024, 1),
+        "traced_kib": round(
+            sum([s.size for s in snapshot.statistics("filename")]) / 1024, 1
+        ),
+        "top": [
+            {
+                "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                "size_kib": round(s.size / 1024, 1),
+                "count": s.count,
+            }
+            for s in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ],
+    }
+
+
+def _write_profile(
+    bucket_name: str,
+    prefix: str,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    peak: int,
+) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix, dump in [
+            (PSTATS_SUFFIX, profiler.dump_stats),
+            (SNAPSHOT_SUFFIX, snapshot.dump),
+        ]:
+            path = os.path.join(tmp, f"profile{suffix}")
+            dump(path)
+            s3_client.upload_file(path, bucket_name, f"{prefix}{suffix}")
+
+    allocations = _top_allocations(snapshot=snapshot, peak=peak)
+    s3_client.put_object(
+        Body=json.dumps(allocations, indent=2),
+        Bucket=bucket_name,
+        Key=f"{prefix}{ALLOCATIONS_SUFFIX}",
+    )
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(
+        TOP_FUNCTIONS
+    )
+    print(out.getvalue())
+    print(f"Peak traced memory {allocations['peak_kib']} KiB")
+    for a in allocations["top"][:10]:
+        print(f"{a['size_kib']:>10} KiB {a['count']:>8} {a['location']}")
+    print(f"Profile written to s3://{bucket_name}/{prefix}")
+
+
+def profiled(bucket_name: str, name: str) -> Callable:
+    """
+    Run the decorated lambda handler under cProfile and tracemalloc when profiling is
+    switched on, writing the pstats, the tracemalloc snapshot and the top allocations
+    to s3 under profile/<run id>/<name>. Both add overhead so timings are only
+    comparable with other profiled runs
+    """
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not profile_enabled(event):
+                return handler(event, context)
+
+            run_id = _run_id(event)
+            profiler = cProfile.Profile()
+            tracemalloc.start()
+            try:
+                result = profiler.runcall(handler, event, context)
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                try:
+                    _write_profile(
+                        bucket_name=bucket_name,
+                        prefix=f"{PROFILE_PREFIX}/{run_id}/{name}",
+                        profiler=profiler,
+                        snapshot=snapshot,
+                        peak=peak,
+                    )
+                except Exception as e:
+                    print(f"Unable to write profile for {name}: {e}")
+
+            if isinstance(result, dict):
+                result[FLD_PROFILE] = run_id
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,202 @@
+import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import boto3
+import pandas as pd
+
+DEAD_LETTER_PREFIX = "dead-letter"
+# dead letter files already sent round again by a retryQuarantine run
+RETRIED_PREFIX = f"{DEAD_LETTER_PREFIX}/retried"
+# key of the dead letter files a retryQuarantine run read in the step output - they
+# are moved under RETRIED_PREFIX once the run is finalised
+FLD_DEAD_LETTER_FILES = "deadLetterFiles"
+
+FLD_REASON = "quarantine_reason"
+FLD_MODEL = "model"
+FLD_SALESFORCE_ID = "salesforce_id"
+
+REASON_MISSING_KEY = "missing_key"
+REASON_INVALID_KEY = "invalid_key"
+REASON_UNKNOWN_MODEL = "unknown_model"
+REASON_VALUE_TOO_LONG = "value_too_long"
+REASON_DUPLICATE_KEY = "duplicate_key"
+# a duplicate read back alone no longer collides, so would be applied over the row
+# which was kept - it stays quarantined until the duplicate is put right in salesforce
+NOT_RETRIED = {REASON_DUPLICATE_KEY}
+
+# length of the DNSWatch and staging varchar columns
+MAX_VARCHAR = 255
+
+s3_client = boto3.client("s3")
+
+
+def validate_rows(
+    df: pd.DataFrame,
+    key_columns: List[str],
+    seen: Set[int],
+    varchar_columns: Optional[List[str]] = None,
+    models: Optional[Set[str]] = None,
+    scope_columns: Optional[List[str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split a chunk in to the rows which can be staged and the rows which would fail the
+    load, each of which gets the reason code of its first failed check. Key columns
+    must be whole numbers and are returned as int64. seen holds a hash of every key
+    passed in earlier chunks of the same file so the first row with a key, within its
+    scope_columns, is kept and any later row with it is quarantined as a duplicate
+    """
+    reason = pd.Series(pd.NA, index=df.index, dtype="object")
+
+    def _flag(failed: pd.Series, code: str) -> None:
+        reason[failed.fillna(False).astype(bool) & reason.isna()] = code
+
+    missing = df[key_columns].isna().any(axis=1)
+    _flag(missing, REASON_MISSING_KEY)
+
+    keys = pd.DataFrame(index=df.index)
+    for c in key_columns:
+        keys[c] = pd.to_numeric(df[c], errors="coerce")
+        _flag(~missing & (keys[c].isna() | (keys[c] % 1 != 0)), REASON_INVALID_KEY)
+
+    if models is not None:
+        _flag(~df[FLD_MODEL].isin(models), REASON_UNKNOWN_MODEL)
+
+    for c in [c for c in (varchar_columns or []) if c in df.columns]:
+        _flag(df[c].astype("string").str.len() > MAX_VARCHAR, REASON_VALUE_TOO_LONG)
+
+    valid = reason.isna()
+    hashes = pd.util.hash_pandas_object(
+        pd.concat(
+            [keys.loc[valid].astype("int64"), df.loc[valid, scope_columns or []]],
+            axis=1,
+        ),
+        index=False,
+    ).set_axis(keys.index[valid])
+    _flag(
+        (hashes.duplicated() | hashes.isin(seen)).reindex(df.index, fill_value=False),
+        REASON_DUPLICATE_KEY,
+    )
+    seen.update(hashes[reason.loc[valid].isna()].tolist())
+
+    good = df.loc[reason.isna()].copy()
+    for c in key_columns:
+        good[c] = keys.loc[good.index, c].astype("int64")
+
+    rejected = df.loc[reason.notna()].copy()
+    rejected[FLD_REASON] = reason[reason.notna()]
+
+    return good, rejected
+
+
+def write_dead_letter(
+    bucket_name: str,
+    key: str,
+    rejected: List[pd.DataFrame],
+    model: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Write the quarantined rows of a file, with their reason codes, to a dead letter
+    file in s3 and return its key. model is recorded against each row when the rows
+    have no model column of their own so a retryQuarantine run can read them back
+    """
+    rejected = [r for r in rejected if len(r) != 0]
+    if not rejected:
+        return None
+
+    df = pd.concat(rejected)
+    if model is not None and FLD_MODEL not in df.columns:
+        df[FLD_MODEL] = model
+
+    now = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%S%fZ")
+    dead_letter_key = f"{DEAD_LETTER_PREFIX}/{key.removesuffix('.csv')}/{now}.csv"
+    s3_client.put_object(
+        Body=df.to_csv(encoding="utf-8", index=False, lineterminator="\n"),
+        Bucket=bucket_name,
+        Key=dead_letter_key,
+    )
+
+    print(
+        f"Quarantined {len(df)} rows of {key} to {dead_letter_key}: "
+        f"{df[FLD_REASON].value_counts().to_dict()}"
+    )
+    return dead_letter_key
+
+
+def quarantine_rejected(
+    bucket_name: str,
+    key: str,
+    rejected: List[pd.DataFrame],
+    stats: Dict[str, Any],
+    model: Optional[str] = None,
+) -> None:
+    """
+    Write the quarantined rows of a file and record them in the file's stats
+    """
+    dead_letter_key = write_dead_letter(
+        bucket_name=bucket_name, key=key, rejected=rejected, model=model
+    )
+    stats["quarantined"] = sum([len(r) for r in rejected])
+    if dead_letter_key:
+        stats["dead_letter"] = dead_letter_key
+
+
+def retryable_ids(df: pd.DataFrame) -> Dict[str, Set[str]]:
+    """
+    Salesforce ids, by model, of the rows of a dead letter file a retryQuarantine run
+    reads back
+    """
+    df = df.loc[~df[FLD_REASON].isin(NOT_RETRIED)].dropna(
+        subset=[FLD_MODEL, FLD_SALESFORCE_ID]
+    )
+    return {model: set(ids) for model, ids in df.groupby(FLD_MODEL)[FLD_SALESFORCE_ID]}
+
+
+def read_quarantined_ids(
+    bucket_name: str, skip_prefixes: Optional[List[str]] = None
+) -> Tuple[Dict[str, Set[str]], List[str]]:
+    """
+    Salesforce ids of the retryable quarantined rows, by model, from the dead letter
+    files not yet retried, and the keys of those files. Dead letter files of change
+    files under skip_prefixes are left alone. The files stay where they are until
+    mark_retried is called once the retry has been finalised, so a failed retry reads
+    them again
+    """
+    skip = tuple(
+        [RETRIED_PREFIX] + [f"{DEAD_LETTER_PREFIX}/{p}" for p in (skip_prefixes or [])]
+    )
+    quarantined = dict()
+    keys = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{DEAD_LETTER_PREFIX}/"):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key.startswith(tuple([f"{p}/" for p in skip])):
+                continue
+
+            df = pd.read_csv(
+                s3_client.get_object(Bucket=bucket_name, Key=key)["Body"],
+                usecols=[FLD_MODEL, FLD_SALESFORCE_ID, FLD_REASON],
+                dtype=str,
+            )
+            for model, ids in retryable_ids(df).items():
+                quarantined.setdefault(model, set()).update(ids)
+            keys.append(key)
+
+    return quarantined, keys
+
+
+def mark_retried(bucket_name: str, keys: List[str]) -> None:
+    """
+    Move dead letter files under dead-letter/retried so each is sent round once - rows
+    which failed again have been quarantined to new dead letter files
+    """
+    for key in keys:
+        retried_key = f"{RETRIED_PREFIX}/{key.removeprefix(f'{DEAD_LETTER_PREFIX}/')}"
+        s3_client.copy_object(
+            Bucket=bucket_name,
+            Key=retried_key,
+            CopySource={"Bucket": bucket_name, "Key": key},
+        )
+        s3_client.delete_object(Bucket=bucket_name, Key=key)
+    if keys:
+        print(f"Moved {len(keys)} retried dead letter files under {RETRIED_PREFIX}")
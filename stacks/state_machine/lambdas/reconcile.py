@@ -0,0 +1,96 @@
+import hashlib
+from typing import Dict, List, Set, Tuple
+
+import pandas as pd
+import sqlalchemy
+
+# digests of salesforce_salesforceobject per id bucket for one model. The bucket and row
+# hashes are the leading hex digits of md5, which python computes identically, so the
+# two sides can be compared bucket by bucket. Summing the row hashes makes a digest
+# which does not depend on row order
+DNSWATCH_DIGEST_SQL = """
+SELECT ('x' || substr(md5(sso.object_id::text), 1, 7))::bit(28)::int % :buckets AS bucket,
+       count(*) AS rows,
+       sum(('x' || substr(md5(sso.object_id::text || ':' || coalesce(sso.salesforce_id, '')), 1, 15))::bit(60)::bigint) AS digest
+FROM salesforce_salesforceobject sso
+JOIN django_content_type dct ON dct.id = sso.content_type_id
+WHERE dct.model = :model
+GROUP BY 1
+"""  # noqa: E501
+
+DNSWATCH_BUCKET_ROWS_SQL = """
+SELECT sso.object_id::text AS object_id, sso.salesforce_id
+FROM salesforce_salesforceobject sso
+JOIN django_content_type dct ON dct.id = sso.content_type_id
+WHERE dct.model = :model
+AND ('x' || substr(md5(sso.object_id::text), 1, 7))::bit(28)::int % :buckets = ANY(:bucket_list)
+"""
+
+FLD_OBJECT_ID = "object_id"
+FLD_SALESFORCE_ID = "salesforce_id"
+
+
+def _md5_prefix(value: str, digits: int) -> int:
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:digits], 16)
+
+
+def bucket_of(object_id: str, buckets: int) -> int:
+    return _md5_prefix(object_id, 7) % buckets
+
+
+def row_hash(object_id: str, salesforce_id: str) -> int:
+    return _md5_prefix(f"{object_id}:{salesforce_id}", 15)
+
+
+def salesforce_digests(
+    df: pd.DataFrame, buckets: int
+) -> Tuple[pd.DataFrame, Dict[int, Tuple[int, int]]]:
+    """
+    Bucket a projection of (object_id, salesforce_id) read from salesforce and digest
+    each bucket as DNSWATCH_DIGEST_SQL does. Returns the projection with its bucket
+    and the (rows, digest) of each bucket
+    """
+    df = df.copy()
+    df["bucket"] = [bucket_of(o, buckets) for o in df[FLD_OBJECT_ID]]
+    df["row_hash"] = [
+        row_hash(o, s) for o, s in zip(df[FLD_OBJECT_ID], df[FLD_SALESFORCE_ID])
+    ]
+    digests = {
+        int(bucket): (int(len(rows)), int(sum(rows["row_hash"].tolist())))
+        for bucket, rows in df.groupby("bucket")
+    }
+    return df, digests
+
+
+def dnswatch_digests(
+    db_conn: sqlalchemy.Connection, model: str, buckets: int
+) -> Dict[int, Tuple[int, int]]:
+    result = db_conn.execute(
+        sqlalchemy.sql.text(DNSWATCH_DIGEST_SQL), {"model": model, "buckets": buckets}
+    )
+    return {r.bucket: (r.rows, int(r.digest)) for r in result}
+
+
+def differing_buckets(
+    salesforce: Dict[int, Tuple[int, int]], dnswatch: Dict[int, Tuple[int, int]]
+) -> List[int]:
+    return sorted(
+        [
+            b
+            for b in set(salesforce) | set(dnswatch)
+            if salesforce.get(b) != dnswatch.get(b)
+        ]
+    )
+
+
+def dnswatch_bucket_ids(
+    db_conn: sqlalchemy.Connection, model: str, buckets: int, bucket_list: List[int]
+) -> Set[str]:
+    """
+    DNSWatch object ids held for the model in the given buckets
+    """
+    result = db_conn.execute(
+        sqlalchemy.sql.text(DNSWATCH_BUCKET_ROWS_SQL),
+        {"model": model, "buckets": buckets, "bucket_list": bucket_list},
+    )
+    return {r.object_id for r in result}
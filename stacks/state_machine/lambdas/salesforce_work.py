@@ -0,0 +1,250 @@
+import io
+from typing import Any, Dict, Iterable, Iterator, List
+
+import pandas as pd
+import requests
+from cddo.utils.constants import (
+    FLD_DOMAIN_RELATION,
+    FLD_FIELDS_TO_JOIN,
+    FLD_FIELDS_TO_UPDATE,
+    FLD_FILES_WRITTEN,
+    FLD_MODEL,
+    FLD_ORGANISATION,
+    FLD_QUERY,
+    FLD_RENAMER,
+    PS_SALESFORCE_LAST_CHECKED,
+    SALESFORCE_API_VERSION,
+)
+from cddo.utils.salesforce import query_to_df
+
+FLD_FIELDS_TO_NULL = "fieldsToNull"
+FLD_SALESFORCE_OBJECT = "salesforceObject"
+# key of the salesforce id lookup file in the step output, absent before it was added
+FLD_LOOKUP_FILE = "lookupFile"
+LOOKUP_FILE = "salesforce_salesforceobject.csv"
+LOOKUP_COLUMNS = ["id", "salesforce_id", FLD_MODEL]
+# key of the watermark a polling run read up to in the step output - finalise writes
+# it once the changes are in DNSWatch, so a failed run reads them again
+FLD_WATERMARK = "watermark"
+FLD_WATERMARK_PARAMETER = "parameter"
+FLD_WATERMARK_VALUE = "value"
+# ids per SOQL IN clause - keeps the query well inside the url length limit
+IDS_PER_QUERY = 200
+TIMEOUT = 20
+# rows of a DataFrame encoded to csv at a time when streaming it to s3
+CSV_SLICE_ROWS = 10000
+
+# salesforce objects read and the DNSWatch model each one updates - shared by the
+# polling and the change data capture paths so both write the same files
+work = dict()
+work[FLD_ORGANISATION] = {
+    FLD_MODEL: "organisation",
+    FLD_SALESFORCE_OBJECT: "Account",
+    FLD_RENAMER: {"external_id__c": "id", "id": "salesforce_id"},
+    FLD_QUERY: "select Id, Name, external_id__c from Account where",
+    FLD_FIELDS_TO_UPDATE: ["salesforce_id"],
+    FLD_FIELDS_TO_JOIN: ["id"],
+    FLD_FIELDS_TO_NULL: ["salesforce_id"],
+}
+work[FLD_DOMAIN_RELATION] = {
+    FLD_MODEL: "domain",
+    FLD_SALESFORCE_OBJECT: "Domain__c",
+    FLD_RENAMER: {"external_id__c": "id", "id": "salesforce_id"},
+    FLD_QUERY: (
+        "select Id, Name, Organisation__c, Parent_domain__c, Public_suffix__c, "
+        "Organisation__r.Id, Organisation__r.Name, external_id__c from Domain__c where"
+    ),
+    FLD_FIELDS_TO_UPDATE: ["salesforce_id"],
+    FLD_FIELDS_TO_JOIN: ["id"],
+    FLD_FIELDS_TO_NULL: ["salesforce_id", "salesforce_organisation_id"],
+}
+
+# work[FLD_ORPHAN_ORGANISATION] = {
+#     FLD_MODEL: "orphan",
+#     FLD_RENAMER: {"external_id__c": "object_id", "id": "salesforce_id"},
+#     FLD_QUERY: "SELECT Id, Name, external_id__c FROM Account WHERE Id NOT IN "
+#     "(SELECT Organisation__c FROM Domain__c) and",
+# }
+
+
+def last_checked_key(event_root: str) -> str:
+    """
+    Name of the parameter holding an org's watermark, the LastModifiedDate of each
+    entity a polling run last read up to
+    """
+    return f"/{event_root}/{PS_SALESFORCE_LAST_CHECKED}"
+
+
+def changed_since(since: str) -> str:
+    """
+    SOQL condition for the records changed after a watermark - the window both the
+    extraction and the run size estimate read
+    """
+    return f"LastModifiedDate > {since}"
+
+
+def to_model_frame(df: pd.DataFrame, info: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Rename the columns of a salesforce query result to the DNSWatch model columns
+    """
+    df.columns = [x.lower() for x in df.columns]
+    df[FLD_MODEL] = info[FLD_MODEL]
+    return df.rename(columns=info[FLD_RENAMER])
+
+
+def change_file_info(info: Dict[str, Any], keys: List[str]) -> Dict[str, Any]:
+    """
+    The entry for one model in the change files FinaliseSalesforceUpdate processes
+    """
+    return {
+        FLD_FIELDS_TO_UPDATE: info[FLD_FIELDS_TO_UPDATE],
+        FLD_FIELDS_TO_JOIN: info[FLD_FIELDS_TO_JOIN],
+        FLD_FIELDS_TO_NULL: info[FLD_FIELDS_TO_NULL],
+        FLD_FILES_WRITTEN: keys,
+    }
+
+
+def query_ids(
+    query: str, ids: List[str], domain: str, access_token: str
+) -> pd.DataFrame:
+    """
+    Read the records with the given salesforce ids using a work query
+    """
+    frames = []
+    for i in range(0, len(ids), IDS_PER_QUERY):
+        in_list = ",".join(
+            [f"'{record_id}'" for record_id in ids[i : i + IDS_PER_QUERY]]
+        )
+        frames.append(
+            query_to_df(
+                query=f"{query} Id IN ({in_list})",
+                domain=domain,
+                access_token=access_token,
+            )
+        )
+    return pd.concat(frames) if frames else pd.DataFrame()
+
+
+def query_pages(
+    query: str, domain: str, access_token: str, batch_size: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield the result of a query page by page, asking salesforce for pages of batch_size
+    records so each page fits the memory the function has
+    """
+    url = f"https://{domain}.my.salesforce.com/services/data/v{SALESFORCE_API_VERSION}/query"
+    params = {"q": query}
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Sforce-Query-Options": f"batchSize={batch_size}",
+    }
+    while url:
+        response = requests.get(url, params=params, headers=headers, timeout=TIMEOUT)
+        response.raise_for_status()
+        page = response.json()
+        if page["records"]:
+            df = pd.json_normalize(page["records"])
+            yield df.drop(
+                columns=[c for c in df.columns if "attributes" in c.split(".")]
+            )
+        url = (
+            None
+            if page["done"]
+            else f"https://{domain}.my.salesforce.com{page['nextRecordsUrl']}"
+        )
+        params = None
+
+
+def put_csv_frames(
+    s3_client,
+    bucket_name: str,
+    key: str,
+    frames: Iterable[pd.DataFrame],
+    part_size: int,
+) -> int:
+    """
+    Write DataFrames to s3 as one csv as they arrive, uploading parts of part_size so
+    only the part being filled is held in memory. The header, and the columns written,
+    are those of the first frame - a later page may spell a relationship left empty by
+    the first differently, and such columns are not read downstream. Returns the
+    number of rows written
+    """
+    buffer = io.BytesIO()
+    upload_id = None
+    parts = []
+    columns = None
+    rows = 0
+
+    def _upload_part():
+        response = s3_client.upload_part(
+            Body=buffer.getvalue(),
+            Bucket=bucket_name,
+            Key=key,
+            PartNumber=len(parts) + 1,
+            UploadId=upload_id,
+        )
+        parts.append({"ETag": response["ETag"], "PartNumber": len(parts) + 1})
+
+    try:
+        for df in frames:
+            if len(df) == 0:
+                continue
+            if columns is None:
+                columns = list(df.columns)
+            buffer.write(
+                df.reindex(columns=columns)
+                .to_csv(index=False, header=rows == 0, lineterminator="\n")
+                .encode("utf-8")
+            )
+            rows += len(df)
+            if buffer.tell() >= part_size:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(
+                        Bucket=bucket_name, Key=key
+                    )["UploadId"]
+                _upload_part()
+                buffer = io.BytesIO()
+
+        if upload_id is None:
+            body = (
+                buffer.getvalue()
+                if rows
+                else pd.DataFrame().to_csv(
+                    encoding="utf-8", index=False, lineterminator="\n"
+                )
+            )
+            s3_client.put_object(Body=body, Bucket=bucket_name, Key=key)
+            return rows
+        # the last part may be smaller than the minimum part size, but not empty
+        if buffer.tell():
+            _upload_part()
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=upload_id
+            )
+        raise
+    return rows
+
+
+def put_csv(s3_client, bucket_name: str, key: str, df: pd.DataFrame, part_size: int):
+    """
+    Write a DataFrame to s3 as csv, encoding it a slice at a time and uploading parts
+    of part_size so the csv text of the whole frame is never held in memory
+    """
+    put_csv_frames(
+        s3_client=s3_client,
+        bucket_name=bucket_name,
+        key=key,
+        frames=(
+            df.iloc[start : start + CSV_SLICE_ROWS]
+            for start in range(0, len(df), CSV_SLICE_ROWS)
+        ),
+        part_size=part_size,
+    )
@@ -0,0 +1,51 @@
+from typing import List, Optional, Tuple
+
+# records changed in one run at or above which the run counts as busy
+BUSY_RECORDS = 100
+
+
+def next_interval_minutes(
+    runs: List[Tuple[float, int]],
+    min_minutes: int,
+    max_minutes: int,
+    busy_records: int = BUSY_RECORDS,
+) -> int:
+    """
+    Minutes to wait before the next run given recent runs as (timestamp, records
+    changed) pairs, oldest first. The interval since the previous run is halved after a
+    busy run, kept after a run with some changes and doubled after a run with none, so
+    polling speeds up during bulk edits and backs off to max_minutes when quiet
+    """
+    if not runs:
+        return max_minutes
+
+    if len(runs) < 2:
+        interval = max_minutes
+    else:
+        interval = (runs[-1][0] - runs[-2][0]) / 60
+
+    records = runs[-1][1]
+    if records >= busy_records:
+        interval = interval / 2
+    elif records == 0:
+        interval = interval * 2
+
+    return int(min(max(round(interval), min_minutes), max_minutes))
+
+
+def runs_from_stats(
+    items: List[Tuple[str, int, Optional[str]]]
+) -> List[Tuple[float, int]]:
+    """
+    Sum the per entity record counts of each run in to (timestamp, records) pairs
+    oldest first. Items are (as_at_datetime, records, execution id). The entities of a
+    run share its as_at_datetime, and a multi-org run records the execution id as each
+    org extracts at its own time - those runs are summed by execution and take the
+    time of their first extraction
+    """
+    runs = dict()
+    for as_at_datetime, records, execution_id in items:
+        run = execution_id or as_at_datetime
+        at, total = runs.get(run, (float(as_at_datetime), 0))
+        runs[run] = (min(at, float(as_at_datetime)), total + records)
+    return sorted(runs.values())
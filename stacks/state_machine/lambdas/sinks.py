@@ -0,0 +1,248 @@
+import concurrent.futures
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+import pandas as pd
+import requests
+from cddo.utils.constants import (
+    FLD_FIELDS_TO_JOIN,
+    FLD_FIELDS_TO_UPDATE,
+    FLD_FILES_WRITTEN,
+)
+from requests.adapters import HTTPAdapter
+
+from quarantine import quarantine_rejected, validate_rows
+from sql_statements import ALLOWED_COLUMNS
+
+# where FinaliseSalesforceUpdate sends the changes - "sql" writes the DNSWatch tables
+# directly, "api" posts them to the DNSWatch bulk APIs so the app applies them itself
+ENV_SINK = "CDDO_DNSWATCH_SINK"
+SINK_SQL = "sql"
+SINK_API = "api"
+SINK = os.environ.get(ENV_SINK, SINK_SQL)
+
+ENV_API_URL = "CDDO_DNSWATCH_API_URL"
+# secret holding the DNSWatch API token, sent as "Authorization: Token <token>"
+ENV_API_TOKEN_SECRET = "CDDO_DNSWATCH_API_TOKEN_SECRET"
+# records per request and requests in flight - the connection pool is the same size
+ENV_API_BATCH_SIZE = "CDDO_DNSWATCH_API_BATCH_SIZE"
+ENV_API_CONCURRENCY = "CDDO_DNSWATCH_API_CONCURRENCY"
+ENV_API_RETRIES = "CDDO_DNSWATCH_API_RETRIES"
+
+API_BATCH_SIZE = int(os.environ.get(ENV_API_BATCH_SIZE, "500"))
+API_CONCURRENCY = int(os.environ.get(ENV_API_CONCURRENCY, "4"))
+API_RETRIES = int(os.environ.get(ENV_API_RETRIES, "5"))
+API_TIMEOUT_SECONDS = 30
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 20
+
+# model bulk update and salesforce object bulk upsert endpoints, relative to the API
+# url - the model path has a {model} placeholder for the DNSWatch model name
+ENV_API_MODEL_PATH = "CDDO_DNSWATCH_API_MODEL_PATH"
+ENV_API_LOOKUP_PATH = "CDDO_DNSWATCH_API_LOOKUP_PATH"
+
+# responses worth sending again - everything else other than success fails the run
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TransientSinkError(Exception):
+    pass
+
+
+def create_session(concurrency: int, token: Optional[str] = None) -> requests.Session:
+    """
+    Session whose pool holds one connection per request in flight and blocks rather
+    than opening more, so DNSWatch never sees more than concurrency connections
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=concurrency, pool_block=True, max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Content-Type"] = "application/json"
+    if token:
+        session.headers["Authorization"] = f"Token {token}"
+    return session
+
+
+def _api_token() -> Optional[str]:
+    secret_name = os.environ.get(ENV_API_TOKEN_SECRET)
+    if not secret_name:
+        return None
+    secret = boto3.client("secretsmanager").get_secret_value(SecretId=secret_name)
+    return secret["SecretString"]
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_BACKOFF_SECONDS)
+    # full jitter so retrying batches do not arrive back together
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2**attempt))
+
+
+def _post(
+    session: requests.Session,
+    url: str,
+    records: List[Dict[str, Any]],
+    retries: int,
+) -> Tuple[Dict[str, Any], int]:
+    """
+    Post one batch, retrying connection failures and transient responses with
+    exponential backoff. Returns the response body and the number of retries, which
+    the caller sums as batches are posted from several threads
+    """
+    body = json.dumps({"records": records}, default=str)
+    for attempt in range(retries + 1):
+        try:
+            response = session.post(url, data=body, timeout=API_TIMEOUT_SECONDS)
+            if response.status_code not in TRANSIENT_STATUS:
+                response.raise_for_status()
+                return (response.json() if response.content else {}), attempt
+            error = TransientSinkError(f"{url} returned {response.status_code}")
+            retry_after = response.headers.get("Retry-After")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = TransientSinkError(f"{url}: {e}")
+            retry_after = None
+
+        if attempt == retries:
+            raise error
+        time.sleep(_backoff(attempt=attempt, retry_after=retry_after))
+
+
+def send_frames(
+    session: requests.Session,
+    url: str,
+    frames: Iterator[pd.DataFrame],
+    batch_size: int = API_BATCH_SIZE,
+    concurrency: int = API_CONCURRENCY,
+    retries: int = API_RETRIES,
+) -> Dict[str, Any]:
+    """
+    Post the rows of each frame in batches of batch_size, with up to concurrency
+    batches in flight. Each frame is sent before the next is read so memory stays
+    bounded by the frame size. Returns the counts the responses report along with the
+    throughput
+    """
+    stats = {"rows": 0, "batches": 0, "retries": 0, "updated": 0, "inserted": 0}
+    start = time.perf_counter()
+    # one thread per request in flight, kept for every frame of the file
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for df in frames:
+            records = (
+                df.astype(object).where(df.notna(), None).to_dict(orient="records")
+            )
+            batches = [
+                records[i : i + batch_size] for i in range(0, len(records), batch_size)
+            ]
+            for response, batch_retries in executor.map(
+                lambda b: _post(session=session, url=url, records=b, retries=retries),
+                batches,
+            ):
+                stats["retries"] += batch_retries
+                stats["updated"] += int(response.get("updated", 0))
+                stats["inserted"] += int(response.get("inserted", 0))
+            stats["rows"] += len(records)
+            stats["batches"] += len(batches)
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["rows_per_second"] = (
+        round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] else None
+    )
+    return stats
+
+
+def api_sink(
+    bucket_name: str,
+    input_files: Dict[str, Any],
+    lookup_file: str,
+    read_chunks: Callable[..., Iterator[pd.DataFrame]],
+) -> Dict[str, Any]:
+    """
+    Send the change files and the salesforce id lookup to the DNSWatch bulk APIs in
+    place of the SQL merge. Rows are validated and quarantined as the SQL path does;
+    DNSWatch applies the changes, and its own invariants, in its own transactions
+    """
+    base_url = os.environ[ENV_API_URL].rstrip("/")
+    model_path = os.environ[ENV_API_MODEL_PATH].lstrip("/")
+    lookup_path = os.environ[ENV_API_LOOKUP_PATH].lstrip("/")
+
+    def _valid(
+        key: str,
+        key_columns: List[str],
+        stats: Dict[str, Any],
+        model: Optional[str] = None,
+        skip_missing: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Iterator[pd.DataFrame]:
+        seen = set()
+        rejected = []
+        for df in read_chunks(bucket_name=bucket_name, key=key):
+            # records with no external_id__c are not linked to an object yet
+            if skip_missing:
+                df = df.dropna(subset=skip_missing)
+            df, df_rejected = validate_rows(
+                df=df, key_columns=key_columns, seen=seen, **kwargs
+            )
+            rejected.append(df_rejected)
+            if len(df) != 0:
+                yield df
+        quarantine_rejected(
+            bucket_name=bucket_name,
+            key=key,
+            rejected=rejected,
+            stats=stats,
+            model=model,
+        )
+
+    run_stats = dict()
+    with create_session(concurrency=API_CONCURRENCY, token=_api_token()) as session:
+        for model, object_info in input_files.items():
+            columns = (
+                object_info[FLD_FIELDS_TO_JOIN] + object_info[FLD_FIELDS_TO_UPDATE]
+            )
+            for key in object_info[FLD_FILES_WRITTEN]:
+                stats = dict()
+                stats |= send_frames(
+                    session=session,
+                    url=f"{base_url}/{model_path.format(model=model)}",
+                    frames=(
+                        df[columns]
+                        for df in _valid(
+                            key=key,
+                            key_columns=object_info[FLD_FIELDS_TO_JOIN],
+                            stats=stats,
+                            model=model,
+                            skip_missing=object_info[FLD_FIELDS_TO_JOIN],
+                            varchar_columns=object_info[FLD_FIELDS_TO_UPDATE],
+                        )
+                    ),
+                )
+                run_stats[key] = stats
+                print(f"Sent {key}: {stats}")
+
+        stats = dict()
+        stats |= send_frames(
+            session=session,
+            url=f"{base_url}/{lookup_path}",
+            frames=(
+                df.rename(columns={"id": "object_id"})
+                for df in _valid(
+                    key=lookup_file,
+                    key_columns=["id"],
+                    stats=stats,
+                    skip_missing=["id"],
+                    varchar_columns=["salesforce_id"],
+                    models=set(ALLOWED_COLUMNS.keys()),
+                    scope_columns=["model"],
+                )
+            ),
+        )
+        run_stats[lookup_file] = stats
+        print(f"Sent {lookup_file}: {stats}")
+
+    return run_stats
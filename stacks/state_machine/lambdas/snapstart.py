@@ -0,0 +1,13 @@
+try:
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+except ImportError:
+    # not running under SnapStart, e.g. locally or on Fargate, so the hooks never run
+
+    def register_before_snapshot(func):
+        return func
+
+    def register_after_restore(func):
+        return func
+
+
+__all__ = ["register_after_restore", "register_before_snapshot"]
@@ -0,0 +1,218 @@
+import functools
+import re
+from typing import Dict, List, Tuple
+
+TEMP_TABLE = "zzz_temp_table"
+
+# models and columns the generated statements may reference - the column names arrive
+# in the step input so nothing is interpolated into sql unless it is listed here
+ALLOWED_COLUMNS = {
+    "organisation": {"id", "salesforce_id"},
+    "domain": {"id", "salesforce_id", "salesforce_organisation_id"},
+}
+
+STMT_NULL = "null"
+STMT_UPDATE = "update"
+STMT_INSERT = "insert"
+STMT_MATCHED = "matched"
+STMT_DUPLICATES = "duplicates"
+
+IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+# statements to resolve the staged salesforce id lookup against DNSWatch - these only
+# write to the staging table. Rows the id mapping has already resolved are staged with
+# their sso_id and content_type_id so are skipped, unless the row they name has gone
+LOOKUP_RESOLVE_STATEMENTS = [
+    # get content type id for each model
+    f"UPDATE {TEMP_TABLE} tt SET content_type_id = dct.id  FROM django_content_type dct WHERE dct.model = tt.model AND tt.content_type_id = 0",  # noqa: E501
+    # send rows resolved from a stale id mapping back through the join below
+    f"UPDATE {TEMP_TABLE} tt SET sso_id = 0 WHERE tt.sso_id <> 0 AND NOT EXISTS (SELECT 1 FROM salesforce_salesforceobject sso WHERE sso.id = tt.sso_id AND sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id)",  # noqa: E501
+    # update existing entries
+    f"UPDATE {TEMP_TABLE} tt SET sso_id = sso.id  FROM salesforce_salesforceobject sso WHERE sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id AND tt.sso_id = 0",  # noqa: E501
+    # null ids which dont exist in DNSWatch
+    f"update {TEMP_TABLE} set sso_id=null where sso_id=0",
+]
+
+# statements to merge the resolved lookup in to salesforce_salesforceobject
+LOOKUP_MERGE_STATEMENTS = [
+    # update existing - only rows whose salesforce id has changed are rewritten
+    f"UPDATE salesforce_salesforceobject sso SET salesforce_id = tt.salesforce_id FROM {TEMP_TABLE} tt WHERE tt.sso_id = sso.id AND sso.salesforce_id IS DISTINCT FROM tt.salesforce_id",  # noqa: E501
+    # insert new - the staged id is the object_id, sso.id comes from its sequence
+    f"INSERT INTO salesforce_salesforceobject(object_id, salesforce_id, content_type_id, batch) select id, salesforce_id, content_type_id, batch from {TEMP_TABLE} WHERE sso_id IS NULL",  # noqa: E501
+]
+
+# invariants of a resolved lookup, checked before any merge statement runs so a broken
+# lookup never reaches DNSWatch, whether or not the merge is batched
+INV_STAGED = "staged"
+INV_UNRESOLVED_CONTENT_TYPE = "unresolved_content_type"
+INV_DUPLICATE_STAGED = "duplicate_staged_keys"
+
+LOOKUP_PRECHECK_STATEMENTS = {
+    INV_STAGED: f"SELECT count(*) FROM {TEMP_TABLE}",
+    INV_UNRESOLVED_CONTENT_TYPE: f"SELECT count(*) FROM {TEMP_TABLE} WHERE content_type_id IS NULL OR content_type_id = 0",  # noqa: E501
+    INV_DUPLICATE_STAGED: f"SELECT count(*) - count(DISTINCT (id, content_type_id)) FROM {TEMP_TABLE}",
+}
+
+# what the merge will do, counted from the resolved lookup rather than from the merge
+# row counts, which a resumed batched merge only has for the rows it has not yet done
+CNT_EXISTING = "existing"
+CNT_UPDATES = "updates"
+CNT_INSERTS = "inserts"
+
+LOOKUP_COUNT_STATEMENTS = {
+    CNT_EXISTING: f"SELECT count(*) FROM {TEMP_TABLE} WHERE sso_id IS NOT NULL",
+    CNT_UPDATES: f"SELECT count(*) FROM {TEMP_TABLE} tt JOIN salesforce_salesforceobject sso ON sso.id = tt.sso_id WHERE sso.salesforce_id IS DISTINCT FROM tt.salesforce_id",  # noqa: E501
+    CNT_INSERTS: f"SELECT count(*) FROM {TEMP_TABLE} WHERE sso_id IS NULL",
+}
+
+# invariants of a merged lookup, checked against salesforce_salesforceobject itself -
+# every staged row is now held with its salesforce id, once
+INV_MERGED = "staged_rows_merged"
+INV_DUPLICATE_OBJECTS = "duplicate_salesforce_objects"
+
+LOOKUP_VERIFY_STATEMENTS = {
+    INV_MERGED: f"SELECT count(*) FROM {TEMP_TABLE} tt WHERE EXISTS (SELECT 1 FROM salesforce_salesforceobject sso WHERE sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id AND sso.salesforce_id IS NOT DISTINCT FROM tt.salesforce_id)",  # noqa: E501
+    INV_DUPLICATE_OBJECTS: f"SELECT count(*) FROM (SELECT sso.object_id, sso.content_type_id FROM salesforce_salesforceobject sso JOIN {TEMP_TABLE} tt ON sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id GROUP BY sso.object_id, sso.content_type_id HAVING count(*) > 1) d",  # noqa: E501
+}
+
+# the merged rows as salesforce_salesforceobject now holds them, to refresh the id mapping
+LOOKUP_MAPPING_SQL = f"SELECT tt.model, tt.id AS object_id, sso.salesforce_id, sso.id AS sso_id, sso.content_type_id FROM {TEMP_TABLE} tt JOIN salesforce_salesforceobject sso ON sso.object_id = tt.id AND sso.content_type_id = tt.content_type_id"  # noqa: E501
+
+# key order the lookup is merged in when batching
+LOOKUP_ORDER_BY = ["content_type_id", "id"]
+
+
+def _check_identifiers(upsert_object: str, fields: List[str]) -> None:
+    if upsert_object not in ALLOWED_COLUMNS:
+        raise ValueError(f"Model <{upsert_object}> is not in the allowed list")
+    for f in fields:
+        if not IDENTIFIER.match(f) or f not in ALLOWED_COLUMNS[upsert_object]:
+            raise ValueError(f"Column <{f}> is not allowed for model <{upsert_object}>")
+
+
+def _create_null_sql(
+    upsert_object: str,
+    fields_to_null: List[str],
+) -> str:
+    set_stmt = ",".join([f"{f}=null" for f in fields_to_null])
+    changed_stmt = " or ".join([f"{f} is not null" for f in fields_to_null])
+
+    query = f"UPDATE {upsert_object} uo SET {set_stmt} WHERE {changed_stmt}"
+
+    return query
+
+
+def _create_update_sql(
+    upsert_object: str,
+    fields_to_join: List[str],
+    fields_to_update: List[str],
+) -> str:
+    set_stmt = ",".join([f"{f}=tt.{f}" for f in fields_to_update])
+    where_stmt = " and ".join([f"uo.{f}=tt.{f}" for f in fields_to_join])
+    # rows where nothing would change are not rewritten, and as the join columns are
+    # never set the update can stay on the same heap page (HOT) when no indexed column changes
+    changed_stmt = " or ".join(
+        [f"uo.{f} is distinct from tt.{f}" for f in fields_to_update]
+    )
+
+    query = f"UPDATE {upsert_object} uo SET {set_stmt} FROM {TEMP_TABLE} tt WHERE {where_stmt} and ({changed_stmt})"
+
+    return query
+
+
+def _create_matched_sql(
+    upsert_object: str,
+    fields_to_join: List[str],
+) -> str:
+    where_stmt = " and ".join([f"uo.{f}=tt.{f}" for f in fields_to_join])
+
+    query = (
+        f"SELECT count(*) FROM {upsert_object} uo JOIN {TEMP_TABLE} tt ON {where_stmt}"
+    )
+
+    return query
+
+
+def _create_duplicates_sql(
+    fields_to_join: List[str],
+) -> str:
+    key_stmt = ",".join(fields_to_join)
+
+    query = f"SELECT count(*) - count(DISTINCT ({key_stmt})) FROM {TEMP_TABLE}"
+
+    return query
+
+
+def _create_insert_sql(
+    upsert_object: str,
+    fields_to_join: List[str],
+    fields_to_update: List[str],
+) -> str:
+    flds_stmt = ",".join([f for f in (fields_to_join + fields_to_update)])
+    values_stmt = ",".join([f"tt.{f}" for f in (fields_to_join + fields_to_update)])
+
+    where_stmt = " and ".join([f"tt.{f} is null" for f in fields_to_join])
+
+    query = f"INSERT INTO {upsert_object}({flds_stmt}) SELECT {values_stmt} FROM {TEMP_TABLE} tt WHERE {where_stmt}"
+
+    return query
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(
+    upsert_object: str,
+    fields_to_join: Tuple[str, ...],
+    fields_to_update: Tuple[str, ...],
+    fields_to_null: Tuple[str, ...],
+) -> Dict[str, str]:
+    _check_identifiers(
+        upsert_object=upsert_object,
+        fields=list(fields_to_join + fields_to_update + fields_to_null),
+    )
+
+    return {
+        STMT_NULL: _create_null_sql(
+            upsert_object=upsert_object, fields_to_null=list(fields_to_null)
+        ),
+        STMT_UPDATE: _create_update_sql(
+            upsert_object=upsert_object,
+            fields_to_join=list(fields_to_join),
+            fields_to_update=list(fields_to_update),
+        ),
+        STMT_MATCHED: _create_matched_sql(
+            upsert_object=upsert_object,
+            fields_to_join=list(fields_to_join),
+        ),
+        STMT_DUPLICATES: _create_duplicates_sql(
+            fields_to_join=list(fields_to_join),
+        ),
+        STMT_INSERT: _create_insert_sql(
+            upsert_object=upsert_object,
+            fields_to_join=list(fields_to_join),
+            fields_to_update=list(fields_to_update),
+        ),
+    }
+
+
+def compile_upsert_statements(
+    upsert_object: str,
+    fields_to_join: List[str],
+    fields_to_update: List[str],
+    fields_to_null: List[str],
+) -> Dict[str, str]:
+    """
+    Build the null/update/matched/duplicates/insert statements for a model once - the text is cached for the
+    life of the execution environment so the same statement, and so the same server side
+    prepared statement, is reused across files and warm invocations
+    """
+    return _compile(
+        upsert_object,
+        tuple(fields_to_join),
+        tuple(fields_to_update),
+        tuple(fields_to_null),
+    )
+
+
+def compile_cache_info() -> Dict[str, int]:
+    info = _compile.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
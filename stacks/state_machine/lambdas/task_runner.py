@@ -0,0 +1,71 @@
+"""
+Entry point of the Fargate runner for runs too large for the Lambda limits - runs
+GetSalesforceChanges and FinaliseSalesforceUpdate, the same handlers the Lambda tasks
+run, one after the other in this container and keeps the run lease alive throughout
+"""
+import _thread
+import json
+import os
+import threading
+
+import boto3
+
+import FinaliseSalesforceUpdate
+import GetSalesforceChanges
+import RunLease
+
+# set by the state machine when it starts the task
+ENV_EXECUTION_ID = "CDDO_EXECUTION_ID"
+# the input which started the execution as json, e.g. {"retryQuarantine": true}
+ENV_EXECUTION_INPUT = "CDDO_EXECUTION_INPUT"
+
+TASK_OUTPUT_PREFIX = "task-output"
+
+s3_client = boto3.client("s3")
+
+
+def _keep_lease(execution_id: str, stop: threading.Event) -> None:
+    while not stop.wait(RunLease.LEASE_SECONDS / 3):
+        try:
+            RunLease.lambda_handler(
+                {
+                    RunLease.FLD_ACTION: RunLease.ACTION_HEARTBEAT,
+                    RunLease.FLD_EXECUTION_ID: execution_id,
+                },
+                None,
+            )
+        except RunLease.LeaseLostError as e:
+            # another run holds the lease now so stop rather than both write
+            print(e)
+            _thread.interrupt_main()
+            return
+
+
+def main() -> None:
+    execution_id = os.environ[ENV_EXECUTION_ID]
+    execution_input = json.loads(os.environ.get(ENV_EXECUTION_INPUT) or "{}")
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_keep_lease,
+        kwargs={"execution_id": execution_id, "stop": stop},
+        daemon=True,
+    )
+    heartbeat.start()
+    try:
+        changes = GetSalesforceChanges.lambda_handler(execution_input, None)
+        run_stats = FinaliseSalesforceUpdate.lambda_handler(changes, None)
+    finally:
+        stop.set()
+
+    # the .sync integration returns the task description rather than any output so the
+    # run stats are kept in s3 against the execution
+    s3_client.put_object(
+        Body=json.dumps(run_stats, indent=2, default=str),
+        Bucket=GetSalesforceChanges.OUTPUT_BUCKET,
+        Key=f"{TASK_OUTPUT_PREFIX}/{execution_id.split(':')[-1]}.json",
+    )
+
+
+if __name__ == "__main__":
+    main()
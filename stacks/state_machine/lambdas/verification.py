@@ -0,0 +1,27 @@
+import json
+from typing import List, Tuple
+
+
+class RunVerificationError(Exception):
+    """
+    A finalise run broke an invariant. The message is json so the failed Step Functions
+    execution carries a structured cause
+    """
+
+
+def check_invariants(label: str, invariants: List[Tuple[str, int, int]]) -> None:
+    """
+    Raise RunVerificationError listing each (name, expected, actual) invariant which
+    does not hold
+    """
+    violations = [
+        {"invariant": name, "expected": expected, "actual": actual}
+        for name, expected, actual in invariants
+        if expected != actual
+    ]
+    for v in violations:
+        print(f"Invariant {v['invariant']} failed for {label}: {v}")
+    if violations:
+        raise RunVerificationError(
+            json.dumps({"file": label, "violations": violations})
+        )
@@ -14,13 +14,72 @@ from aws_cdk import aws_secretsmanager as sm
 from aws_cdk import aws_ssm as ssm
 from cddo.utils import constants as cnst
 from cddo.utils import lambdas
-from cddo.utils.constants import LL_REQUESTS
+from cddo.utils.constants import LL_REQUESTS, PS_SALESFORCE_EVENT_ROOT
 
-from stacks.constants import LL_CDDO_UTILS, FLD_CONTEXT_RDSSECRETNAME
-from .vpc import get_rds_vpc
+from stacks.constants import (
+    LL_CDDO_UTILS,
+    FLD_CONTEXT_DNSWATCH_API_LOOKUP_PATH,
+    FLD_CONTEXT_DNSWATCH_API_MODEL_PATH,
+    FLD_CONTEXT_DNSWATCH_API_TOKEN_SECRET,
+    FLD_CONTEXT_DNSWATCH_API_URL,
+    FLD_CONTEXT_DNSWATCH_SINK,
+    FLD_CONTEXT_FARGATE_RUNNER,
+    FLD_CONTEXT_FARGATE_THRESHOLD_RECORDS,
+    FLD_CONTEXT_RDSSECRETNAME,
+    FLD_CONTEXT_RECONCILE_BUCKETS,
+    FLD_CONTEXT_SALESFORCE_ORG_CONCURRENCY,
+    FLD_CONTEXT_SCHEDULE_MAX_MINUTES,
+    FLD_CONTEXT_SCHEDULE_MIN_MINUTES,
+    STATS_INDEX,
+)
+from stacks.ssm_and_secrets import org_event_root
+from .fargate_runner import create_fargate_runner
+from .vpc import create_rds_proxy, get_rds_vpc
 
 
 ENV_UPDATE_FROM_SALESFORCE_BUCKET = "CDDO_UPDATE_FROM_SALESFORCE_BUCKET"
+ENV_RDS_PROXY_ENDPOINT = "CDDO_RDS_PROXY_ENDPOINT"
+ENV_LEASE_TABLE = "CDDO_LEASE_TABLE"
+ENV_STATS_TABLES = "CDDO_STATS_TABLES"
+ENV_STATS_INDEX = "CDDO_STATS_INDEX"
+ENV_SCHEDULER_ROLE_ARN = "CDDO_SCHEDULER_ROLE_ARN"
+ENV_SCHEDULE_MIN_MINUTES = "CDDO_SCHEDULE_MIN_MINUTES"
+ENV_SCHEDULE_MAX_MINUTES = "CDDO_SCHEDULE_MAX_MINUTES"
+ENV_FARGATE_THRESHOLD_RECORDS = "CDDO_FARGATE_THRESHOLD_RECORDS"
+ENV_RECONCILE_BUCKETS = "CDDO_RECONCILE_BUCKETS"
+ENV_DNSWATCH_SINK = "CDDO_DNSWATCH_SINK"
+ENV_DNSWATCH_API_URL = "CDDO_DNSWATCH_API_URL"
+ENV_DNSWATCH_API_TOKEN_SECRET = "CDDO_DNSWATCH_API_TOKEN_SECRET"
+ENV_DNSWATCH_API_MODEL_PATH = "CDDO_DNSWATCH_API_MODEL_PATH"
+ENV_DNSWATCH_API_LOOKUP_PATH = "CDDO_DNSWATCH_API_LOOKUP_PATH"
+
+STATE_MACHINE_NAME = "SendSalesforceUpdatesToDNSWatch"
+# input of a run started for a change data capture batch, which is finalised as it is
+FLD_CHANGE_DATA_CAPTURE = "changeDataCapture"
+# wait before trying for the lease again, as a batch cannot be coalesced
+CDC_LEASE_WAIT_SECONDS = 30
+# input of a run which reconciles DNSWatch with salesforce instead of polling
+FLD_RECONCILE = "reconcile"
+# input of a run which reads back only the quarantined records of the default org
+FLD_RETRY_QUARANTINE = "retryQuarantine"
+# orgs extracted at once in multi-org mode - they are finalised one at a time
+SALESFORCE_ORG_CONCURRENCY = 4
+ORGS_PREFIX = "orgs"
+
+# one time schedule ScheduleNextRun creates and moves
+NEXT_RUN_SCHEDULE_NAME = "NextSalesforceUpdate"
+
+# one org's extraction in the multi-org Map, as GetSalesforceChanges reads it
+FLD_ORG = "org"
+FLD_ORG_NAME = "name"
+FLD_ORG_EVENT_ROOT = "eventRoot"
+FLD_ORG_PREFIX = "prefix"
+# recorded with each org's run stats so the orgs' extractions count as one run
+FLD_EXECUTION_ID = "executionId"
+
+LEASE_ACQUIRE = "acquire"
+LEASE_HEARTBEAT = "heartbeat"
+LEASE_RELEASE = "release"
 
 layers = {}
 
@@ -60,6 +119,10 @@ def _create_lambda_task(
     memory_size: Optional[int] = 512,
     timeout: int = 900,
     lambda_function: Optional[lambda_.Function] = None,
+    snap_start: bool = False,
+    state_name: Optional[str] = None,
+    payload: Optional[sfn.TaskInput] = None,
+    result_path: Optional[str] = None,
 ) -> Tuple[tasks.LambdaInvoke, lambda_.Function]:
     if not lambda_function:
         lambda_function = lambdas.create_lambda(
@@ -80,27 +143,438 @@ def _create_lambda_task(
         for p in policy_statements:
             lambda_function.add_to_role_policy(p)
 
+    invoked_function = lambda_function
+    if snap_start:
+        # snapshots are only taken of published versions so the task invokes the current version
+        cfn_function: lambda_.CfnFunction = lambda_function.node.default_child
+        cfn_function.add_property_override(
+            "SnapStart", {"ApplyOn": "PublishedVersions"}
+        )
+        invoked_function = lambda_function.current_version
+
     return (
         tasks.LambdaInvoke(
             payload_response_only=True,
             scope=stack,
             id=task_name,
-            state_name=task_name,
+            state_name=state_name or task_name,
             retry_on_service_exceptions=False,
-            lambda_function=lambda_function,
+            lambda_function=invoked_function,
+            payload=payload,
+            result_path=result_path,
         ),
         lambda_function,
     )
 
 
+def _create_lease_tasks(
+    stack: cdk.Stack, lease_table: ddb.TableV2, state_machine_name: str
+) -> Dict[str, tasks.LambdaInvoke]:
+    """
+    Tasks which acquire, heartbeat and release the single-flight lease for the state
+    machine, all invoking one RunLease function
+    """
+
+    def _payload(action: str) -> sfn.TaskInput:
+        payload = {
+            "action": action,
+            "executionId": sfn.JsonPath.string_at("$$.Execution.Id"),
+            "stateMachineArn": sfn.JsonPath.string_at("$$.StateMachine.Id"),
+        }
+        if action == LEASE_ACQUIRE:
+            # only polling runs are coalesced in to a follow up run
+            payload["input"] = sfn.JsonPath.entire_payload
+        return sfn.TaskInput.from_object(payload)
+
+    lease_tasks = dict()
+    lease_tasks["AcquireRunLease"], fn = _create_lambda_task(
+        stack=stack,
+        task_name="RunLease",
+        state_name="AcquireRunLease",
+        description="Single-flight lease for the Salesforce update state machine",
+        environment={ENV_LEASE_TABLE: lease_table.table_name},
+        memory_size=128,
+        timeout=30,
+        payload=_payload(LEASE_ACQUIRE),
+        result_path="$.lease",
+        # a run requested while the lease was held is started when it is released
+        policy_statements=[
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["states:StartExecution"],
+                resources=[
+                    stack.format_arn(
+                        service="states",
+                        resource="stateMachine",
+                        resource_name=state_machine_name,
+                        arn_format=cdk.ArnFormat.COLON_RESOURCE_NAME,
+                    )
+                ],
+            )
+        ],
+    )
+    lease_table.grant_read_write_data(fn)
+
+    for task_name, action in [
+        ("HeartbeatRunLease", LEASE_HEARTBEAT),
+        ("HeartbeatRunLeaseAfterOrgs", LEASE_HEARTBEAT),
+        ("HeartbeatRunLeaseExtractingOrg", LEASE_HEARTBEAT),
+        ("HeartbeatRunLeaseFinalisingOrg", LEASE_HEARTBEAT),
+        ("ReleaseRunLease", LEASE_RELEASE),
+        ("ReleaseRunLeaseAfterFailure", LEASE_RELEASE),
+    ]:
+        lease_tasks[task_name], _ = _create_lambda_task(
+            stack=stack,
+            task_name=task_name,
+            description="",
+            lambda_function=fn,
+            payload=_payload(action),
+            result_path=sfn.JsonPath.DISCARD,
+        )
+
+    return lease_tasks
+
+
+def _create_schedule_next_run_task(
+    stack: cdk.Stack,
+    tables: List[ddb.TableV2],
+    scheduler_role: iam.Role,
+    context: Dict[str, str],
+) -> tasks.LambdaInvoke:
+    """
+    Task which schedules the next run from the change volume in the run stats tables
+    """
+    environment = {
+        ENV_STATS_TABLES: ",".join([t.table_name for t in tables]),
+        ENV_STATS_INDEX: STATS_INDEX,
+        ENV_SCHEDULER_ROLE_ARN: scheduler_role.role_arn,
+    }
+    if FLD_CONTEXT_SCHEDULE_MIN_MINUTES in context:
+        environment[ENV_SCHEDULE_MIN_MINUTES] = str(
+            context[FLD_CONTEXT_SCHEDULE_MIN_MINUTES]
+        )
+    if FLD_CONTEXT_SCHEDULE_MAX_MINUTES in context:
+        environment[ENV_SCHEDULE_MAX_MINUTES] = str(
+            context[FLD_CONTEXT_SCHEDULE_MAX_MINUTES]
+        )
+
+    task, fn = _create_lambda_task(
+        stack=stack,
+        task_name="ScheduleNextRun",
+        description="Schedule the next Salesforce update from recent change volume",
+        environment=environment,
+        memory_size=128,
+        timeout=30,
+        # change data capture and reconcile runs leave the polling schedule alone, and
+        # their state no longer holds the input which started them
+        payload=sfn.TaskInput.from_object(
+            {
+                "stateMachineArn": sfn.JsonPath.string_at("$$.StateMachine.Id"),
+                "input": sfn.JsonPath.object_at("$$.Execution.Input"),
+            }
+        ),
+        result_path="$.nextRun",
+        policy_statements=[
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["scheduler:CreateSchedule", "scheduler:UpdateSchedule"],
+                resources=[
+                    stack.format_arn(
+                        service="scheduler",
+                        resource="schedule",
+                        resource_name=f"default/{NEXT_RUN_SCHEDULE_NAME}",
+                    )
+                ],
+            ),
+        ],
+    )
+    scheduler_role.grant_pass_role(fn)
+    for t in tables:
+        t.grant_read_data(fn)
+
+    return task
+
+
+def _add_dnswatch_api_environment(
+    stack: cdk.Stack, context: Dict[str, Any], environment: Dict[str, str]
+) -> Optional[sm.ISecret]:
+    """
+    Add the settings which send the changes through the DNSWatch bulk APIs, rather
+    than writing its tables, to environment. Returns the API token secret if one is set
+    """
+    if context.get(FLD_CONTEXT_DNSWATCH_SINK):
+        environment[ENV_DNSWATCH_SINK] = context[FLD_CONTEXT_DNSWATCH_SINK]
+    for context_key, env in [
+        (FLD_CONTEXT_DNSWATCH_API_URL, ENV_DNSWATCH_API_URL),
+        (FLD_CONTEXT_DNSWATCH_API_MODEL_PATH, ENV_DNSWATCH_API_MODEL_PATH),
+        (FLD_CONTEXT_DNSWATCH_API_LOOKUP_PATH, ENV_DNSWATCH_API_LOOKUP_PATH),
+    ]:
+        if context_key in context:
+            environment[env] = context[context_key]
+    if FLD_CONTEXT_DNSWATCH_API_TOKEN_SECRET not in context:
+        return None
+
+    environment[ENV_DNSWATCH_API_TOKEN_SECRET] = context[
+        FLD_CONTEXT_DNSWATCH_API_TOKEN_SECRET
+    ]
+    return sm.Secret.from_secret_name_v2(
+        scope=stack,
+        id="DNSWatchApiTokenSecret",
+        secret_name=context[FLD_CONTEXT_DNSWATCH_API_TOKEN_SECRET],
+    )
+
+
+def _create_fargate_run(
+    stack: cdk.Stack,
+    context: Dict[str, Any],
+    vpc: ec2.IVpc,
+    security_group: ec2.ISecurityGroup,
+    vpc_subnets: ec2.SubnetSelection,
+    environment: Dict[str, str],
+    tables: List[ddb.TableV2],
+    lease_table: ddb.TableV2,
+    lease_tasks: Dict[str, tasks.LambdaInvoke],
+    release_after_failure: sfn.IChainable,
+    from_salesforce_bucket: s3.Bucket,
+    rds_secret: sm.ISecret,
+    salesforce_secret: sm.Secret,
+    api_token_secret: Optional[sm.ISecret],
+    last_checked_param: ssm.IParameter,
+    lambda_run: sfn.IChainable,
+) -> sfn.IChainable:
+    """
+    Estimate the size of the run and send runs with more changed records than the
+    Lambda limits allow for to the Fargate runner, the rest to lambda_run
+    """
+    estimate_environment = dict()
+    if FLD_CONTEXT_FARGATE_THRESHOLD_RECORDS in context:
+        estimate_environment[ENV_FARGATE_THRESHOLD_RECORDS] = str(
+            context[FLD_CONTEXT_FARGATE_THRESHOLD_RECORDS]
+        )
+    task_estimate, fn = _create_lambda_task(
+        stack=stack,
+        task_name="EstimateRunSize",
+        description="Count the Salesforce records changed since the last run",
+        environment=estimate_environment,
+        memory_size=256,
+        timeout=60,
+        result_path="$.runSize",
+    )
+    salesforce_secret.grant_read(fn)
+    last_checked_param.grant_read(fn)
+
+    task_fargate, task_role = create_fargate_runner(
+        stack=stack,
+        context=context,
+        vpc=vpc,
+        security_group=security_group,
+        vpc_subnets=vpc_subnets,
+        environment=environment | {ENV_LEASE_TABLE: lease_table.table_name},
+    )
+    from_salesforce_bucket.grant_read_write(task_role)
+    rds_secret.grant_read(task_role)
+    salesforce_secret.grant_read(task_role)
+    if api_token_secret:
+        api_token_secret.grant_read(task_role)
+    last_checked_param.grant_read(task_role)
+    last_checked_param.grant_write(task_role)
+    lease_table.grant_read_write_data(task_role)
+    for t in tables:
+        t.grant_write_data(task_role)
+
+    for t in [task_estimate, task_fargate]:
+        t.add_catch(
+            release_after_failure, errors=[sfn.Errors.ALL], result_path="$.error"
+        )
+
+    return task_estimate.next(
+        sfn.Choice(stack, "IsLargeRun")
+        .when(
+            sfn.Condition.boolean_equals("$.runSize.useFargate", True),
+            task_fargate.next(lease_tasks["ReleaseRunLease"]),
+        )
+        .otherwise(lambda_run)
+    )
+
+
+def _create_reconcile_task(
+    stack: cdk.Stack,
+    context: Dict[str, Any],
+    vpc: ec2.IVpc,
+    security_group: ec2.ISecurityGroup,
+    vpc_subnets: ec2.SubnetSelection,
+    environment: Dict[str, str],
+    from_salesforce_bucket: s3.Bucket,
+    rds_secret: sm.ISecret,
+    salesforce_secret: sm.Secret,
+    release_after_failure: sfn.IChainable,
+) -> tasks.LambdaInvoke:
+    """
+    Task which reads the records of buckets which differ between salesforce and
+    DNSWatch
+    """
+    reconcile_environment = dict(environment)
+    if FLD_CONTEXT_RECONCILE_BUCKETS in context:
+        reconcile_environment[ENV_RECONCILE_BUCKETS] = str(
+            context[FLD_CONTEXT_RECONCILE_BUCKETS]
+        )
+    task_reconcile, fn = _create_lambda_task(
+        stack=stack,
+        task_name="ReconcileSalesforce",
+        description="Find and read back records which differ between Salesforce and DNSWatch",
+        security_groups=[security_group],
+        vpc=vpc,
+        vpc_subnets=vpc_subnets,
+        environment=reconcile_environment,
+        memory_size=2048,
+        timeout=900,
+    )
+    from_salesforce_bucket.grant_read_write(fn)
+    rds_secret.grant_read(fn)
+    salesforce_secret.grant_read(fn)
+    task_reconcile.add_catch(
+        release_after_failure, errors=[sfn.Errors.ALL], result_path="$.error"
+    )
+
+    return task_reconcile
+
+
+def _create_multi_org_run(
+    stack: cdk.Stack,
+    context: Dict[str, Any],
+    org_secrets: Dict[str, Tuple[sm.Secret, ssm.IParameter]],
+    get_fn: lambda_.Function,
+    finalise_fn: lambda_.Function,
+    lease_tasks: Dict[str, tasks.LambdaInvoke],
+    release_after_failure: sfn.IChainable,
+    default_org_run: sfn.IChainable,
+) -> sfn.IChainable:
+    """
+    Extract every org in parallel, up to salesforceOrgConcurrency at once, then
+    finalise each org's files in turn so only one run writes to DNSWatch at a time.
+    The org from the top level context is extracted as the default org. A
+    retryQuarantine run covers the default org only, so goes to default_org_run
+    """
+    orgs = [
+        {
+            FLD_ORG_NAME: "default",
+            FLD_ORG_EVENT_ROOT: PS_SALESFORCE_EVENT_ROOT,
+            FLD_ORG_PREFIX: "",
+        }
+    ]
+    for name, (secret, param) in org_secrets.items():
+        orgs.append(
+            {
+                FLD_ORG_NAME: name,
+                FLD_ORG_EVENT_ROOT: org_event_root(name),
+                FLD_ORG_PREFIX: f"{ORGS_PREFIX}/{name}/",
+            }
+        )
+        secret.grant_read(get_fn)
+        param.grant_read(get_fn)
+        param.grant_write(finalise_fn)
+
+    task_get_org, _ = _create_lambda_task(
+        stack=stack,
+        task_name="GetSalesforceOrgChanges",
+        description="",
+        lambda_function=get_fn,
+        snap_start=True,
+    )
+    # each org is extracted with the execution input, e.g. profile, as the single org
+    # run would be - merged in a Pass as the Map cannot select fields which may be absent
+    with_execution_input = sfn.Pass(
+        stack,
+        "WithExecutionInput",
+        parameters={
+            "event": sfn.JsonPath.json_merge(
+                sfn.JsonPath.object_at("$.input"), sfn.JsonPath.object_at("$.org")
+            )
+        },
+        output_path="$.event",
+    )
+    extract = sfn.Map(
+        stack,
+        "ExtractEachOrg",
+        items_path="$.orgs",
+        item_selector={
+            "input": sfn.JsonPath.object_at("$$.Execution.Input"),
+            "org": {
+                FLD_ORG: sfn.JsonPath.object_at("$$.Map.Item.Value"),
+                FLD_EXECUTION_ID: sfn.JsonPath.string_at("$$.Execution.Id"),
+            },
+        },
+        max_concurrency=int(
+            context.get(
+                FLD_CONTEXT_SALESFORCE_ORG_CONCURRENCY, SALESFORCE_ORG_CONCURRENCY
+            )
+        ),
+        result_path="$.orgResults",
+    ).item_processor(
+        # the lease is renewed as each org starts, as all the orgs together may take
+        # longer than it lasts
+        with_execution_input.next(lease_tasks["HeartbeatRunLeaseExtractingOrg"]).next(
+            task_get_org
+        )
+    )
+
+    task_finalise_org, _ = _create_lambda_task(
+        stack=stack,
+        task_name="FinaliseSalesforceOrgUpdate",
+        description="",
+        lambda_function=finalise_fn,
+        snap_start=True,
+    )
+    finalise = sfn.Map(
+        stack,
+        "FinaliseEachOrg",
+        items_path="$.orgResults",
+        max_concurrency=1,
+        result_path="$.orgStats",
+    ).item_processor(
+        lease_tasks["HeartbeatRunLeaseFinalisingOrg"].next(task_finalise_org)
+    )
+
+    for t in [extract, lease_tasks["HeartbeatRunLeaseAfterOrgs"], finalise]:
+        t.add_catch(
+            release_after_failure, errors=[sfn.Errors.ALL], result_path="$.error"
+        )
+
+    return (
+        sfn.Choice(stack, "IsRetryQuarantine")
+        .when(
+            sfn.Condition.and_(
+                sfn.Condition.is_present(f"$.{FLD_RETRY_QUARANTINE}"),
+                sfn.Condition.boolean_equals(f"$.{FLD_RETRY_QUARANTINE}", True),
+            ),
+            default_org_run,
+        )
+        .otherwise(
+            sfn.Pass(
+                stack,
+                "ListSalesforceOrgs",
+                result=sfn.Result.from_array(orgs),
+                result_path="$.orgs",
+            )
+            .next(extract)
+            .next(lease_tasks["HeartbeatRunLeaseAfterOrgs"])
+            .next(finalise)
+            .next(lease_tasks["ReleaseRunLease"])
+        )
+    )
+
+
 def create_queue_consume_state_machine(
     stack: cdk.Stack,
     tables: List[ddb.TableV2],
+    lease_table: ddb.TableV2,
+    scheduler_role: iam.Role,
     profile: str,
     context: Dict[str, str],
     from_salesforce_bucket: s3.Bucket,
     salesforce_secret: sm.Secret,
     last_checked_param: ssm.IParameter,
+    org_secrets: Optional[Dict[str, Tuple[sm.Secret, ssm.IParameter]]] = None,
 ) -> sfn.StateMachine:
     LL_PSYCOPG = "python_psycopg_layer"
     LL_SQLALCHEMY = "python_sqlalchemy_layer"
@@ -112,9 +586,9 @@ def create_queue_consume_state_machine(
         profile=profile,
     )
 
-    state_machine_name = "SendSalesforceUpdatesToDNSWatch"
+    state_machine_name = STATE_MACHINE_NAME
 
-    task_start_sf_update, fn = _create_lambda_task(
+    task_start_sf_update, get_fn = _create_lambda_task(
         stack=stack,
         task_name="GetSalesforceChanges",
         description="Query Salesforce with REST API to find updated data",
@@ -122,14 +596,15 @@ def create_queue_consume_state_machine(
             ENV_UPDATE_FROM_SALESFORCE_BUCKET: from_salesforce_bucket.bucket_name
         },
         memory_size=2048,
+        snap_start=True,
     )
-    from_salesforce_bucket.grant_put(fn)
-    salesforce_secret.grant_read(fn)
-    last_checked_param.grant_read(fn)
-    last_checked_param.grant_write(fn)
+    # read and move the dead letter files on a retryQuarantine run
+    from_salesforce_bucket.grant_read_write(get_fn)
+    salesforce_secret.grant_read(get_fn)
+    last_checked_param.grant_read(get_fn)
 
     for t in tables:
-        t.grant_write_data(fn)
+        t.grant_write_data(get_fn)
 
     rds_secret = sm.Secret.from_secret_name_v2(
         scope=stack,
@@ -143,7 +618,23 @@ def create_queue_consume_state_machine(
 
     environment[ENV_UPDATE_FROM_SALESFORCE_BUCKET] = from_salesforce_bucket.bucket_name
 
-    task_complete_sf_update, fn = _create_lambda_task(
+    rds_proxy = create_rds_proxy(
+        stack=stack,
+        context=context,
+        vpc=vpc,
+        security_group=security_group,
+        vpc_subnets=vpc_subnets,
+        rds_secret=rds_secret,
+    )
+    if rds_proxy:
+        rds_proxy.connections.allow_default_port_from(security_group)
+        environment[ENV_RDS_PROXY_ENDPOINT] = rds_proxy.endpoint
+
+    api_token_secret = _add_dnswatch_api_environment(
+        stack=stack, context=context, environment=environment
+    )
+
+    task_complete_sf_update, finalise_fn = _create_lambda_task(
         stack=stack,
         task_name="FinaliseSalesforceUpdate",
         description="Finalise Salesforce update",
@@ -153,11 +644,133 @@ def create_queue_consume_state_machine(
         environment=environment,
         memory_size=2048,
         timeout=180,
+        snap_start=True,
+    )
+    from_salesforce_bucket.grant_read_write(finalise_fn)
+    rds_secret.grant_read(finalise_fn)
+    # the watermark moves on once the changes read since it are in DNSWatch
+    last_checked_param.grant_write(finalise_fn)
+    if api_token_secret:
+        api_token_secret.grant_read(finalise_fn)
+
+    lease_tasks = _create_lease_tasks(
+        stack=stack, lease_table=lease_table, state_machine_name=state_machine_name
+    )
+
+    # release the lease however the run ends so the next run is not held up
+    release_after_failure = lease_tasks["ReleaseRunLeaseAfterFailure"].next(
+        sfn.Fail(stack, "SalesforceUpdateFailed", error="SalesforceUpdateFailed")
+    )
+    for t in [
+        task_start_sf_update,
+        lease_tasks["HeartbeatRunLease"],
+        task_complete_sf_update,
+    ]:
+        t.add_catch(
+            release_after_failure, errors=[sfn.Errors.ALL], result_path="$.error"
+        )
+
+    run = (
+        task_start_sf_update.next(lease_tasks["HeartbeatRunLease"])
+        .next(task_complete_sf_update)
+        .next(lease_tasks["ReleaseRunLease"])
+        .next(
+            _create_schedule_next_run_task(
+                stack=stack,
+                tables=tables,
+                scheduler_role=scheduler_role,
+                context=context,
+            )
+        )
     )
-    from_salesforce_bucket.grant_read_write(fn)
-    rds_secret.grant_read(fn)
 
-    definition = task_start_sf_update.next(task_complete_sf_update)
+    if context.get(FLD_CONTEXT_FARGATE_RUNNER):
+        run = _create_fargate_run(
+            stack=stack,
+            context=context,
+            vpc=vpc,
+            security_group=security_group,
+            vpc_subnets=vpc_subnets,
+            environment=environment,
+            tables=tables,
+            lease_table=lease_table,
+            lease_tasks=lease_tasks,
+            release_after_failure=release_after_failure,
+            from_salesforce_bucket=from_salesforce_bucket,
+            rds_secret=rds_secret,
+            salesforce_secret=salesforce_secret,
+            api_token_secret=api_token_secret,
+            last_checked_param=last_checked_param,
+            lambda_run=run,
+        )
+
+    if org_secrets:
+        if context.get(FLD_CONTEXT_FARGATE_RUNNER):
+            raise ValueError("fargateRunner is not supported with salesforceOrgs")
+        run = _create_multi_org_run(
+            stack=stack,
+            context=context,
+            org_secrets=org_secrets,
+            get_fn=get_fn,
+            finalise_fn=finalise_fn,
+            lease_tasks=lease_tasks,
+            release_after_failure=release_after_failure,
+            default_org_run=run,
+        )
+
+    task_reconcile = _create_reconcile_task(
+        stack=stack,
+        context=context,
+        vpc=vpc,
+        security_group=security_group,
+        vpc_subnets=vpc_subnets,
+        environment=environment,
+        from_salesforce_bucket=from_salesforce_bucket,
+        rds_secret=rds_secret,
+        salesforce_secret=salesforce_secret,
+        release_after_failure=release_after_failure,
+    )
+
+    # a change data capture batch has already been read from salesforce
+    change_data_capture = sfn.Choice(stack, "IsChangeDataCaptureBatch")
+    change_data_capture.when(
+        sfn.Condition.is_present(f"$.{FLD_CHANGE_DATA_CAPTURE}"),
+        sfn.Pass(
+            stack,
+            "UseChangeDataCaptureBatch",
+            output_path=f"$.{FLD_CHANGE_DATA_CAPTURE}",
+        ).next(lease_tasks["HeartbeatRunLease"]),
+    ).when(
+        sfn.Condition.is_present(f"$.{FLD_RECONCILE}"),
+        task_reconcile.next(lease_tasks["HeartbeatRunLease"]),
+    ).otherwise(
+        run
+    )
+
+    definition = lease_tasks["AcquireRunLease"].next(
+        sfn.Choice(stack, "RunLeaseAcquired")
+        .when(
+            sfn.Condition.and_(
+                sfn.Condition.boolean_equals("$.lease.acquired", False),
+                sfn.Condition.or_(
+                    sfn.Condition.is_present(f"$.{FLD_CHANGE_DATA_CAPTURE}"),
+                    sfn.Condition.is_present(f"$.{FLD_RECONCILE}"),
+                ),
+            ),
+            sfn.Wait(
+                stack,
+                "WaitForRunLease",
+                time=sfn.WaitTime.duration(
+                    cdk.Duration.seconds(CDC_LEASE_WAIT_SECONDS)
+                ),
+            ).next(lease_tasks["AcquireRunLease"]),
+        )
+        .when(
+            sfn.Condition.boolean_equals("$.lease.acquired", False),
+            sfn.Succeed(stack, "CoalescedInToFollowUpRun"),
+        )
+        .otherwise(change_data_capture)
+    )
 
     log_group = logs.LogGroup(
         stack,
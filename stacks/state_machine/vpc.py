@@ -1,12 +1,18 @@
-from typing import Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 import aws_cdk.aws_ec2 as ec2
-from aws_cdk import Stack
+import aws_cdk.aws_rds as rds
+from aws_cdk import Duration, Stack
+from aws_cdk import aws_secretsmanager as sm
 from cddo.utils.constants import ENV_RDS_SECRET_NAME
 
 from stacks.constants import (
     FLD_CONTEXT_PRIVATESUBNETID1,
     FLD_CONTEXT_PRIVATESUBNETID2,
+    FLD_CONTEXT_RDSENDPOINT,
+    FLD_CONTEXT_RDSINSTANCEID,
+    FLD_CONTEXT_RDSPORT,
+    FLD_CONTEXT_RDSPROXY,
     FLD_CONTEXT_RDSSECRETNAME,
     FLD_CONTEXT_VPCID,
     FLD_CONTEXT_BASTIONHOSTSG,
@@ -41,3 +47,45 @@ def get_rds_vpc(
         ec2.SubnetSelection(subnets=[subnet1, subnet2]),
         environment,
     )
+
+
+def create_rds_proxy(
+    stack: Stack,
+    context: Dict[str, Any],
+    vpc: ec2.Vpc,
+    security_group: ec2.SecurityGroup,
+    vpc_subnets: ec2.SubnetSelection,
+    rds_secret: sm.ISecret,
+) -> Optional[rds.DatabaseProxy]:
+    """
+    RDS Proxy in front of the DNSWatch database so frequent runs share a small pool of
+    database connections - only created when the context asks for it. Finalise's
+    prepared statements pin its session, so this guards against connection storms
+    rather than multiplexing transactions
+    """
+    if not context.get(FLD_CONTEXT_RDSPROXY, False):
+        return None
+
+    instance = rds.DatabaseInstance.from_database_instance_attributes(
+        stack,
+        "RDSInstance",
+        instance_identifier=context[FLD_CONTEXT_RDSINSTANCEID],
+        instance_endpoint_address=context[FLD_CONTEXT_RDSENDPOINT],
+        port=int(context.get(FLD_CONTEXT_RDSPORT, 5432)),
+        security_groups=[security_group],
+        engine=rds.DatabaseInstanceEngine.POSTGRES,
+    )
+
+    return rds.DatabaseProxy(
+        stack,
+        "RDSProxy",
+        db_proxy_name=f"{stack.stack_name}-dnswatch",
+        proxy_target=rds.ProxyTarget.from_instance(instance),
+        secrets=[rds_secret],
+        vpc=vpc,
+        vpc_subnets=vpc_subnets,
+        security_groups=[security_group],
+        require_tls=True,
+        idle_client_timeout=Duration.minutes(30),
+        max_connections_percent=25,
+    )
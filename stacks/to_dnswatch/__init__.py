@@ -0,0 +1 @@
+from .to_dnswatch import ToDNSWatch  # noqa: F401
@@ -0,0 +1,103 @@
+from typing import Any, Dict
+
+from aws_cdk import Stack
+from constructs import Construct
+
+from stacks.constants import FLD_CONTEXT_PROFILE, FLD_CONTEXT_SCHEDULE_EXPRESSION
+from stacks.dynamodb import create_dynamodb_tables, create_lease_table
+from stacks.eventbridge import create_schedule, create_scheduler_role
+from stacks.json_bucket import create_s3_bucket
+from stacks.ssm_and_secrets import (
+    create_org_secrets_and_params,
+    create_secrets_and_params,
+)
+from stacks.state_machine import (
+    STATE_MACHINE_NAME,
+    create_change_data_capture,
+    create_queue_consume_state_machine,
+)
+
+
+class ToDNSWatch(Stack):
+    """
+    1. Create secrets for salesforce access and parameter for "last updated" variables
+    2. Create s3 bucket to put json files extracted from salesforce
+    3. Create dynamodb tables to store import stats (number of records of each type pulled from salesforce)
+       and the lease which stops runs overlapping
+    4. Create state machine to pull data from salesforce to DNSWatch - steps are:
+     * AcquireRunLease - skip the run, coalescing it in to one follow up run, if another is in progress
+     * Change data capture batches skip State 1 as they have already been read from salesforce
+     * With salesforceOrgs set, State 1 runs for each org in parallel and State 3 for each org in turn
+     * EstimateRunSize - with fargateRunner set, runs too large for lambda run States 1 and 3 in a fargate task
+     * State 1: GetSalesforceChanges - lambda function to call salesforce api to get changes and save them to json files
+     * State 2: domains-dnswatch-bulk-update-from-salesforce - farget task to process files
+     * State 3: FinaliseSalesforceUpdate - lambda to archive processed files
+     * ScheduleNextRun - schedule the next run sooner or later depending on how many records changed
+    5. Optionally consume salesforce change data capture events from an eventbridge partner bus
+    6. Create eventbridge rule to run the state machine on the fixed schedule, the slowest polling rate
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        context: Dict[str, Any],
+        from_salesforce_bucket_name: str,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # ARNs for secrets and parameters - needed to grant permissions to lambda functions for read/write
+        salesforce_secret, last_checked_param = create_secrets_and_params(
+            stack=self,
+            context=context,
+        )
+
+        # a secret and "last updated" parameter for each additional org in multi-org mode
+        org_secrets = create_org_secrets_and_params(stack=self, context=context)
+
+        # Bucket to put data read from salesforce REST API
+        from_salesforce_bucket = create_s3_bucket(
+            stack=self, bucket_name=from_salesforce_bucket_name
+        )
+
+        # dynamodb tables to store summary stats of each run
+        tables = create_dynamodb_tables(stack=self)
+
+        # dynamodb table holding the lease which stops runs overlapping
+        lease_table = create_lease_table(stack=self)
+
+        # role eventbridge scheduler uses for the adaptive one time runs
+        scheduler_role = create_scheduler_role(
+            stack=self, state_machine_name=STATE_MACHINE_NAME
+        )
+
+        # State machine to run all steps in the update run on an EventBridge schedule
+        sm = create_queue_consume_state_machine(
+            stack=self,
+            from_salesforce_bucket=from_salesforce_bucket,
+            salesforce_secret=salesforce_secret,
+            last_checked_param=last_checked_param,
+            org_secrets=org_secrets,
+            tables=tables,
+            lease_table=lease_table,
+            scheduler_role=scheduler_role,
+            profile=self.node.get_context(FLD_CONTEXT_PROFILE),
+            context=context,
+        )
+
+        # Push ingestion of salesforce change events when a partner bus is configured
+        create_change_data_capture(
+            stack=self,
+            context=context,
+            state_machine=sm,
+            from_salesforce_bucket=from_salesforce_bucket,
+            salesforce_secret=salesforce_secret,
+        )
+
+        # Eventbridge schedule to run update
+        create_schedule(
+            stack=self,
+            schedule_expression=self.node.get_context(FLD_CONTEXT_SCHEDULE_EXPRESSION),
+            state_machine=sm,
+        )
@@ -0,0 +1,67 @@
+import pytest
+
+import chunk_planner
+from batched_merge import MAX_BATCH_SIZE, MIN_BATCH_SIZE
+from chunk_planner import (
+    ENV_MEMORY_SIZE,
+    MIB,
+    PLAN_CSV_CHUNK_ROWS,
+    PLAN_MERGE_BATCH_SIZE,
+    PLAN_S3_PART_SIZE,
+    PLAN_SALESFORCE_BATCH_SIZE,
+    plan_chunks,
+)
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """
+    Set the function memory size and resident set size, in MiB, the plan is made from
+    """
+
+    def _memory(memory_size: int, rss: int) -> None:
+        monkeypatch.setenv(ENV_MEMORY_SIZE, str(memory_size))
+        monkeypatch.setattr(chunk_planner, "rss_bytes", lambda: rss * MIB)
+
+    monkeypatch.setattr(chunk_planner, "CHUNK_MEMORY_FRACTION", 0.5)
+    return _memory
+
+
+def test_large_function_plans_the_upper_limits(memory):
+    memory(memory_size=2048, rss=0)
+    assert plan_chunks() == {
+        PLAN_SALESFORCE_BATCH_SIZE: 2000,
+        PLAN_S3_PART_SIZE: 100 * MIB,
+        PLAN_CSV_CHUNK_ROWS: 100000,
+        PLAN_MERGE_BATCH_SIZE: MAX_BATCH_SIZE,
+    }
+
+
+def test_no_memory_left_plans_the_lower_limits(memory):
+    memory(memory_size=128, rss=128)
+    assert plan_chunks() == {
+        PLAN_SALESFORCE_BATCH_SIZE: 200,
+        PLAN_S3_PART_SIZE: 5 * MIB,
+        PLAN_CSV_CHUNK_ROWS: 1000,
+        PLAN_MERGE_BATCH_SIZE: MIN_BATCH_SIZE,
+    }
+
+
+def test_budget_is_split_between_workers(memory):
+    memory(memory_size=2048, rss=0)
+    # 16 MiB each
+    assert plan_chunks(workers=64) == {
+        PLAN_SALESFORCE_BATCH_SIZE: 512,
+        PLAN_S3_PART_SIZE: 5 * MIB,
+        PLAN_CSV_CHUNK_ROWS: 4096,
+        PLAN_MERGE_BATCH_SIZE: 4096,
+    }
+
+
+def test_overrides_are_used_as_they_are(memory):
+    memory(memory_size=2048, rss=0)
+    plan = plan_chunks(
+        overrides={PLAN_SALESFORCE_BATCH_SIZE: 300, PLAN_S3_PART_SIZE: None}
+    )
+    assert plan[PLAN_SALESFORCE_BATCH_SIZE] == 300
+    assert plan[PLAN_S3_PART_SIZE] == 100 * MIB
@@ -0,0 +1,47 @@
+import pytest
+import sqlalchemy
+
+APPLICATION_NAME = "test_db_engine"
+
+
+@pytest.fixture
+def db_engine(database_url):
+    # the secret path needs cddo-utils, though a database url never reads the secret
+    pytest.importorskip("cddo")
+    import db_engine
+
+    db_engine.reset_engine()
+    yield db_engine
+    db_engine.reset_engine()
+
+
+def test_engine_is_reused_by_warm_invocations(db_engine):
+    engine = db_engine.get_engine(application_name=APPLICATION_NAME)
+    assert db_engine.get_engine(application_name=APPLICATION_NAME) is engine
+
+    db_engine.reset_engine()
+    assert db_engine.get_engine(application_name=APPLICATION_NAME) is not engine
+
+
+def test_connections_carry_the_application_name(db_engine):
+    with db_engine.connect(application_name=APPLICATION_NAME) as db_conn:
+        name = db_conn.execute(
+            sqlalchemy.text("SELECT current_setting('application_name')")
+        ).scalar()
+    assert name == APPLICATION_NAME
+
+
+def test_dropped_connection_is_replaced(db_engine, database_url):
+    # as when the environment was frozen long enough for the server to drop it
+    with db_engine.connect(application_name=APPLICATION_NAME) as db_conn:
+        pid = db_conn.execute(sqlalchemy.text("SELECT pg_backend_pid()")).scalar()
+
+    # from outside the pool, which now holds the connection being dropped
+    other = sqlalchemy.create_engine(database_url, poolclass=sqlalchemy.NullPool)
+    with other.connect() as other_conn:
+        other_conn.execute(
+            sqlalchemy.text("SELECT pg_terminate_backend(:pid)"), {"pid": pid}
+        )
+
+    with db_engine.connect(application_name=APPLICATION_NAME) as db_conn:
+        assert db_conn.execute(sqlalchemy.text("SELECT 1")).scalar() == 1
@@ -0,0 +1,215 @@
+import json
+from typing import Any, Dict
+
+import pytest
+from aws_cdk.assertions import Match, Template
+
+from tools.synth_offline import OFFLINE_SUBNETS, VARIANTS, synth_offline
+
+# the values below are written out rather than imported so a change to the sizing or
+# concurrency of a run shows up here in review
+
+# seconds one synthesis may take - well above a normal synth, so a failure means a
+# change has made deploys markedly slower
+SYNTH_SECONDS_BUDGET = 60
+
+GET_DESCRIPTION = "Query Salesforce with REST API to find updated data"
+FINALISE_DESCRIPTION = "Finalise Salesforce update"
+RECONCILE_DESCRIPTION = (
+    "Find and read back records which differ between Salesforce and DNSWatch"
+)
+LEASE_DESCRIPTION = "Single-flight lease for the Salesforce update state machine"
+SCHEDULE_DESCRIPTION = "Schedule the next Salesforce update from recent change volume"
+ESTIMATE_DESCRIPTION = "Count the Salesforce records changed since the last run"
+CDC_DESCRIPTION = "Micro-batch Salesforce change events in to a DNSWatch update"
+
+LAYER_COUNT = 5
+
+
+@pytest.fixture(scope="module")
+def synthesized():
+    """
+    Template and synthesis seconds of each variant, synthesized once per module
+    """
+    cache = dict()
+
+    def _synth(variant: str):
+        if variant not in cache:
+            cache[variant] = synth_offline(profile_context=VARIANTS[variant])
+        return cache[variant]
+
+    return _synth
+
+
+def _function(template: Template, description: str) -> Dict[str, Any]:
+    functions = template.find_resources(
+        "AWS::Lambda::Function", {"Properties": {"Description": description}}
+    )
+    assert len(functions) == 1, description
+    return next(iter(functions.values()))["Properties"]
+
+
+def _states(template: Template) -> Dict[str, Any]:
+    """
+    Top level states of the state machine definition
+    """
+    machines = template.find_resources("AWS::StepFunctions::StateMachine")
+    assert len(machines) == 1
+    definition = next(iter(machines.values()))["Properties"]["DefinitionString"]
+    if isinstance(definition, dict):
+        # tokens, such as function arns, are joined in and all sit inside json strings
+        definition = "".join(
+            p if isinstance(p, str) else "token" for p in definition["Fn::Join"][1]
+        )
+    return json.loads(definition)["States"]
+
+
+@pytest.mark.parametrize("variant", list(VARIANTS))
+def test_synthesizes_offline_within_budget(synthesized, variant):
+    _, seconds = synthesized(variant)
+    assert seconds < SYNTH_SECONDS_BUDGET
+
+
+@pytest.mark.parametrize(
+    "description,memory_size,timeout",
+    [
+        (GET_DESCRIPTION, 2048, 900),
+        (FINALISE_DESCRIPTION, 2048, 180),
+        (RECONCILE_DESCRIPTION, 2048, 900),
+        (LEASE_DESCRIPTION, 128, 30),
+        (SCHEDULE_DESCRIPTION, 128, 30),
+    ],
+)
+def test_function_sizing(synthesized, description, memory_size, timeout):
+    template, _ = synthesized("default")
+    function = _function(template, description)
+    assert function["MemorySize"] == memory_size
+    assert function["Timeout"] == timeout
+
+
+def test_optional_function_sizing(synthesized):
+    template, _ = synthesized("fargate")
+    function = _function(template, ESTIMATE_DESCRIPTION)
+    assert (function["MemorySize"], function["Timeout"]) == (256, 60)
+
+    template, _ = synthesized("cdc")
+    function = _function(template, CDC_DESCRIPTION)
+    assert (function["MemorySize"], function["Timeout"]) == (512, 300)
+
+
+@pytest.mark.parametrize("description", [GET_DESCRIPTION, FINALISE_DESCRIPTION])
+def test_snap_start(synthesized, description):
+    template, _ = synthesized("default")
+    function = _function(template, description)
+    assert function["SnapStart"] == {"ApplyOn": "PublishedVersions"}
+
+
+def test_layers(synthesized):
+    template, _ = synthesized("default")
+    template.resource_count_is("AWS::Lambda::LayerVersion", LAYER_COUNT)
+    for description in [
+        GET_DESCRIPTION,
+        FINALISE_DESCRIPTION,
+        RECONCILE_DESCRIPTION,
+        LEASE_DESCRIPTION,
+        SCHEDULE_DESCRIPTION,
+    ]:
+        assert len(_function(template, description)["Layers"]) == LAYER_COUNT
+
+
+@pytest.mark.parametrize("description", [FINALISE_DESCRIPTION, RECONCILE_DESCRIPTION])
+def test_database_functions_in_database_subnets(synthesized, description):
+    template, _ = synthesized("default")
+    function = _function(template, description)
+    assert function["VpcConfig"]["SubnetIds"] == [s[0] for s in OFFLINE_SUBNETS]
+
+
+def test_rds_proxy(synthesized):
+    template, _ = synthesized("rdsProxy")
+    template.resource_count_is("AWS::RDS::DBProxy", 1)
+    function = _function(template, FINALISE_DESCRIPTION)
+    assert "CDDO_RDS_PROXY_ENDPOINT" in function["Environment"]["Variables"]
+
+    template, _ = synthesized("default")
+    template.resource_count_is("AWS::RDS::DBProxy", 0)
+    function = _function(template, FINALISE_DESCRIPTION)
+    assert "CDDO_RDS_PROXY_ENDPOINT" not in function["Environment"]["Variables"]
+
+
+def test_state_machine_logging(synthesized):
+    template, _ = synthesized("default")
+    template.has_resource_properties(
+        "AWS::StepFunctions::StateMachine",
+        {"LoggingConfiguration": Match.object_like({"Level": "ALL"})},
+    )
+
+
+def test_org_concurrency(synthesized):
+    template, _ = synthesized("orgs")
+    states = _states(template)
+    assert states["ExtractEachOrg"]["MaxConcurrency"] == 4
+    # one org at a time writes to DNSWatch
+    assert states["FinaliseEachOrg"]["MaxConcurrency"] == 1
+
+
+def test_org_runs_keep_the_execution_input(synthesized):
+    template, _ = synthesized("orgs")
+    states = _states(template)
+    # each org is extracted with the input the execution was started with
+    assert states["ExtractEachOrg"]["ItemProcessor"]["StartAt"] == "WithExecutionInput"
+    # and a retryQuarantine run goes to the default org alone
+    assert states["IsRetryQuarantine"]["Default"] == "ListSalesforceOrgs"
+
+
+def test_org_runs_heartbeat_the_lease(synthesized):
+    template, _ = synthesized("orgs")
+    states = _states(template)
+    # the lease is renewed as each org is extracted and as each is finalised
+    assert "HeartbeatRunLeaseExtractingOrg" in (
+        states["ExtractEachOrg"]["ItemProcessor"]["States"]
+    )
+    assert (
+        states["FinaliseEachOrg"]["ItemProcessor"]["StartAt"]
+        == "HeartbeatRunLeaseFinalisingOrg"
+    )
+
+
+def test_fargate_task_size(synthesized):
+    template, _ = synthesized("fargate")
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition", {"Cpu": "4096", "Memory": "16384"}
+    )
+
+
+def test_fargate_statement_timeout(synthesized):
+    template, _ = synthesized("fargate")
+    # large runs merge in one statement, for longer than the Lambda default allows
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {
+            "ContainerDefinitions": Match.array_with(
+                [
+                    Match.object_like(
+                        {
+                            "Environment": Match.array_with(
+                                [{"Name": "CDDO_STATEMENT_TIMEOUT", "Value": "60min"}]
+                            )
+                        }
+                    )
+                ]
+            )
+        },
+    )
+
+
+def test_change_data_capture_batching(synthesized):
+    template, _ = synthesized("cdc")
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"BatchSize": 1000, "MaximumBatchingWindowInSeconds": 60},
+    )
+
+
+def test_fargate_runner_with_orgs_is_rejected():
+    with pytest.raises(ValueError):
+        synth_offline(profile_context=VARIANTS["fargate"] | VARIANTS["orgs"])
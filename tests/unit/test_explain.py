@@ -0,0 +1,23 @@
+from explain import ENV_EXPLAIN, FLD_EXPLAIN, explain_enabled, pass_explain
+
+
+def test_explain_is_off_by_default(monkeypatch):
+    monkeypatch.delenv(ENV_EXPLAIN, raising=False)
+    assert not explain_enabled({})
+
+
+def test_explain_from_the_environment(monkeypatch):
+    monkeypatch.setenv(ENV_EXPLAIN, "true")
+    assert explain_enabled({})
+
+
+def test_execution_input_reaches_finalise(monkeypatch):
+    monkeypatch.delenv(ENV_EXPLAIN, raising=False)
+    # GetSalesforceChanges' output is FinaliseSalesforceUpdate's input
+    output = pass_explain(event={FLD_EXPLAIN: True}, output={"lookupFile": "x.csv"})
+    assert output == {"lookupFile": "x.csv", FLD_EXPLAIN: True}
+    assert explain_enabled(output)
+
+
+def test_nothing_passed_without_the_opt_in():
+    assert pass_explain(event={}, output={}) == {}
@@ -0,0 +1,84 @@
+import io
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+# the DNSWatch tables are created in their own schema, ahead of public on the search
+# path, as the staging table is written to public
+SCHEMA = "test_finalise_sql_sink"
+LOOKUP_FILE = "salesforce_salesforceobject.csv"
+
+
+@pytest.fixture
+def finalise(database_url, monkeypatch):
+    pytest.importorskip("cddo")
+    from cddo.utils.constants import ENV_UPDATE_FROM_SALESFORCE_BUCKET
+
+    monkeypatch.setenv(ENV_UPDATE_FROM_SALESFORCE_BUCKET, "test-bucket")
+    import db_engine
+    import FinaliseSalesforceUpdate
+
+    url = sqlalchemy.make_url(database_url)
+    engine = sqlalchemy.create_engine(url, poolclass=sqlalchemy.NullPool)
+    with engine.begin() as db_conn:
+        for statement in [
+            f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+            f"CREATE SCHEMA {SCHEMA}",
+            f"CREATE TABLE {SCHEMA}.django_content_type (id int, model text)",
+            f"INSERT INTO {SCHEMA}.django_content_type VALUES (1, 'domain')",
+            f"CREATE TABLE {SCHEMA}.salesforce_salesforceobject "
+            "(id serial, object_id int, salesforce_id text, content_type_id int, "
+            "batch uuid)",
+        ]:
+            db_conn.execute(sqlalchemy.text(statement))
+
+    monkeypatch.setenv(
+        db_engine.ENV_DATABASE_URL,
+        url.update_query_dict(
+            {"options": f"-csearch_path={SCHEMA},public"}
+        ).render_as_string(hide_password=False),
+    )
+    monkeypatch.setattr(FinaliseSalesforceUpdate, "ID_MAPPING", False)
+    db_engine.reset_engine()
+    yield FinaliseSalesforceUpdate
+    db_engine.reset_engine()
+
+    with engine.begin() as db_conn:
+        db_conn.execute(sqlalchemy.text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+
+def _lookup(finalise, monkeypatch, csv: str):
+    def _read_csv_chunks(bucket_name, key, chunksize=None, **kwargs):
+        assert key == LOOKUP_FILE
+        yield from pd.read_csv(io.StringIO(csv), chunksize=1000, **kwargs)
+
+    monkeypatch.setattr(finalise, "_read_csv_chunks", _read_csv_chunks)
+    return finalise._sql_sink(event={}, input_files={}, lookup_file=LOOKUP_FILE)
+
+
+def _objects(database_url):
+    engine = sqlalchemy.create_engine(database_url, poolclass=sqlalchemy.NullPool)
+    with engine.connect() as db_conn:
+        return db_conn.execute(
+            sqlalchemy.text(
+                "SELECT id, object_id, salesforce_id, content_type_id "
+                f"FROM {SCHEMA}.salesforce_salesforceobject ORDER BY id"
+            )
+        ).all()
+
+
+def test_new_lookup_row_is_inserted_and_verified(finalise, monkeypatch, database_url):
+    run_stats = _lookup(
+        finalise, monkeypatch, "id,salesforce_id,model\n7,a0B000000000001,domain\n"
+    )
+    assert run_stats[LOOKUP_FILE]["rows_inserted"] == 1
+    assert _objects(database_url) == [(1, 7, "a0B000000000001", 1)]
+
+    # read again, the row is matched rather than inserted a second time
+    run_stats = _lookup(
+        finalise, monkeypatch, "id,salesforce_id,model\n7,a0B000000000002,domain\n"
+    )
+    assert run_stats[LOOKUP_FILE]["rows_inserted"] == 0
+    assert run_stats[LOOKUP_FILE]["rows_changed"] == 1
+    assert _objects(database_url) == [(1, 7, "a0B000000000002", 1)]
@@ -0,0 +1,101 @@
+import pandas as pd
+
+from id_mapping import (
+    FLD_CONTENT_TYPE_ID,
+    FLD_MODEL,
+    FLD_OBJECT_ID,
+    FLD_SALESFORCE_ID,
+    FLD_SSO_ID,
+    MAPPING_DTYPES,
+    classify,
+    empty_mapping,
+    update_mapping,
+)
+
+
+def _mapping(rows) -> pd.DataFrame:
+    return update_mapping(
+        mapping=empty_mapping(),
+        changed=pd.DataFrame(
+            rows,
+            columns=[
+                FLD_MODEL,
+                FLD_OBJECT_ID,
+                FLD_SALESFORCE_ID,
+                FLD_SSO_ID,
+                FLD_CONTENT_TYPE_ID,
+            ],
+        ),
+    )
+
+
+def _lookup(rows) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=["id", FLD_SALESFORCE_ID, FLD_MODEL])
+    df["id"] = df["id"].astype("int64")
+    return df
+
+
+MAPPING = _mapping(
+    [
+        ("organisation", 1, "001A", 10, 7),
+        ("domain", 1, "a0B1", 11, 8),
+        ("domain", 2, "a0B2", 12, 8),
+    ]
+)
+
+
+def test_classify():
+    df, counts = classify(
+        mapping=MAPPING,
+        df=_lookup(
+            [
+                # unchanged
+                (1, "a0B1", "domain"),
+                # new salesforce id for a known row
+                (2, "a0B2-new", "domain"),
+                # unknown - same object id as a known row of another model
+                (2, "001B", "organisation"),
+            ]
+        ),
+    )
+    assert counts == {"unchanged": 1, "updates": 1, "unknown": 1}
+    assert df[[FLD_MODEL, "id", FLD_SSO_ID, FLD_CONTENT_TYPE_ID]].values.tolist() == [
+        ["domain", 2, 12, 8],
+        ["organisation", 2, 0, 0],
+    ]
+
+
+def test_classify_with_an_empty_mapping():
+    df, counts = classify(
+        mapping=empty_mapping(), df=_lookup([(1, "001A", "organisation")])
+    )
+    assert counts == {"unchanged": 0, "updates": 0, "unknown": 1}
+    assert df[FLD_SSO_ID].tolist() == [0]
+
+
+def test_update_mapping_replaces_rows_and_keeps_order():
+    mapping = update_mapping(
+        mapping=MAPPING,
+        changed=pd.DataFrame(
+            {
+                FLD_MODEL: ["domain", "domain"],
+                FLD_OBJECT_ID: [2, 0],
+                FLD_SALESFORCE_ID: ["a0B2-new", "a0B0"],
+                FLD_SSO_ID: [12, 13],
+                FLD_CONTENT_TYPE_ID: [8, 8],
+            }
+        ),
+    )
+    assert mapping[[FLD_MODEL, FLD_OBJECT_ID, FLD_SALESFORCE_ID]].values.tolist() == [
+        ["domain", 0, "a0B0"],
+        ["domain", 1, "a0B1"],
+        ["domain", 2, "a0B2-new"],
+        ["organisation", 1, "001A"],
+    ]
+    assert {c: str(t) for c, t in mapping.dtypes.items()} == {
+        c: str(pd.Series([], dtype=t).dtype) for c, t in MAPPING_DTYPES.items()
+    }
+
+
+def test_update_mapping_without_changes():
+    assert update_mapping(mapping=MAPPING, changed=MAPPING.iloc[:0]) is MAPPING
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from quarantine import (
+    FLD_REASON,
+    MAX_VARCHAR,
+    REASON_DUPLICATE_KEY,
+    REASON_INVALID_KEY,
+    REASON_MISSING_KEY,
+    REASON_UNKNOWN_MODEL,
+    REASON_VALUE_TOO_LONG,
+    retryable_ids,
+    validate_rows,
+)
+
+MODELS = {"organisation", "domain"}
+
+
+def _validate(df: pd.DataFrame, seen=None):
+    return validate_rows(
+        df=df,
+        key_columns=["id"],
+        seen=set() if seen is None else seen,
+        varchar_columns=["salesforce_id"],
+        models=MODELS,
+        scope_columns=["model"],
+    )
+
+
+def test_reason_codes():
+    good, rejected = _validate(
+        pd.DataFrame(
+            {
+                "id": ["1", None, "x", "2.5", "3", "4", "5", "5", "5"],
+                "salesforce_id": ["a", "b", "c", "d", "e", "f" * (MAX_VARCHAR + 1)]
+                + ["g", "h", "i"],
+                "model": ["domain"] * 4 + ["user"] + ["domain"] * 3 + ["organisation"],
+            }
+        )
+    )
+    assert rejected[FLD_REASON].tolist() == [
+        REASON_MISSING_KEY,
+        REASON_INVALID_KEY,
+        REASON_INVALID_KEY,
+        REASON_UNKNOWN_MODEL,
+        REASON_VALUE_TOO_LONG,
+        REASON_DUPLICATE_KEY,
+    ]
+    # the first row with a key is kept, and keys are only unique within their model
+    assert good[["id", "salesforce_id", "model"]].values.tolist() == [
+        [1, "a", "domain"],
+        [5, "g", "domain"],
+        [5, "i", "organisation"],
+    ]
+    assert str(good["id"].dtype) == "int64"
+
+
+def test_first_failed_check_gives_the_reason():
+    _, rejected = _validate(
+        pd.DataFrame(
+            {"id": ["x"], "salesforce_id": ["f" * (MAX_VARCHAR + 1)], "model": ["user"]}
+        )
+    )
+    assert rejected[FLD_REASON].tolist() == [REASON_INVALID_KEY]
+
+
+def test_duplicates_are_found_across_chunks():
+    seen = set()
+    chunk = pd.DataFrame({"id": ["1"], "salesforce_id": ["a"], "model": ["domain"]})
+    good, _ = _validate(chunk, seen=seen)
+    assert len(good) == 1
+    good, rejected = _validate(chunk, seen=seen)
+    assert len(good) == 0
+    assert rejected[FLD_REASON].tolist() == [REASON_DUPLICATE_KEY]
+
+
+def test_duplicates_are_not_retried():
+    df = pd.DataFrame(
+        {
+            "model": ["domain", "domain", "organisation", "domain"],
+            "salesforce_id": ["a", "b", "c", None],
+            FLD_REASON: [
+                REASON_VALUE_TOO_LONG,
+                REASON_DUPLICATE_KEY,
+                REASON_INVALID_KEY,
+                REASON_INVALID_KEY,
+            ],
+        }
+    )
+    assert retryable_ids(df) == {"domain": {"a"}, "organisation": {"c"}}
@@ -0,0 +1,88 @@
+import pandas as pd
+import sqlalchemy
+
+from reconcile import (
+    FLD_OBJECT_ID,
+    FLD_SALESFORCE_ID,
+    bucket_of,
+    differing_buckets,
+    dnswatch_bucket_ids,
+    dnswatch_digests,
+    salesforce_digests,
+)
+
+BUCKETS = 16
+ROWS = [(str(i), f"a0B{i:015d}") for i in range(1, 200)]
+
+
+def _projection(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=[FLD_OBJECT_ID, FLD_SALESFORCE_ID])
+
+
+def test_digests_do_not_depend_on_row_order():
+    _, digests = salesforce_digests(_projection(ROWS), buckets=BUCKETS)
+    _, reversed_digests = salesforce_digests(_projection(ROWS[::-1]), buckets=BUCKETS)
+    assert digests == reversed_digests
+    assert sum([rows for rows, _ in digests.values()]) == len(ROWS)
+
+
+def test_changed_row_shows_in_its_bucket_only():
+    changed = list(ROWS)
+    changed[10] = (changed[10][0], "a0BCHANGED")
+    _, digests = salesforce_digests(_projection(ROWS), buckets=BUCKETS)
+    _, changed_digests = salesforce_digests(_projection(changed), buckets=BUCKETS)
+    assert differing_buckets(digests, changed_digests) == [
+        bucket_of(ROWS[10][0], BUCKETS)
+    ]
+
+
+def test_buckets_held_on_one_side_only_differ():
+    assert differing_buckets({1: (1, 10), 2: (1, 20)}, {2: (1, 20), 3: (1, 30)}) == [
+        1,
+        3,
+    ]
+
+
+def test_sql_and_python_digests_match(database_url):
+    model = "domain"
+    engine = sqlalchemy.create_engine(database_url, poolclass=sqlalchemy.NullPool)
+    with engine.connect() as db_conn:
+        # temporary tables shadow the DNSWatch tables for this session only
+        db_conn.execute(
+            sqlalchemy.text(
+                "CREATE TEMPORARY TABLE django_content_type (id int, model text)"
+            )
+        )
+        db_conn.execute(
+            sqlalchemy.text(
+                "CREATE TEMPORARY TABLE salesforce_salesforceobject "
+                "(id serial, object_id int, salesforce_id text, content_type_id int)"
+            )
+        )
+        db_conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO django_content_type VALUES (1, :model), (2, 'organisation')"
+            ),
+            {"model": model},
+        )
+        db_conn.execute(
+            sqlalchemy.text(
+                "INSERT INTO salesforce_salesforceobject "
+                "(object_id, salesforce_id, content_type_id) "
+                "VALUES (:object_id, :salesforce_id, :content_type_id)"
+            ),
+            [
+                {"object_id": int(o), "salesforce_id": s, "content_type_id": 1}
+                for o, s in ROWS
+            ]
+            # another model's rows are not part of the digest
+            + [{"object_id": 1, "salesforce_id": "other", "content_type_id": 2}],
+        )
+
+        _, digests = salesforce_digests(_projection(ROWS), buckets=BUCKETS)
+        assert dnswatch_digests(db_conn, model=model, buckets=BUCKETS) == digests
+
+        bucket = bucket_of(ROWS[0][0], BUCKETS)
+        assert dnswatch_bucket_ids(
+            db_conn, model=model, buckets=BUCKETS, bucket_list=[bucket]
+        ) == {o for o, _ in ROWS if bucket_of(o, BUCKETS) == bucket}
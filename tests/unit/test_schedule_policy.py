@@ -0,0 +1,65 @@
+import pytest
+
+from schedule_policy import BUSY_RECORDS, next_interval_minutes, runs_from_stats
+
+MIN_MINUTES = 5
+MAX_MINUTES = 60
+
+
+def _runs(minutes_apart: int, records: int):
+    return [(0.0, 0), (minutes_apart * 60.0, records)]
+
+
+def test_no_runs_waits_the_longest():
+    assert next_interval_minutes([], MIN_MINUTES, MAX_MINUTES) == MAX_MINUTES
+
+
+def test_one_run_starts_from_the_longest():
+    assert next_interval_minutes([(0.0, 10)], MIN_MINUTES, MAX_MINUTES) == MAX_MINUTES
+
+
+@pytest.mark.parametrize(
+    "records,minutes",
+    [(BUSY_RECORDS, 10), (BUSY_RECORDS - 1, 20), (0, 40)],
+)
+def test_interval_follows_change_volume(records, minutes):
+    # halved after a busy run, kept after some changes and doubled after none
+    assert (
+        next_interval_minutes(_runs(20, records), MIN_MINUTES, MAX_MINUTES) == minutes
+    )
+
+
+@pytest.mark.parametrize(
+    "minutes_apart,records,minutes",
+    [(6, BUSY_RECORDS, MIN_MINUTES), (40, 0, MAX_MINUTES)],
+)
+def test_interval_is_bounded(minutes_apart, records, minutes):
+    assert (
+        next_interval_minutes(_runs(minutes_apart, records), MIN_MINUTES, MAX_MINUTES)
+        == minutes
+    )
+
+
+def test_busy_records_can_be_set():
+    runs = _runs(20, 10)
+    assert next_interval_minutes(runs, MIN_MINUTES, MAX_MINUTES, busy_records=10) == 10
+
+
+def test_runs_from_stats_sums_entities_oldest_first():
+    items = [("200.0", 3, None), ("100.0", 1, None), ("200.0", 4, None)]
+    items += [("100.0", 2, None)]
+    assert runs_from_stats(items) == [(100.0, 3), (200.0, 7)]
+
+
+def test_runs_from_stats_sums_the_orgs_of_an_execution():
+    # each org extracts at its own time, seconds apart
+    items = [("100.0", 1, "run-1"), ("104.0", 2, "run-1"), ("102.0", 3, "run-1")]
+    items += [("1300.0", 4, "run-2"), ("1301.0", 5, "run-2")]
+    runs = runs_from_stats(items)
+    assert runs == [(100.0, 6), (1300.0, 9)]
+    # so the interval is measured between executions, not between orgs
+    assert next_interval_minutes(runs, MIN_MINUTES, MAX_MINUTES) == 20
+
+
+def test_runs_from_stats_empty():
+    assert runs_from_stats([]) == []
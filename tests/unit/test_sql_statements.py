@@ -0,0 +1,69 @@
+import pytest
+
+from sql_statements import (
+    STMT_DUPLICATES,
+    STMT_INSERT,
+    STMT_MATCHED,
+    STMT_NULL,
+    STMT_UPDATE,
+    TEMP_TABLE,
+    compile_cache_info,
+    compile_upsert_statements,
+)
+
+
+def _compile(**kwargs):
+    return compile_upsert_statements(
+        **(
+            {
+                "upsert_object": "organisation",
+                "fields_to_join": ["id"],
+                "fields_to_update": ["salesforce_id"],
+                "fields_to_null": ["salesforce_id"],
+            }
+            | kwargs
+        )
+    )
+
+
+def test_compiled_statements():
+    statements = _compile()
+    assert statements[STMT_UPDATE] == (
+        f"UPDATE organisation uo SET salesforce_id=tt.salesforce_id FROM {TEMP_TABLE} "
+        "tt WHERE uo.id=tt.id and (uo.salesforce_id is distinct from tt.salesforce_id)"
+    )
+    assert statements[STMT_MATCHED] == (
+        f"SELECT count(*) FROM organisation uo JOIN {TEMP_TABLE} tt ON uo.id=tt.id"
+    )
+    assert statements[STMT_DUPLICATES] == (
+        f"SELECT count(*) - count(DISTINCT (id)) FROM {TEMP_TABLE}"
+    )
+    assert statements[STMT_INSERT] == (
+        "INSERT INTO organisation(id,salesforce_id) SELECT tt.id,tt.salesforce_id "
+        f"FROM {TEMP_TABLE} tt WHERE tt.id is null"
+    )
+    assert statements[STMT_NULL] == (
+        "UPDATE organisation uo SET salesforce_id=null WHERE salesforce_id is not null"
+    )
+
+
+def test_statements_are_compiled_once():
+    first = _compile(upsert_object="domain")
+    hits = compile_cache_info()["hits"]
+    assert _compile(upsert_object="domain") is first
+    assert compile_cache_info()["hits"] == hits + 1
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"upsert_object": "auth_user"},
+        {"fields_to_update": ["name"]},
+        {"fields_to_join": ["id; DROP TABLE organisation"]},
+        # allowed for domain only
+        {"fields_to_null": ["salesforce_organisation_id"]},
+    ],
+)
+def test_identifiers_outside_the_allow_list_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        _compile(**kwargs)
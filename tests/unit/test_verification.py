@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from verification import RunVerificationError, check_invariants
+
+
+def test_invariants_which_hold_pass():
+    check_invariants(label="file.csv", invariants=[("staged", 3, 3), ("dupes", 0, 0)])
+
+
+def test_violations_are_listed_as_json():
+    with pytest.raises(RunVerificationError) as e:
+        check_invariants(
+            label="file.csv",
+            invariants=[("staged", 3, 3), ("merged", 3, 2), ("dupes", 0, 1)],
+        )
+    assert json.loads(str(e.value)) == {
+        "file": "file.csv",
+        "violations": [
+            {"invariant": "merged", "expected": 3, "actual": 2},
+            {"invariant": "dupes", "expected": 0, "actual": 1},
+        ],
+    }
@@ -0,0 +1,94 @@
+"""
+Stand-in for the salesforce event relay when testing the change data capture path.
+
+Builds Account / Domain__c change events in the shape the EventBridge partner bus
+delivers them and either prints them or sends them to the change events SQS queue,
+which only accepts events from the partner bus through EventBridge itself:
+
+    python tools/cdc_event_producer.py --entity Account --record-id 001... --record-id 001...
+    python tools/cdc_event_producer.py --entity Domain__c --record-id a0B... --queue-url https://sqs...
+"""
+import argparse
+import datetime
+import json
+import uuid
+from typing import Any, Dict, List
+
+DETAIL_TYPES = {
+    "Account": "AccountChangeEvent",
+    "Domain__c": "Domain__ChangeEvent",
+}
+CHANGE_TYPES = ["CREATE", "UPDATE", "DELETE", "UNDELETE", "GAP_OVERFLOW"]
+# SQS send_message_batch limit
+SQS_BATCH = 10
+
+
+def change_event(
+    entity: str, record_ids: List[str], change_type: str, org_id: str
+) -> Dict[str, Any]:
+    now = datetime.datetime.now(datetime.UTC)
+    return {
+        "version": "0",
+        "id": str(uuid.uuid4()),
+        "detail-type": DETAIL_TYPES[entity],
+        "source": f"aws.partner/salesforce.com/{org_id}/stand-in",
+        "time": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "detail": {
+            "payload": {
+                "ChangeEventHeader": {
+                    "entityName": entity,
+                    "recordIds": record_ids,
+                    "changeType": change_type,
+                    "changeOrigin": "cdc_event_producer",
+                    "transactionKey": str(uuid.uuid4()),
+                    "commitTimestamp": int(now.timestamp() * 1000),
+                },
+            },
+            "schemaId": "stand-in",
+            "id": str(uuid.uuid4()),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--entity", choices=list(DETAIL_TYPES.keys()), required=True)
+    parser.add_argument("--record-id", action="append", default=[], dest="record_ids")
+    parser.add_argument("--change-type", choices=CHANGE_TYPES, default="UPDATE")
+    parser.add_argument(
+        "--events", type=int, default=1, help="Send the change this many times"
+    )
+    parser.add_argument("--org-id", default="00D000000000000")
+    parser.add_argument("--queue-url", help="Send to this queue rather than print")
+    args = parser.parse_args()
+
+    events = [
+        change_event(
+            entity=args.entity,
+            record_ids=args.record_ids,
+            change_type=args.change_type,
+            org_id=args.org_id,
+        )
+        for _ in range(args.events)
+    ]
+
+    if not args.queue_url:
+        print(json.dumps(events, indent=2))
+        return
+
+    import boto3
+
+    sqs_client = boto3.client("sqs")
+    for i in range(0, len(events), SQS_BATCH):
+        sqs_client.send_message_batch(
+            QueueUrl=args.queue_url,
+            Entries=[
+                {"Id": str(n), "MessageBody": json.dumps(e)}
+                for n, e in enumerate(events[i : i + SQS_BATCH])
+            ],
+        )
+    print(f"Sent {len(events)} events to {args.queue_url}")
+
+
+if __name__ == "__main__":
+    main()
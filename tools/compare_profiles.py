@@ -0,0 +1,114 @@
+"""
+Render or compare the profiles written by a profiled run (CDDO_PROFILE / "profile": true).
+
+A run is an s3 run prefix or a local directory holding the files of that prefix:
+
+    python tools/compare_profiles.py s3://bucket/profile/20240101T000000Z
+    python tools/compare_profiles.py s3://bucket/profile/<run a> s3://bucket/profile/<run b> \
+        --handler FinaliseSalesforceUpdate --top 20
+"""
+import argparse
+import os
+import pstats
+import tempfile
+import tracemalloc
+from typing import Dict, Tuple
+
+HANDLERS = ["GetSalesforceChanges", "FinaliseSalesforceUpdate"]
+PSTATS_SUFFIX = ".pstats"
+SNAPSHOT_SUFFIX = ".tracemalloc"
+
+
+def _fetch(run: str, handler: str, tmp: str) -> Tuple[str, str]:
+    """
+    Local paths of the pstats and tracemalloc snapshot of one handler in a run,
+    downloading them first when the run is in s3
+    """
+    files = [f"{handler}{PSTATS_SUFFIX}", f"{handler}{SNAPSHOT_SUFFIX}"]
+    if not run.startswith("s3://"):
+        return tuple([os.path.join(run, f) for f in files])
+
+    import boto3
+
+    bucket, _, prefix = run[len("s3://") :].partition("/")
+    s3_client = boto3.client("s3")
+    local = os.path.join(tmp, prefix.strip("/").replace("/", "_"))
+    os.makedirs(local, exist_ok=True)
+    for f in files:
+        s3_client.download_file(
+            bucket, f"{prefix.rstrip('/')}/{f}", os.path.join(local, f)
+        )
+    return tuple([os.path.join(local, f) for f in files])
+
+
+def _function_times(stats: pstats.Stats) -> Dict[str, Tuple[int, float, float]]:
+    # (calls, own time, cumulative time) keyed by file:line(function)
+    return {
+        f"{os.path.basename(file)}:{line}({function})": (nc, tt, ct)
+        for (file, line, function), (_, nc, tt, ct, _) in stats.stats.items()
+    }
+
+
+def render(pstats_path: str, snapshot_path: str, top: int) -> None:
+    pstats.Stats(pstats_path).sort_stats("cumulative").print_stats(top)
+
+    snapshot = tracemalloc.Snapshot.load(snapshot_path)
+    print(f"Top {top} allocations still held at the end of the handler")
+    for s in snapshot.statistics("lineno")[:top]:
+        print(s)
+
+
+def compare(
+    a: Tuple[str, str], b: Tuple[str, str], top: int, label_a: str, label_b: str
+) -> None:
+    times_a = _function_times(pstats.Stats(a[0]))
+    times_b = _function_times(pstats.Stats(b[0]))
+    total_a = max([ct for _, _, ct in times_a.values()], default=0)
+    total_b = max([ct for _, _, ct in times_b.values()], default=0)
+    print(f"Total time {total_a:.3f}s ({label_a}) -> {total_b:.3f}s ({label_b})")
+
+    deltas = sorted(
+        [
+            (
+                times_b.get(f, (0, 0.0, 0.0))[2] - times_a.get(f, (0, 0.0, 0.0))[2],
+                f,
+            )
+            for f in set(times_a) | set(times_b)
+        ],
+        key=lambda d: abs(d[0]),
+        reverse=True,
+    )
+    print(
+        f"\n{'cumulative a':>13} {'cumulative b':>13} {'delta':>10} {'calls b':>9}  function"
+    )
+    for delta, f in deltas[:top]:
+        ca = times_a.get(f, (0, 0.0, 0.0))
+        cb = times_b.get(f, (0, 0.0, 0.0))
+        print(f"{ca[2]:>13.3f} {cb[2]:>13.3f} {delta:>+10.3f} {cb[0]:>9}  {f}")
+
+    print(f"\nAllocation changes, {label_a} -> {label_b}")
+    snapshot_a = tracemalloc.Snapshot.load(a[1])
+    snapshot_b = tracemalloc.Snapshot.load(b[1])
+    for s in snapshot_b.compare_to(snapshot_a, "lineno")[:top]:
+        print(s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("run_a")
+    parser.add_argument("run_b", nargs="?")
+    parser.add_argument("--handler", choices=HANDLERS, default=HANDLERS[-1])
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        a = _fetch(run=args.run_a, handler=args.handler, tmp=tmp)
+        if args.run_b is None:
+            render(pstats_path=a[0], snapshot_path=a[1], top=args.top)
+            return
+        b = _fetch(run=args.run_b, handler=args.handler, tmp=tmp)
+        compare(a=a, b=b, top=args.top, label_a=args.run_a, label_b=args.run_b)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Stand-in for the DNSWatch bulk APIs the "api" sink posts to, for testing the sink and
+measuring its throughput without a DNSWatch deployment.
+
+Serve the stub, with optional latency and injected transient failures, and point
+CDDO_DNSWATCH_API_URL at it, with CDDO_DNSWATCH_API_MODEL_PATH and
+CDDO_DNSWATCH_API_LOOKUP_PATH set to the paths it serves (--model-path, --lookup-path):
+
+    python tools/stub_dnswatch.py serve --port 8000 --latency-ms 20 --failure-rate 0.05
+
+or run the sink against an in-process stub over a grid of batch sizes and concurrency:
+
+    python tools/stub_dnswatch.py bench --rows 100000 --batch-size 200 --batch-size 1000 \
+        --concurrency 1 --concurrency 8 --latency-ms 20
+"""
+import argparse
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict
+
+# paths served when --model-path and --lookup-path are not given
+MODEL_PATH = "/api/salesforce/{model}/bulk-update/"
+LOOKUP_PATH = "/api/salesforce/salesforce-objects/bulk-upsert/"
+MODELS = ["organisation", "domain"]
+
+
+class StubDNSWatch(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency_ms: float,
+        failure_rate: float,
+        model_path: str = MODEL_PATH,
+        lookup_path: str = LOOKUP_PATH,
+    ):
+        super().__init__(address, StubHandler)
+        self.model_path = model_path
+        self.lookup_path = lookup_path
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "failures": 0, "rows": 0, "max_in_flight": 0}
+        self.in_flight = 0
+        # object_id -> salesforce_id per model, so upserts report inserts and updates
+        self.objects: Dict[str, Dict[Any, Any]] = {m: dict() for m in MODELS}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _apply(self, records) -> Dict[str, int]:
+        server = self.server
+        if self.path == server.lookup_path:
+            inserted = updated = 0
+            with server.lock:
+                for r in records:
+                    objects = server.objects.setdefault(r["model"], dict())
+                    if r["object_id"] not in objects:
+                        inserted += 1
+                    elif objects[r["object_id"]] != r["salesforce_id"]:
+                        updated += 1
+                    objects[r["object_id"]] = r["salesforce_id"]
+            return {"inserted": inserted, "updated": updated}
+
+        for model in MODELS:
+            if self.path == server.model_path.format(model=model):
+                return {"updated": len(records)}
+        return None
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.counts["requests"] += 1
+            server.in_flight += 1
+            server.counts["max_in_flight"] = max(
+                server.counts["max_in_flight"], server.in_flight
+            )
+        try:
+            time.sleep(server.latency_ms / 1000)
+            if random.random() < server.failure_rate:
+                with server.lock:
+                    server.counts["failures"] += 1
+                self._reply(503, {"detail": "injected failure"})
+                return
+
+            records = json.loads(body)["records"]
+            result = self._apply(records)
+            if result is None:
+                self._reply(404, {"detail": f"no endpoint {self.path}"})
+                return
+            with server.lock:
+                server.counts["rows"] += len(records)
+            self._reply(200, result)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def start_stub(
+    port: int,
+    latency_ms: float,
+    failure_rate: float,
+    model_path: str = MODEL_PATH,
+    lookup_path: str = LOOKUP_PATH,
+) -> StubDNSWatch:
+    server = StubDNSWatch(
+        ("127.0.0.1", port), latency_ms, failure_rate, model_path, lookup_path
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench(args) -> None:
+    # the sink's module level clients need a region, although nothing here calls AWS
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    sys.path.insert(
+        0,
+        os.path.join(
+            os.path.dirname(__file__), "..", "stacks", "state_machine", "lambdas"
+        ),
+    )
+    import pandas as pd
+    from sinks import create_session, send_frames
+
+    server = start_stub(
+        port=args.port,
+        latency_ms=args.latency_ms,
+        failure_rate=args.failure_rate,
+        model_path=args.model_path,
+        lookup_path=args.lookup_path,
+    )
+    url = f"http://127.0.0.1:{server.server_address[1]}{args.lookup_path}"
+    frames = [
+        pd.DataFrame(
+            {
+                "object_id": range(start, min(start + args.frame_rows, args.rows)),
+                "salesforce_id": [
+                    f"a0B{i:015d}"
+                    for i in range(start, min(start + args.frame_rows, args.rows))
+                ],
+                "model": "domain",
+            }
+        )
+        for start in range(0, args.rows, args.frame_rows)
+    ]
+
+    print(
+        f"{'batch size':>10} {'concurrency':>11} {'rows/s':>10} {'seconds':>8} "
+        f"{'retries':>7} {'max in flight':>13}"
+    )
+    for batch_size in args.batch_size or [500]:
+        for concurrency in args.concurrency or [4]:
+            with server.lock:
+                server.counts["max_in_flight"] = 0
+                server.objects = {m: dict() for m in MODELS}
+            with create_session(concurrency=concurrency) as session:
+                stats = send_frames(
+                    session=session,
+                    url=url,
+                    frames=iter(frames),
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                    retries=args.retries,
+                )
+            print(
+                f"{batch_size:>10} {concurrency:>11} {stats['rows_per_second']:>10} "
+                f"{stats['seconds']:>8} {stats['retries']:>7} "
+                f"{server.counts['max_in_flight']:>13}"
+            )
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("mode", choices=["serve", "bench"])
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--frame-rows", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, action="append")
+    parser.add_argument("--concurrency", type=int, action="append")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--lookup-path", default=LOOKUP_PATH)
+    args = parser.parse_args()
+
+    if args.mode == "bench":
+        bench(args)
+        return
+
+    server = StubDNSWatch(
+        ("127.0.0.1", args.port or 8000),
+        args.latency_ms,
+        args.failure_rate,
+        args.model_path,
+        args.lookup_path,
+    )
+    print(f"Stub DNSWatch on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.counts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Synthesize the ToDNSWatch stack offline, without AWS credentials, and time it.
+
+The profile context is pre-seeded with stand-in ids, the VPC lookup is answered from a
+seeded vpc-provider context entry and the layer zips are referenced in a stand-in
+layer bucket, which synthesis never reads. Run every variant, or only some, a few times:
+
+    python tools/synth_offline.py --runs 3
+    python tools/synth_offline.py --variant default --variant fargate --max-seconds 30
+
+tests/unit/test_domains_salesforce_to_dnswatch_stack.py synthesizes through the same
+harness to assert the settings runs depend on.
+"""
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+OFFLINE_ACCOUNT = "123456789012"
+OFFLINE_REGION = "eu-west-2"
+# the layer bucket is the layer bucket root followed by the profile
+OFFLINE_PROFILE = "offline"
+OFFLINE_BUCKET = "offline-updates-from-salesforce"
+OFFLINE_VPC_ID = "vpc-0123456789abcdef0"
+OFFLINE_SUBNETS = [
+    ("subnet-0123456789abcdef1", "10.0.1.0/24", "eu-west-2a"),
+    ("subnet-0123456789abcdef2", "10.0.2.0/24", "eu-west-2b"),
+]
+
+# profile context of a minimal deployment - the keys app.py reads from cdk.context.json
+OFFLINE_CONTEXT = {
+    "consumerKey": "offline-consumer-key",
+    "consumerSecret": "offline-consumer-secret",
+    "domain": "offline.my.salesforce.com",
+    "VpcId": OFFLINE_VPC_ID,
+    "BastionHostSG": "sg-0123456789abcdef0",
+    "PrivateSubnetId1": OFFLINE_SUBNETS[0][0],
+    "PrivateSubnetId2": OFFLINE_SUBNETS[1][0],
+    "RdsSecretName": "offline-rds-secret",
+}
+OFFLINE_SCHEDULE_EXPRESSION = "rate(1 hour)"
+
+# profile context added to the minimal deployment for each optional feature
+VARIANTS = {
+    "default": {},
+    "fargate": {"fargateRunner": True},
+    "orgs": {
+        "salesforceOrgs": [
+            {
+                "name": "sandbox",
+                "consumerKey": "offline-sandbox-key",
+                "consumerSecret": "offline-sandbox-secret",
+                "domain": "offline--sandbox.my.salesforce.com",
+            }
+        ]
+    },
+    "cdc": {"cdcEventBusName": "aws.partner/salesforce.com/offline/0"},
+    "api": {
+        "dnswatchSink": "api",
+        "dnswatchApiUrl": "https://dnswatch.offline",
+        "dnswatchApiModelPath": "api/{model}/bulk-update/",
+        "dnswatchApiLookupPath": "api/salesforce-objects/bulk-upsert/",
+        "dnswatchApiTokenSecretName": "offline-dnswatch-api-token",
+    },
+    "rdsProxy": {
+        "RdsProxy": True,
+        "RdsInstanceId": "offline-dnswatch",
+        "RdsEndpoint": "offline-dnswatch.eu-west-2.rds.amazonaws.com",
+    },
+}
+
+
+def vpc_lookup_context(
+    vpc_id: str = OFFLINE_VPC_ID,
+    account: str = OFFLINE_ACCOUNT,
+    region: str = OFFLINE_REGION,
+) -> Dict[str, Any]:
+    """
+    The cdk.context.json entry a real Vpc.from_lookup would have cached, so the lookup
+    is answered without calling EC2
+    """
+    key = (
+        f"vpc-provider:account={account}:filter.vpc-id={vpc_id}:region={region}"
+        ":returnAsymmetricSubnets=true"
+    )
+    return {
+        key: {
+            "vpcId": vpc_id,
+            "vpcCidrBlock": "10.0.0.0/16",
+            "ownerAccountId": account,
+            "availabilityZones": [],
+            "subnetGroups": [
+                {
+                    "name": "Private",
+                    "type": "Private",
+                    "subnets": [
+                        {
+                            "subnetId": subnet_id,
+                            "cidr": cidr,
+                            "availabilityZone": az,
+                            "routeTableId": f"rtb-{subnet_id[len('subnet-'):]}",
+                        }
+                        for subnet_id, cidr, az in OFFLINE_SUBNETS
+                    ],
+                }
+            ],
+        }
+    }
+
+
+def app_context(profile_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Everything the cdk cli would pass as context - the cdk.json feature flags, the
+    seeded lookup and the offline profile with profile_context added to it
+    """
+    with open(os.path.join(ROOT, "cdk.json")) as f:
+        context = json.load(f)["context"]
+
+    context |= vpc_lookup_context()
+    context |= {
+        "profile": OFFLINE_PROFILE,
+        "scheduleExpression": OFFLINE_SCHEDULE_EXPRESSION,
+        OFFLINE_PROFILE: copy.deepcopy(OFFLINE_CONTEXT) | (profile_context or {}),
+    }
+    return context
+
+
+def synth_offline(
+    profile_context: Optional[Dict[str, Any]] = None
+) -> Tuple[Any, float]:
+    """
+    Synthesize ToDNSWatch as app.py does with the offline context. Returns an
+    assertions.Template of the stack and the seconds synthesis took. Raises
+    ValueError if the stack asked for context which was not seeded, as it would
+    otherwise be synthesized against dummy lookup values
+    """
+    import aws_cdk as cdk
+    from aws_cdk.assertions import Template
+
+    from stacks.to_dnswatch import ToDNSWatch
+
+    context = app_context(profile_context=profile_context)
+
+    start = time.perf_counter()
+    app = cdk.App(context=context)
+    stack = ToDNSWatch(
+        app,
+        "ToDNSWatch",
+        context=context[OFFLINE_PROFILE],
+        from_salesforce_bucket_name=OFFLINE_BUCKET,
+        env=cdk.Environment(account=OFFLINE_ACCOUNT, region=OFFLINE_REGION),
+    )
+    assembly = app.synth()
+    seconds = time.perf_counter() - start
+
+    missing = assembly.manifest.missing or []
+    if missing:
+        raise ValueError(
+            f"Synthesis needs context which is not seeded: {[m.key for m in missing]}"
+        )
+
+    template = Template.from_json(
+        assembly.get_stack_artifact(stack.artifact_id).template
+    )
+    return template, seconds
+
+
+def bench(variants: List[str], runs: int) -> Dict[str, Dict[str, Any]]:
+    results = dict()
+    for variant in variants:
+        timings = []
+        for _ in range(runs):
+            template, seconds = synth_offline(profile_context=VARIANTS[variant])
+            timings.append(seconds)
+        results[variant] = {
+            "resources": len(template.to_json()["Resources"]),
+            "mean": round(statistics.mean(timings), 3),
+            "max": round(max(timings), 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--variant", choices=list(VARIANTS), action="append")
+    parser.add_argument("--runs", type=int, default=1)
+    # fail, for CI, when a variant's mean synthesis time is over this
+    parser.add_argument("--max-seconds", type=float)
+    args = parser.parse_args()
+
+    # the cdk cli runs app.py from the project root
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    # jsii starts its node process on the first import, so it is timed on its own
+    start = time.perf_counter()
+    import aws_cdk  # noqa: F401
+
+    print(f"Imported aws_cdk in {time.perf_counter() - start:.3f}s")
+
+    results = bench(variants=args.variant or list(VARIANTS), runs=args.runs)
+
+    print(f"{'variant':>10} {'resources':>9} {'mean s':>8} {'max s':>8}")
+    for variant, r in results.items():
+        print(f"{variant:>10} {r['resources']:>9} {r['mean']:>8} {r['max']:>8}")
+
+    slow = [
+        v
+        for v, r in results.items()
+        if args.max_seconds is not None and r["mean"] > args.max_seconds
+    ]
+    if slow:
+        print(f"Synthesis slower than {args.max_seconds}s: {', '.join(slow)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()